@@ -0,0 +1,70 @@
+"""
+Compares fixed rate polling with an AdaptivePollPolicy over a whole
+discharge, using a simulated CBA4 whose battery runs SPEED times faster than
+real time, so a one hour discharge takes seconds and no hardware is needed.
+
+Half way through the load is stepped up, and the discharge runs on to the
+stop voltage through the knee of the curve.  For each policy it reports the
+number of samples (USB transactions), and the largest voltage step between
+consecutive samples on the plateau and in the knee, which is how much of the
+curve could be missed between samples.  The voltage readings flicker by up
+to NOISE volts, like those of a real CBA.
+
+It then polls a CBA whose battery isn't changing for STEADY seconds in real
+time, and reports the samples taken and the interval the policy settled on:
+the flicker alone shouldn't keep it polling fast.
+"""
+
+from wmr_cba import wmr_cba
+from wmr_cba import simulator
+import time
+
+SPEED = 40.0
+NOISE = 0.001
+STEADY = 10.0
+
+def bench(name, policy, amps=2.0, step_amps=3.0, vstop=11.0):
+    t0 = time.monotonic()
+    sim = simulator.SimulatedCBA4(watchdog=3.0 * SPEED, clock=lambda: t0 + ((time.monotonic() - t0) * SPEED), noise=NOISE)
+    cba = wmr_cba.CBA4(interface=sim)
+    cba.set_poll_policy(policy)
+    samples = []
+    cba.add_listener(samples.append)
+    cba.do_start(amps, vstop)
+    stepped = False
+    while cba.is_running():
+        time.sleep(0.05)
+        if not stepped and sim.get_capacity_used() > 0.8:
+            cba.set_load(step_amps)
+            stepped = True
+    cba.close()
+    running = [s for s in samples if s.is_running()]
+    knee_start = running[-1].voltage + 0.5
+    # leave out the load step itself, only the shape of the curve matters
+    steps = [(a, b) for a, b in zip(running, running[1:]) if a.set_current == b.set_current]
+    plateau = [abs(b.voltage - a.voltage) for a, b in steps if a.voltage > knee_start]
+    knee = [abs(b.voltage - a.voltage) for a, b in steps if a.voltage <= knee_start]
+    print(("%-9s" % name) + " " + ("%5d" % len(samples)) + " samples, " + ("%4d" % len(knee)) + " in the knee, largest step on plateau " +
+        ("%6.1f" % (1000.0 * max(plateau or [0]))) + "mV, in knee " + ("%6.1f" % (1000.0 * max(knee or [0]))) + "mV")
+    #end bench()
+
+def bench_steady(name, policy):
+    sim = simulator.SimulatedCBA4(noise=NOISE)
+    cba = wmr_cba.CBA4(interface=sim)
+    cba.set_poll_policy(policy)
+    samples = []
+    cba.add_listener(samples.append)
+    # a tiny load, so the battery stays put
+    cba.do_start(0.001, 0)
+    time.sleep(STEADY)
+    cba.close()
+    print(("%-9s" % name) + " " + ("%5d" % len(samples)) + " samples in " + ("%.0f" % STEADY) + "s steady, interval " +
+        ("%.2f" % policy.get_stats()["interval"]) + "s")
+    #end bench_steady()
+
+if __name__ == "__main__":
+    dvdt = 0.002 * SPEED
+    bench("20Hz", wmr_cba.AdaptivePollPolicy(0.05, 0.05))
+    bench("default", None)
+    bench("adaptive", wmr_cba.AdaptivePollPolicy(0.05, 0.75, dvdt=dvdt))
+    bench_steady("adaptive", wmr_cba.AdaptivePollPolicy(0.05, 0.75))
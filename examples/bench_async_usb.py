@@ -0,0 +1,53 @@
+"""
+Compares the status rate and round trip time of the pyusb backend
+(MpOrLibUsb, a blocking read after each write) and the asynchronous libusb
+backend (wmr_cba.libusb_async.AsyncLibUsb, several reads always queued),
+polling every connected CBA as fast as it will go, one thread per CBA.
+
+Needs real CBAs, and python-libusb1 ('pip install libusb1') for the
+asynchronous backend.
+"""
+
+from wmr_cba import wmr_cba
+from wmr_cba import libusb_async
+import threading
+import time
+
+def bench(name, interfaces, seconds=5.0):
+    devices = [wmr_cba.CBA4(interface=usb_if) for usb_if in interfaces]
+    devices = [cba for cba in devices if cba.get_serial_number()]
+    if not devices:
+        print(name + ": no CBAs found")
+        return
+    rtts = [[] for cba in devices]
+    stop = threading.Event()
+    def sample(i, cba):
+        while not stop.is_set():
+            status = cba.get_status(max_age=0)
+            if status:
+                rtts[i].append(status.rtt)
+    threads = [threading.Thread(target=sample, args=(i, cba)) for i, cba in enumerate(devices)]
+    t_start = time.perf_counter()
+    for t in threads:
+        t.start()
+    time.sleep(seconds)
+    stop.set()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - t_start
+    for cba in devices:
+        cba.close()
+    all_rtts = sorted(rtt for r in rtts for rtt in r)
+    if not all_rtts:
+        print(name + ": no status heard")
+        return
+    p50 = all_rtts[len(all_rtts) // 2]
+    p99 = all_rtts[min(int(len(all_rtts) * 0.99), len(all_rtts) - 1)]
+    print(("%-6s" % name) + " " + ("%2d" % len(devices)) + " CBAs: " + ("%8.1f" % (len(all_rtts) / elapsed)) +
+        " samples/s total, rtt p50 " + ("%6.2f" % (1000.0 * p50)) + "ms, p99 " + ("%6.2f" % (1000.0 * p99)) + "ms")
+    #end bench()
+
+if __name__ == "__main__":
+    bench("pyusb", wmr_cba.MpOrLibUsb.open_all())
+    for num_transfers in [1, 2, 4, 8]:
+        bench("async" + str(num_transfers), libusb_async.AsyncLibUsb.open_all(num_transfers=num_transfers))
@@ -0,0 +1,52 @@
+"""
+Measures the overhead of the wmr_cba Prometheus/OpenMetrics exporter, using
+simulated CBA4s so no hardware is needed.
+
+Reports how long a refresh of every CBA takes, and how long a scrape takes
+both directly and over HTTP.  Scrapes are served from the cached metrics, so
+their cost should not depend on the number of CBAs or cause any USB traffic.
+"""
+
+from wmr_cba import wmr_cba
+from wmr_cba import simulator
+from wmr_cba import exporter
+import time
+import urllib.request
+
+def bench_exporter(num_devices=16, scrapes=1000, latency=0.001):
+    interfaces = [simulator.SimulatedCBA4(serial_number=1000+i, latency=latency) for i in range(num_devices)]
+    devices = [wmr_cba.CBA4(interface=i) for i in interfaces]
+
+    exp = exporter.CBA4Exporter(devices, refresh_interval=1.0)
+    server = exp.serve(0, "127.0.0.1")
+    port = server.server_address[1]
+
+    refreshes = 10
+    t = time.perf_counter()
+    for i in range(refreshes):
+        exp.refresh()
+    refresh = (time.perf_counter() - t) / refreshes
+    print(str(num_devices) + " CBAs, " + str(latency*1000) + "ms USB latency:")
+    print("  refresh: " + ("%.3f" % (refresh*1000)) + "ms (" + ("%.3f" % (refresh*1000/num_devices)) + "ms per CBA)")
+
+    t = time.perf_counter()
+    for i in range(scrapes):
+        exp.get_metrics()
+    direct = (time.perf_counter() - t) / scrapes
+    print("  scrape, direct: " + ("%.1f" % (direct*1000*1000)) + "us")
+
+    url = "http://127.0.0.1:" + str(port) + "/metrics"
+    t = time.perf_counter()
+    for i in range(scrapes // 10):
+        urllib.request.urlopen(url).read()
+    http = (time.perf_counter() - t) / (scrapes // 10)
+    print("  scrape, HTTP: " + ("%.3f" % (http*1000)) + "ms")
+
+    exp.close()
+    for cba in devices:
+        cba.close()
+    #end bench_exporter()
+
+if __name__ == "__main__":
+    for n in [1, 4, 16, 32]:
+        bench_exporter(n)
@@ -0,0 +1,36 @@
+"""
+Measures how the status throughput of a CBAFleet scales as CBAs are added,
+using simulated CBA4s with a fixed USB round trip time, so no hardware is
+needed.
+
+For each fleet size every CBA runs a test and is polled as fast as the thread
+pool allows.  With a pool of 'max_workers' threads, throughput should grow
+with the number of CBAs until the pool is saturated.
+"""
+
+from wmr_cba import wmr_cba
+from wmr_cba import simulator
+from wmr_cba import fleet
+import time
+
+def bench_fleet(num_devices, max_workers=8, latency=0.004, seconds=3.0):
+    devices = [wmr_cba.CBA4(interface=simulator.SimulatedCBA4(serial_number=1000+i, latency=latency)) for i in range(num_devices)]
+    f = fleet.CBAFleet(devices, max_workers=max_workers, interval=0.001)
+    f.do_start(1.0)
+    f.read_samples()
+    time.sleep(seconds)
+    samples = f.read_samples()
+    stats = f.get_stats()
+    f.close()
+    for cba in devices:
+        cba.close()
+    total = sum(len(s) for s in samples.values())
+    slowest = min(len(s) for s in samples.values())
+    print(("%2d" % num_devices) + " CBAs: " + ("%7.1f" % (total / seconds)) + " samples/s total, " +
+        ("%6.1f" % (slowest / seconds)) + " samples/s slowest CBA, " +
+        str(stats["errors"]) + " errors")
+    #end bench_fleet()
+
+if __name__ == "__main__":
+    for n in [1, 2, 4, 8, 16, 32]:
+        bench_fleet(n)
@@ -0,0 +1,88 @@
+"""
+Runs a 30A test on one 12V battery with simulated CBAs, so no hardware is
+needed, comparing:
+
+single - one CBA, which is power limited well short of 30A.
+even - three CBAs in parallel (one derated to 90W), each set to 10A and
+polled by a SyncGroup, without rebalancing.
+gang - the same three CBAs as a wmr_cba.gang.GangedCBA4.
+
+Reports the mean total current drawn, how much of the test was power
+limited, and at the end of the discharge how long the CBAs kept running
+after the first one stopped at vstop (the battery voltage recovers a little
+when one stops, so without the gang stopping the others they carry on).
+The battery runs SPEED times faster than real time.
+"""
+
+from wmr_cba import wmr_cba
+from wmr_cba import simulator
+from wmr_cba import sync
+from wmr_cba import gang
+import time
+
+SPEED = 20.0
+AMPS = 30.0
+VSTOP = 11.2
+POWERS = [150.0, 150.0, 90.0]
+
+def make_devices(num_devices):
+    t0 = time.monotonic()
+    clock = lambda: t0 + ((time.monotonic() - t0) * SPEED)
+    battery = simulator.SimulatedBattery(capacity_ah=4.0, volts_full=13.4, volts_empty=10.5, resistance=0.01)
+    sims = [simulator.SimulatedCBA4(serial_number=1000+i, battery=battery, clock=clock, watchdog=3.0*SPEED,
+        max_power=POWERS[i]) for i in range(num_devices)]
+    return [wmr_cba.CBA4(interface=sim) for sim in sims], clock
+
+def run(mode):
+    devices, clock = make_devices(1 if mode == "single" else len(POWERS))
+    samples = []
+    stopped = {}
+    def track(serial, status, timestamp):
+        if (serial not in stopped) and not status.is_running():
+            stopped[serial] = timestamp
+    if mode == "gang":
+        g = gang.GangedCBA4(devices, interval=0.1)
+        def on_sample(sample):
+            samples.append(sample)
+            for serial, status in sample.units.items():
+                if status:
+                    track(serial, status, clock())
+        g.add_listener(on_sample)
+        g.do_start(AMPS, VSTOP)
+        while g.is_running():
+            time.sleep(0.1)
+        time.sleep(0.3)
+        stats = g.get_stats()
+        g.close()
+    else:
+        group = sync.SyncGroup(devices, interval=0.1)
+        def on_frame(frame):
+            s = gang.GangSample(frame, AMPS)
+            samples.append(s)
+            for serial, status in frame.statuses.items():
+                if status:
+                    track(serial, status, clock())
+        group.add_listener(on_frame)
+        group.do_start(AMPS / len(devices), VSTOP)
+        while len(stopped) < len(devices):
+            time.sleep(0.1)
+        stats = None
+        group.close()
+    for cba in devices:
+        cba.close()
+    running = [s for s in samples if s.is_running()]
+    mean_amps = sum(s.measured_current for s in running) / max(len(running), 1)
+    limited = sum(1 for s in running if s.is_power_limited()) / max(len(running), 1)
+    spread = (max(stopped.values()) - min(stopped.values())) if stopped else 0.0
+    line = ("%-6s" % mode) + ": mean " + ("%5.1f" % mean_amps) + "A of " + ("%.0f" % AMPS) + "A, " + \
+        ("%5.1f" % (100.0 * limited)) + "% power limited, last CBA stopped " + ("%6.1f" % spread) + \
+        "s (simulated) after the first"
+    if stats:
+        line += ", " + str(stats["rebalances"]) + " rebalances, shares " + \
+            ", ".join("%.1f" % a for a in stats["shares"].values()) + "A"
+    print(line)
+    #end run()
+
+if __name__ == "__main__":
+    for mode in ["single", "even", "gang"]:
+        run(mode)
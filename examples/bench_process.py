@@ -0,0 +1,114 @@
+"""
+Compares thread mode (CBA4 objects in this process) and process mode
+(wmr_cba.process.CBA4Process, one worker process per CBA), using simulated
+CBA4s with a fixed USB round trip time, so no hardware is needed.
+
+1. Sample rate scaling: every CBA is sampled as fast as it will go, while
+   this process also runs a CPU bound loop, like a busy control or logging
+   loop.  In thread mode the sampling threads fight that loop for the GIL.
+
+2. Keep-alive jitter: every CBA runs a test kept alive every 0.75s by its
+   keep-alive thread, while this process runs CPU bound threads.  Reports
+   how late the keep-alives are.
+
+The benefit of process mode depends on the number of CPU cores available,
+which is printed first.
+"""
+
+from wmr_cba import wmr_cba
+from wmr_cba import simulator
+from wmr_cba import process
+import functools
+import multiprocessing
+import threading
+import time
+
+LATENCY = 0.002
+
+def busy_loop(stop):
+    rx = bytearray(64)
+    rx[0] = 0x73
+    while not stop.is_set():
+        wmr_cba.CBA4Status(rx)
+    #end busy_loop()
+
+def open_devices(mode, num_devices, **kwargs):
+    if mode == "thread":
+        return [wmr_cba.CBA4(interface=simulator.SimulatedCBA4(serial_number=1000+i, latency=LATENCY)) for i in range(num_devices)]
+    factories = [functools.partial(simulator.SimulatedCBA4, serial_number=1000+i, latency=LATENCY) for i in range(num_devices)]
+    return [process.CBA4Process(interface_factory=f, **kwargs) for f in factories]
+    #end open_devices()
+
+def bench_rate(mode, num_devices, seconds=3.0, busy_threads=1):
+    stop = threading.Event()
+    counts = [0] * num_devices
+    if mode == "thread":
+        devices = open_devices(mode, num_devices)
+        def sample(i, cba):
+            while not stop.is_set():
+                if cba.get_status(max_age=0):
+                    counts[i] += 1
+        threads = [threading.Thread(target=sample, args=(i, cba)) for i, cba in enumerate(devices)]
+    else:
+        devices = open_devices(mode, num_devices, sample_interval=1e-6)
+        threads = []
+    threads += [threading.Thread(target=busy_loop, args=(stop,)) for i in range(busy_threads)]
+    for cba in devices:
+        if mode == "process":
+            cba.read_samples()
+    t_start = time.perf_counter()
+    for t in threads:
+        t.start()
+    time.sleep(seconds)
+    stop.set()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - t_start
+    if mode == "process":
+        counts = [len(cba.read_samples()) for cba in devices]
+    for cba in devices:
+        cba.close()
+    print(("%-7s" % mode) + " " + ("%2d" % num_devices) + " CBAs: " + ("%8.1f" % (sum(counts) / elapsed)) + " samples/s total")
+    #end bench_rate()
+
+def bench_jitter(mode, num_devices, seconds=10.0, busy_threads=4):
+    devices = open_devices(mode, num_devices)
+    times = dict((i, []) for i in range(num_devices))
+    for i, cba in enumerate(devices):
+        cba.add_listener(lambda status, i=i: times[i].append(status.timestamp))
+    stop = threading.Event()
+    threads = [threading.Thread(target=busy_loop, args=(stop,)) for i in range(busy_threads)]
+    for cba in devices:
+        cba.do_start(1.0)
+    for t in threads:
+        t.start()
+    time.sleep(seconds)
+    stop.set()
+    for t in threads:
+        t.join()
+    time.sleep(0.2)     # let the last batches arrive
+    for cba in devices:
+        cba.do_stop()
+        cba.close()
+    late = []
+    for i, ts in times.items():
+        for a, b in zip(ts[1:-2], ts[2:-1]):
+            late.append(b - a - 0.75)
+    late.sort()
+    if not late:
+        print(mode + ": no keep-alives heard")
+        return
+    p99 = late[min(int(len(late) * 0.99), len(late) - 1)]
+    print(("%-7s" % mode) + " " + ("%2d" % num_devices) + " CBAs: keep-alive late by mean " +
+        ("%6.2f" % (1000.0 * sum(late) / len(late))) + "ms, p99 " + ("%6.2f" % (1000.0 * p99)) +
+        "ms, max " + ("%6.2f" % (1000.0 * late[-1])) + "ms")
+    #end bench_jitter()
+
+if __name__ == "__main__":
+    print(str(multiprocessing.cpu_count()) + " CPUs")
+    for n in [1, 2, 4, 8]:
+        bench_rate("thread", n)
+        bench_rate("process", n)
+    for n in [4, 16]:
+        bench_jitter("thread", n)
+        bench_jitter("process", n)
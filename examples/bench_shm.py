@@ -0,0 +1,86 @@
+"""
+Measures the throughput of sharing samples with other processes through a
+shared memory ring (wmr_cba.shm), against pickling them over a
+multiprocessing.Queue per reader, as the number of reader processes grows.
+
+The publisher writes the same decoded status over and over, as fast as it
+can, so this measures the cost of sharing the samples, not of talking to a
+CBA.  A ring reader that falls a whole ring behind loses samples, which are
+counted, where a Queue makes the publisher do the work for every reader.
+"""
+
+from wmr_cba import wmr_cba
+from wmr_cba import shm
+import multiprocessing
+import time
+
+def make_status():
+    rx = bytearray(64)
+    rx[0] = 0x73
+    rx[1] = 0x02
+    rx[20:24] = (12345678).to_bytes(4, "little")
+    return wmr_cba.CBA4Status(rx, rtt=0.001)
+    #end make_status()
+
+def ring_reader(name, num_samples, results):
+    reader = shm.SampleReader(name, from_start=True)
+    read = 0
+    t_start = None
+    while (read + reader.get_lost()) < num_samples:
+        samples = reader.read(timeout=1.0)
+        if samples and t_start is None:
+            t_start = time.perf_counter()
+        read += len(samples)
+    elapsed = time.perf_counter() - (t_start if t_start else time.perf_counter())
+    results.put((read, reader.get_lost(), elapsed))
+    reader.close()
+    #end ring_reader()
+
+def queue_reader(q, num_samples, results):
+    read = 0
+    t_start = None
+    while read < num_samples:
+        q.get()
+        if t_start is None:
+            t_start = time.perf_counter()
+        read += 1
+    results.put((read, 0, time.perf_counter() - t_start))
+    #end queue_reader()
+
+def bench(kind, num_readers, num_samples=200000, num_slots=65536):
+    status = make_status()
+    results = multiprocessing.Queue()
+    if kind == "ring":
+        publisher = shm.SamplePublisher(num_slots=num_slots)
+        procs = [multiprocessing.Process(target=ring_reader, args=(publisher.get_name(), num_samples, results)) for i in range(num_readers)]
+        write = lambda: publisher.write(status, 1234)
+    else:
+        queues = [multiprocessing.Queue() for i in range(num_readers)]
+        procs = [multiprocessing.Process(target=queue_reader, args=(q, num_samples, results)) for q in queues]
+        def write():
+            for q in queues:
+                q.put(status)
+    for p in procs:
+        p.start()
+    time.sleep(0.5)
+    t_start = time.perf_counter()
+    for i in range(num_samples):
+        write()
+    published = time.perf_counter() - t_start
+    stats = [results.get() for p in procs]
+    for p in procs:
+        p.join()
+    if kind == "ring":
+        publisher.close()
+    read = sum(s[0] for s in stats)
+    lost = sum(s[1] for s in stats)
+    slowest = max(s[2] for s in stats)
+    print(("%-5s" % kind) + " " + str(num_readers) + " readers: publish " + ("%9.0f" % (num_samples / published)) +
+        " samples/s, read " + ("%9.0f" % (read / max(slowest, published))) + " samples/s total, " +
+        str(lost) + " lost")
+    #end bench()
+
+if __name__ == "__main__":
+    for n in [1, 2, 4]:
+        bench("ring", n)
+        bench("queue", n)
@@ -0,0 +1,81 @@
+"""
+Compares keeping every sample of a CBA and computing its statistics when
+asked (with the statistics module), against folding each sample into a
+wmr_cba.stats.StatsMonitor as it arrives, with all-time, 1 minute and 1 hour
+windows.
+
+Feeds the same synthetic status stream, 10 samples/s, to both, and reports
+the time per sample (after taking off the time to make the samples), the
+time a snapshot takes and the peak memory, as the stream grows.
+"""
+
+from wmr_cba import wmr_cba
+from wmr_cba import stats
+import statistics
+import time
+import tracemalloc
+
+def make_statuses(num_samples, t0=1.0e9):
+    rx = bytearray(64)
+    rx[0] = 0x73
+    for i in range(num_samples):
+        rx[1] = 0x12 if (i // 50) % 4 == 0 else 0x02
+        rx[16:20] = (2000000 + (i % 7) * 1000).to_bytes(4, "little")
+        rx[20:24] = (12600000 - (i // 10)).to_bytes(4, "little")
+        yield wmr_cba.CBA4Status(rx, timestamp=t0 + (i * 0.1))
+    #end make_statuses()
+
+def bench_store(num_samples):
+    samples = []
+    t = time.perf_counter()
+    for status in make_statuses(num_samples):
+        samples.append(status)
+    add = time.perf_counter() - t
+    t = time.perf_counter()
+    for get in (lambda s: s.voltage, lambda s: s.measured_current, lambda s: s.voltage * s.measured_current):
+        values = [get(s) for s in samples]
+        statistics.fmean(values), statistics.pstdev(values), min(values), max(values)
+    limited = sum(1 for s in samples if s.is_power_limited())
+    snap = time.perf_counter() - t
+    return add, snap
+    #end bench_store()
+
+def bench_monitor(num_samples):
+    monitor = stats.StatsMonitor(windows=[60, 3600])
+    t = time.perf_counter()
+    for status in make_statuses(num_samples):
+        monitor.add(status, 1234)
+    add = time.perf_counter() - t
+    t = time.perf_counter()
+    monitor.snapshot(now=1.0e9 + (num_samples * 0.1))
+    snap = time.perf_counter() - t
+    return add, snap
+    #end bench_monitor()
+
+def bench_generate(num_samples):
+    t = time.perf_counter()
+    for status in make_statuses(num_samples):
+        pass
+    return time.perf_counter() - t, 0.0
+    #end bench_generate()
+
+def peak_memory(bench, num_samples):
+    """
+    Runs 'bench' again under tracemalloc (which slows it down a lot), returns
+    the peak memory allocated.
+    """
+    tracemalloc.start()
+    bench(num_samples)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return peak
+    #end peak_memory()
+
+if __name__ == "__main__":
+    for n in [10000, 100000, 1000000]:
+        generate = bench_generate(n)[0]
+        for name, bench in [("store", bench_store), ("monitor", bench_monitor)]:
+            add, snap = bench(n)
+            peak = peak_memory(bench, n)
+            print(("%-7s" % name) + " " + ("%8d" % n) + " samples: " + ("%6.2f" % (1e6 * (add - generate) / n)) + "us/sample, snapshot " +
+                ("%8.2f" % (1000.0 * snap)) + "ms, peak memory " + ("%8.1f" % (peak / 1e6)) + "MB")
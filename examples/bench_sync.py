@@ -0,0 +1,104 @@
+"""
+Compares how far apart in time the samples of six simulated CBAs (no
+hardware needed, 2ms USB round trip) are when they are taken:
+
+keep-alive - by the thread of each CBA4 started by do_start(), which polls
+every CBA4.KEEP_ALIVE_INTERVAL seconds.
+own loop - by a thread per CBA calling get_status() every INTERVAL seconds.
+sync - by a wmr_cba.sync.SyncGroup with a tick of INTERVAL seconds.
+
+Every INTERVAL seconds the latest sample of every CBA is taken as a frame,
+and the skew (seconds between the earliest and latest sample of the frame)
+is reported, its mean, 95th percentile and maximum.  For the SyncGroup the
+frames are its own.  Without a SyncGroup the tests are started a random
+0-1s apart, like they would be by a program starting them in turn.
+"""
+
+from wmr_cba import wmr_cba
+from wmr_cba import simulator
+from wmr_cba import sync
+import random
+import threading
+import time
+
+NUM_DEVICES = 6
+INTERVAL = 0.1
+DURATION = 10.0
+LATENCY = 0.002
+MAX_START_GAP = 1.0
+
+def make_devices():
+    sims = [simulator.SimulatedCBA4(serial_number=1000+i, latency=LATENCY) for i in range(NUM_DEVICES)]
+    return [wmr_cba.CBA4(interface=sim) for sim in sims]
+
+def summary(skews):
+    skews = sorted(skews)
+    return sum(skews) / len(skews), skews[int(0.95 * (len(skews) - 1))], skews[-1]
+
+def sample_frames(devices, latest):
+    """
+    Every INTERVAL for DURATION, the skew of the latest sample of each CBA.
+    """
+    skews = []
+    t_end = time.monotonic() + DURATION
+    while time.monotonic() < t_end:
+        time.sleep(INTERVAL)
+        times = [s.timestamp for s in latest.values()]
+        if len(times) == len(devices):
+            skews.append(max(times) - min(times))
+    return skews
+
+def run_keep_alive():
+    devices = make_devices()
+    latest = {}
+    for cba in devices:
+        cba.add_listener(lambda status, serial=cba.get_serial_number(): latest.__setitem__(serial, status))
+        cba.do_start(2.0, 10.5)
+        time.sleep(random.uniform(0.0, MAX_START_GAP))
+    skews = sample_frames(devices, latest)
+    for cba in devices:
+        cba.close()
+    return skews
+
+def run_own_loop():
+    devices = make_devices()
+    latest = {}
+    running = [True]
+    def poll(cba):
+        while running[0]:
+            status = cba.get_status(max_age=0)
+            if status:
+                latest[cba.get_serial_number()] = status
+            time.sleep(INTERVAL)
+    threads = []
+    for cba in devices:
+        cba.do_start(2.0, 10.5, keep_alive=False)
+        threads.append(threading.Thread(target=poll, args=(cba,), daemon=True))
+        threads[-1].start()
+        time.sleep(random.uniform(0.0, MAX_START_GAP))
+    skews = sample_frames(devices, latest)
+    running[0] = False
+    for thread in threads:
+        thread.join()
+    for cba in devices:
+        cba.close()
+    return skews
+
+def run_sync():
+    devices = make_devices()
+    group = sync.SyncGroup(devices, interval=INTERVAL)
+    group.do_start(2.0, 10.5)
+    time.sleep(DURATION)
+    frames = group.read_frames()
+    group.close()
+    for cba in devices:
+        cba.close()
+    return [frame.skew for frame in frames if frame.is_complete()]
+
+if __name__ == "__main__":
+    random.seed(1)
+    for name, run in [("keep-alive", run_keep_alive), ("own loop", run_own_loop), ("sync", run_sync)]:
+        skews = run()
+        mean, p95, worst = summary(skews)
+        print(("%-10s" % name) + ": " + ("%4d" % len(skews)) + " frames, skew mean " + ("%7.2f" % (1000.0 * mean)) +
+            "ms, p95 " + ("%7.2f" % (1000.0 * p95)) + "ms, max " + ("%7.2f" % (1000.0 * worst)) + "ms")
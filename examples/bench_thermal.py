@@ -0,0 +1,92 @@
+"""
+Compares how many discharge tests a CBA completes in a day, with and without
+a ThermalManager, using a simulated CBA4 with a thermal model and a virtual
+clock, so a day runs in seconds and no hardware is needed.
+
+Each test discharges a fresh 2Ah battery at 11A (about 140W), which, with
+the fan off, heats the simulated CBA past its high temperature abort.
+Without thermal management, an aborted test is left to cool down for 10
+minutes, then carried on.  With a ThermalManager, the fan is run and the load
+derated before the CBA gets that hot.  Swapping batteries takes a minute.
+
+The ThermalManager's model of the CBA is only an estimate, so besides a
+simulated CBA matching the manager's defaults ('matched'), it's run on one
+that heats up faster ('hotter': ambient, thermal resistances +30%, heat
+capacity -30%) and one that heats up slower ('cooler': the other way
+round), against the baseline on the same CBA.
+"""
+
+from wmr_cba import wmr_cba
+from wmr_cba import simulator
+from wmr_cba import thermal
+
+# the ThermalManager's defaults, which it assumes whatever the CBA is really like
+MODEL = {"ambient": 25.0, "thermal_resistance": 0.5, "fan_thermal_resistance": 0.4, "heat_capacity": 300.0}
+
+def plant(error):
+    """
+    Thermal constants of a simulated CBA off from MODEL by 'error' (0.3 is
+    +30%), in the direction that makes it hotter.
+    """
+    return {
+        "ambient": MODEL["ambient"] * (1.0 + error),
+        "thermal_resistance": MODEL["thermal_resistance"] * (1.0 + error),
+        "fan_thermal_resistance": MODEL["fan_thermal_resistance"] * (1.0 + error),
+        "heat_capacity": MODEL["heat_capacity"] * (1.0 - error),
+    }
+
+def bench_thermal(name, managed, error=0.0, amps=11.0, vstop=11.0, seconds=24*3600, swap=60.0, cool_down=600.0):
+    now = [0.0]
+    clock = lambda: now[0]
+    sim = simulator.SimulatedCBA4(clock=clock, **plant(error))
+    cba = wmr_cba.CBA4(interface=sim)
+    manager = thermal.ThermalManager(cba, clock=clock) if managed else None
+    def start():
+        if manager:
+            manager.do_start(amps, vstop, keep_alive=False)
+        else:
+            cba.do_start(amps, vstop, keep_alive=False)
+    completed = 0
+    aborts = 0
+    max_temp = 0.0
+    resume_at = None
+    start()
+    while now[0] < seconds:
+        now[0] += 1.0
+        max_temp = max(max_temp, sim.get_temperature())
+        if resume_at is not None:
+            if now[0] >= resume_at:
+                resume_at = None
+                start()
+            else:
+                cba.get_status(max_age=0)
+            continue
+        status = cba.get_status(max_age=0)
+        if status.is_running():
+            continue
+        if status.is_high_temp():
+            if manager:
+                continue    # the manager restarts it once cooled down
+            # leave it to cool down, then carry on with the same battery
+            aborts += 1
+            resume_at = now[0] + cool_down
+            continue
+        # the battery is flat, swap in a fresh one
+        completed += 1
+        sim.recharge()
+        resume_at = now[0] + swap
+    stats = manager.get_stats() if manager else None
+    if manager:
+        manager.close()
+    cba.close()
+    print(("%-8s" % name) + (" managed  " if managed else " baseline ") + ("%3d" % completed) + " tests/day, " +
+        ("%3d" % (stats["aborts"] if stats else aborts)) + " high temp aborts, max " +
+        ("%.1f" % max_temp) + "C" +
+        ((", " + ("%.0f" % stats["time_derated"]) + "s derated, " + ("%.0f" % stats["time_paused"]) + "s paused, model rth x" + ("%.2f" % stats["rth_scale"])) if stats else ""))
+    return completed
+    #end bench_thermal()
+
+if __name__ == "__main__":
+    for name, error in [("matched", 0.0), ("hotter", 0.3), ("cooler", -0.3)]:
+        bench_thermal(name, False, error)
+        bench_thermal(name, True, error)
@@ -0,0 +1,61 @@
+"""
+Records a session with a simulated CBA4 (with a 2ms USB round trip) using
+wmr_cba.trace.RecordingUsb, then replays it with ReplayUsb: in real time,
+and as fast as possible with a StatsMonitor (wmr_cba.stats) decoding the
+samples, as a benchmark of the sampling pipeline would.
+
+Reports the cost of recording, the size of the trace, how closely the real
+time replay keeps to the recorded timing, the speed up of the fast replay,
+and checks that every replay sent exactly the recorded messages and decoded
+exactly the same statistics.
+"""
+
+from wmr_cba import wmr_cba
+from wmr_cba import simulator
+from wmr_cba import stats
+from wmr_cba import trace
+import os
+import tempfile
+import time
+
+LATENCY = 0.002
+NUM_SAMPLES = 2000
+
+def session(usb_if):
+    """
+    The session recorded and replayed: start a test, sample it, stop it.
+    Returns the StatsMonitor snapshot and how long it took.
+    """
+    t = time.perf_counter()
+    cba = wmr_cba.CBA4(interface=usb_if)
+    monitor = stats.StatsMonitor()
+    monitor.attach(cba)
+    cba.do_start(2.0, 10.5, keep_alive=False)
+    for i in range(NUM_SAMPLES):
+        cba.get_status(max_age=0)
+    cba.close()
+    elapsed = time.perf_counter() - t
+    snap = monitor.snapshot()[cba.get_serial_number()]["all"]
+    # the timestamps are when the samples were decoded, not recorded
+    for key in ["first", "last", "time_running", "time_power_limited", "power_limited_fraction"]:
+        snap.pop(key)
+    return snap, elapsed
+    #end session()
+
+if __name__ == "__main__":
+    path = os.path.join(tempfile.mkdtemp(), "session.cbat")
+    plain, plain_s = session(simulator.SimulatedCBA4(serial_number=1234, latency=LATENCY))
+    recorder = trace.RecordingUsb(simulator.SimulatedCBA4(serial_number=1234, latency=LATENCY), path)
+    recorded, recorded_s = session(recorder)
+    size = os.path.getsize(path)
+    print("record:   " + ("%6.3f" % recorded_s) + "s (" + ("%6.3f" % plain_s) + "s without recording), " +
+        str(recorder.get_records()) + " records, " + str(size) + " bytes, " +
+        ("%.1f" % (size / float(NUM_SAMPLES))) + " bytes/sample")
+    for name, realtime, speed in [("realtime", True, 1.0), ("10x", True, 10.0), ("fast", False, 1.0)]:
+        replay = trace.ReplayUsb(path, realtime=realtime, speed=speed)
+        replayed, replayed_s = session(replay)
+        s = replay.get_stats()
+        print(("%-9s" % (name + ":")) + " " + ("%6.3f" % replayed_s) + "s, " + ("%7.1f" % (recorded_s / replayed_s)) +
+            "x real time, " + ("%9.0f" % (NUM_SAMPLES / replayed_s)) + " samples/s, max lag " +
+            ("%6.3f" % (1000.0 * s["max_lag"])) + "ms, " + str(s["mismatches"]) + " mismatched writes, statistics " +
+            ("identical" if replayed == recorded else "DIFFERENT"))
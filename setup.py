@@ -15,7 +15,17 @@ setuptools.setup(
     install_requires=[
         'pyusb'
     ],
+    extras_require={
+        'parquet': ['pyarrow'],
+        'analysis': ['numpy'],
+        'async': ['libusb1'],
+    },
     packages=setuptools.find_packages(),
+    entry_points={
+        'console_scripts': [
+            'wmr-cba=wmr_cba.cli:main',
+        ],
+    },
     classifiers=[
         "Programming Language :: Python :: 3",
         "License :: OSI Approved :: MIT License",
@@ -0,0 +1,72 @@
+"""
+Tests of the discharge analysis, on synthetic discharges.
+"""
+
+import pytest
+numpy = pytest.importorskip("numpy")
+
+from wmr_cba import wmr_cba
+from wmr_cba import analysis
+from wmr_cba import writers
+
+RUNNING = 0x02
+POWER_LIMITED = 0x12
+
+def make_status(volts, timestamp, flags=RUNNING, amps=2.0, measured=None):
+    rx = bytearray(64)
+    rx[0] = 0x73
+    rx[1] = flags
+    rx[3:7] = int(amps * 1000000).to_bytes(4, "little")
+    rx[16:20] = int((amps if measured is None else measured) * 1000000).to_bytes(4, "little")
+    rx[20:24] = int(volts * 1000000).to_bytes(4, "little")
+    return wmr_cba.CBA4Status(rx, timestamp=timestamp)
+
+def make_discharge(periods, dt=10.0):
+    """
+    Samples every 'dt' seconds, 'periods' is a list of (seconds, flags).
+    """
+    samples = []
+    t = 0.0
+    for seconds, flags in periods:
+        for i in range(int(seconds / dt)):
+            samples.append(make_status(12.0, t, flags))
+            t += dt
+    return samples
+
+def test_capacity_and_energy():
+    curve = analysis.DischargeCurve.from_samples(make_discharge([(3610.0, RUNNING)]))
+    assert curve.get_total_capacity() == pytest.approx(2.0)
+    assert curve.get_total_energy() == pytest.approx(24.0)
+    assert curve.get_average_voltage() == pytest.approx(12.0)
+
+def test_pause_not_integrated():
+    # an hour at 2A, a paused hour (the set current is still 2A), and
+    # another hour at 2A is 4Ah, not 6Ah
+    samples = make_discharge([(3600.0, RUNNING), (3600.0, 0x00), (3610.0, RUNNING)])
+    for running_only in (True, False):
+        curve = analysis.DischargeCurve.from_samples(samples, running_only)
+        assert curve.get_total_capacity() == pytest.approx(4.0, rel=0.01)
+        assert curve.get_total_energy() == pytest.approx(48.0, rel=0.01)
+    assert len(analysis.DischargeCurve.from_samples(samples, True)) == 721
+    assert len(analysis.DischargeCurve.from_samples(samples, False)) == 1081
+
+def test_power_limited_uses_measured_current():
+    samples = [make_status(12.0, 10.0 * i, POWER_LIMITED, amps=5.0, measured=1.0) for i in range(361)]
+    curve = analysis.DischargeCurve.from_samples(samples)
+    assert curve.get_total_capacity() == pytest.approx(1.0)
+
+def test_breaks():
+    curve = analysis.DischargeCurve([0.0, 3600.0, 7200.0], [12.0, 12.0, 12.0], [1.0, 1.0, 1.0], [False, False, True])
+    assert list(curve.get_capacity()) == pytest.approx([0.0, 1.0, 1.0])
+    curve = analysis.DischargeCurve([0.0, 3600.0, 7200.0], [12.0, 12.0, 12.0], [1.0, 1.0, 1.0])
+    assert curve.get_total_capacity() == pytest.approx(2.0)
+
+def test_load_capture(tmp_path):
+    path = str(tmp_path / "log.csv")
+    writer = writers.CSVSampleWriter(path)
+    for status in make_discharge([(1800.0, RUNNING), (600.0, 0x00), (1810.0, RUNNING)]):
+        writer.write(status, 1234)
+    writer.close()
+    curves = analysis.load_capture(path)
+    assert list(curves.keys()) == [1234]
+    assert curves[1234].get_total_capacity() == pytest.approx(2.0, rel=0.01)
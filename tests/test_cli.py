@@ -0,0 +1,35 @@
+"""
+Tests of the wmr-cba command line tool against SimulatedCBA4s, no hardware
+needed.
+"""
+
+from wmr_cba import wmr_cba
+from wmr_cba import simulator
+from wmr_cba import cli
+
+def run_on_rack(monkeypatch, argv):
+    """
+    Run 'wmr-cba argv' with three simulated CBAs, each running a test started
+    by another program.  Returns the simulated CBAs, and the exit code.
+    """
+    sims = [simulator.SimulatedCBA4(serial_number=serial) for serial in (1, 2, 3)]
+    others = [wmr_cba.CBA4(interface=sim) for sim in sims]
+    for cba in others:
+        cba.do_start(2.0, 0, keep_alive=False)
+        # hand the CBA over to the tool without stopping the test
+        cba.release()
+        sims[others.index(cba)].open()
+    monkeypatch.setattr(wmr_cba.CBA4, "open_all",
+        staticmethod(lambda max_age=0, config_cache=None: [wmr_cba.CBA4(interface=sim.open()) for sim in sims]))
+    code = cli.main(argv)
+    return sims, code
+
+def test_stop_only_stops_the_named_cba(monkeypatch):
+    sims, code = run_on_rack(monkeypatch, ["stop", "-s", "2"])
+    assert code == 0
+    assert [sim.get_battery().get_load() for sim in sims] == [2.0, 0, 2.0]
+
+def test_info_leaves_tests_running(monkeypatch):
+    sims, code = run_on_rack(monkeypatch, ["info"])
+    assert code == 0
+    assert [sim.get_battery().get_load() for sim in sims] == [2.0, 2.0, 2.0]
@@ -0,0 +1,113 @@
+"""
+Tests of the streaming downsamplers, fed synthetic samples.
+"""
+
+from wmr_cba import wmr_cba
+from wmr_cba import downsample
+import pytest
+
+RUNNING = 0x02
+POWER_LIMITED = 0x12
+
+def make_status(volts, timestamp, flags=RUNNING):
+    rx = bytearray(64)
+    rx[0] = 0x73
+    rx[1] = flags
+    rx[20:24] = int(volts * 1000000).to_bytes(4, "little")
+    return wmr_cba.CBA4Status(rx, timestamp=timestamp)
+
+def make_trace(values, flags=None, dt=1.0):
+    flags = flags or ([RUNNING] * len(values))
+    return [make_status(v, i * dt, f) for i, (v, f) in enumerate(zip(values, flags))]
+
+def run(ds, trace):
+    out = []
+    for status in trace:
+        out += ds.add(status)
+    out += ds.flush()
+    return [trace.index(status) for status in out]
+
+def test_needs_a_bucket():
+    with pytest.raises(ValueError):
+        downsample.MinMaxDownsampler()
+
+def test_min_max_by_count():
+    trace = make_trace([3, 1, 4, 1, 5, 9, 2, 6, 5, 3])
+    ds = downsample.MinMaxDownsampler(bucket_size=5)
+    # the min and max of each bucket, in time order, then the last sample
+    assert run(ds, trace) == [1, 4, 5, 6, 9]
+    assert ds.get_counts() == (10, 5)
+
+def test_min_max_by_time():
+    trace = make_trace([float(i) for i in range(12)], dt=0.25)
+    ds = downsample.MinMaxDownsampler(bucket_seconds=1.0)
+    assert run(ds, trace) == [0, 3, 4, 7, 8, 11]
+
+def test_callback():
+    trace = make_trace([3, 1, 4, 1, 5, 9, 2, 6, 5, 3])
+    passed = []
+    ds = downsample.MinMaxDownsampler(bucket_size=5, callback=passed.append)
+    out = run(ds, trace)
+    assert [trace.index(status) for status in passed] == out
+
+def test_flag_change_keeps_both_samples():
+    flags = [RUNNING] * 50 + [POWER_LIMITED] * 50
+    trace = make_trace([12.0 - 0.01 * i for i in range(100)], flags)
+    for ds in [downsample.MinMaxDownsampler(bucket_size=100), downsample.LTTBDownsampler(bucket_size=100)]:
+        out = run(ds, trace)
+        assert 49 in out
+        assert 50 in out
+
+def test_buckets_never_span_a_flag_change():
+    flags = [RUNNING] * 6 + [POWER_LIMITED] * 6
+    trace = make_trace([5, 4, 6, 5, 3, 7, 8, 5, 2, 9, 4, 6], flags)
+    ds = downsample.MinMaxDownsampler(bucket_size=4)
+    # buckets 0-3, 4-5 (ended by the change at 6), 7-10 and 11
+    assert run(ds, trace) == [1, 2, 4, 5, 6, 8, 9, 11]
+
+def test_flag_changes_stay_in_order():
+    flags = ([RUNNING] * 7 + [POWER_LIMITED] * 7) * 3
+    trace = make_trace([12.0 + 0.1 * ((i * 7) % 5) for i in range(len(flags))], flags)
+    for ds in [downsample.LTTBDownsampler(bucket_size=3), downsample.MinMaxDownsampler(bucket_size=3)]:
+        out = run(ds, trace)
+        assert out == sorted(set(out))
+        # where the flags change between two samples passed on, they are
+        # neighbours in the trace, so nothing from either side was merged
+        for a, b in zip(out, out[1:]):
+            if trace[a].flags != trace[b].flags:
+                assert b == a + 1
+        for i in range(1, len(trace)):
+            if trace[i].flags != trace[i-1].flags:
+                assert (i - 1) in out
+                assert i in out
+
+def test_lttb_passes_on_a_bucket_once_the_next_is_full():
+    trace = make_trace([12.0, 12.1, 12.2, 12.3, 12.2, 12.1, 12.0, 11.9, 11.8, 11.7, 11.6])
+    ds = downsample.LTTBDownsampler(bucket_size=3)
+    # the first sample is passed on straight away
+    assert ds.add(trace[0]) == [trace[0]]
+    for status in trace[1:7]:
+        assert ds.add(status) == []
+    # bucket 1-3 is passed on when bucket 4-6 is full
+    out = ds.add(trace[7])
+    assert len(out) == 1
+    assert trace.index(out[0]) in (1, 2, 3)
+    for status in trace[8:10]:
+        assert ds.add(status) == []
+    out = ds.add(trace[10])
+    assert len(out) == 1
+    assert trace.index(out[0]) in (4, 5, 6)
+    # flush passes on 7-9, then the last sample, in order
+    out = [trace.index(status) for status in ds.flush()]
+    assert len(out) == 2
+    assert out[0] in (7, 8, 9)
+    assert out[1] == 10
+
+def test_lttb_keeps_a_spike():
+    values = [12.0] * 30
+    values[14] = 10.5
+    trace = make_trace(values)
+    ds = downsample.LTTBDownsampler(bucket_size=10)
+    out = run(ds, trace)
+    assert 14 in out
+    assert out == sorted(out)
@@ -0,0 +1,57 @@
+"""
+Tests of CBA4Exporter against SimulatedCBA4s, no hardware needed.
+"""
+
+from wmr_cba import wmr_cba
+from wmr_cba import simulator
+from wmr_cba import exporter
+
+class FailingCBA:
+    """
+    A CBA4 whose every read raises.
+    """
+    def is_valid(self):
+        return True
+
+    def get_serial_number(self):
+        return 99
+
+    def get_status(self, max_age=None):
+        raise IOError("read failed")
+
+def test_refresh_marks_failing_device_down():
+    good = wmr_cba.CBA4(interface=simulator.SimulatedCBA4(serial_number=1234))
+    ex = exporter.CBA4Exporter([good, FailingCBA()])
+    ex.refresh()
+    ex.refresh()
+    metrics = ex.get_metrics().decode("utf-8")
+    good.close()
+    assert 'wmr_cba_up{serial="1234"} 1' in metrics
+    assert 'wmr_cba_up{serial="99"} 0' in metrics
+    assert 'wmr_cba_voltage_volts{serial="1234"}' in metrics
+    assert 'wmr_cba_voltage_volts{serial="99"}' not in metrics
+    assert "wmr_cba_exporter_refresh_errors_total 2.0" in metrics
+
+def test_opens_every_cba_once(monkeypatch):
+    sims = [simulator.SimulatedCBA4(serial_number=serial) for serial in (1, 2, 3)]
+    opened = []
+    def open_all(max_age=0, config_cache=None):
+        opened.append(True)
+        return [wmr_cba.CBA4(interface=sim.open()) for sim in sims]
+    def scan(config_cache=None):
+        raise AssertionError("scan() opens and closes every CBA")
+    monkeypatch.setattr(wmr_cba.CBA4, "open_all", staticmethod(open_all))
+    monkeypatch.setattr(wmr_cba.CBA4, "scan", staticmethod(scan))
+    # a test run by another program
+    other = wmr_cba.CBA4(interface=sims[1])
+    other.do_start(2.0, 0, keep_alive=False)
+    other.release()
+    ex = exporter.CBA4Exporter()
+    ex.refresh()
+    metrics = ex.get_metrics().decode("utf-8")
+    ex.close()
+    assert opened == [True]
+    for serial in (1, 2, 3):
+        assert 'wmr_cba_up{serial="' + str(serial) + '"} 1' in metrics
+    # closing the exporter leaves the test running
+    assert sims[1].get_battery().get_load() == 2.0
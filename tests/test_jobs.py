@@ -0,0 +1,40 @@
+"""
+Tests of JobScheduler against SimulatedCBA4s, no hardware needed.
+"""
+
+from wmr_cba import wmr_cba
+from wmr_cba import simulator
+from wmr_cba import jobs
+import os
+
+def make_devices(*serials):
+    return [wmr_cba.CBA4(interface=simulator.SimulatedCBA4(serial_number=serial)) for serial in serials]
+
+def test_restored_job_for_missing_cba_fails(tmp_path):
+    path = os.path.join(str(tmp_path), "queue.json")
+    devices = make_devices(1, 2)
+    scheduler = jobs.JobScheduler(devices, state_path=path)
+    on_two = scheduler.submit(2.0, 10.5, serial=2)
+    on_any = scheduler.submit(2.0, 10.5)
+    scheduler.close()
+    for cba in devices:
+        cba.close()
+
+    # restarted with CBA 2 gone
+    devices = make_devices(1)
+    scheduler = jobs.JobScheduler(devices, state_path=path)
+    job = scheduler.get_job(on_two)
+    assert job.state == jobs.TestJob.FAILED
+    assert job.reason == "no_cba"
+    assert scheduler.get_job(on_any).state == jobs.TestJob.QUEUED
+    scheduler.close()
+    for cba in devices:
+        cba.close()
+
+    # and it stays failed, even with CBA 2 back
+    devices = make_devices(1, 2)
+    scheduler = jobs.JobScheduler(devices, state_path=path)
+    assert scheduler.get_job(on_two).state == jobs.TestJob.FAILED
+    scheduler.close()
+    for cba in devices:
+        cba.close()
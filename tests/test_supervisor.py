@@ -0,0 +1,78 @@
+"""
+Tests of SupervisedUsb with a SimulatedCBA4 being unplugged and plugged back
+in, no hardware needed.
+"""
+
+from wmr_cba import wmr_cba
+from wmr_cba import simulator
+from wmr_cba import supervisor
+import threading
+import time
+
+def make_supervised(clock=None, **kwargs):
+    sim = simulator.SimulatedCBA4(serial_number=1234, clock=clock)
+    usb_if = supervisor.SupervisedUsb(1234, opener=lambda serial: sim.open(), response_timeout=0.2,
+        retry_interval=0.01, **kwargs)
+    return sim, usb_if, wmr_cba.CBA4(interface=usb_if)
+
+def test_reconnect_resumes_test():
+    sim, usb_if, cba = make_supervised()
+    assert cba.get_serial_number() == 1234
+    cba.do_start(2.0, 10.5, keep_alive=False)
+    assert cba.is_running(0)
+    sim.unplug()
+    # plugged back in well inside the watchdog
+    threading.Timer(0.3, sim.plug).start()
+    status = cba.get_status(max_age=0)
+    assert status is not None
+    assert status.is_running()
+    assert abs(status.set_current - 2.0) < 0.001
+    metrics = usb_if.get_metrics()
+    assert metrics["connected"]
+    assert metrics["disconnects"] == 1
+    assert metrics["reconnects"] == 1
+    assert metrics["last_gap"] >= 0.3
+    cba.close()
+
+def test_reconnect_after_watchdog_restarts_test():
+    now = [0.0]
+    sim, usb_if, cba = make_supervised(clock=lambda: now[0])
+    cba.do_start(2.0, 10.5, keep_alive=False)
+    sim.unplug()
+    # unplugged for longer than the 3s watchdog, which stops the test
+    now[0] += 5.0
+    sim.plug()
+    assert not sim.get_battery().get_load()
+    status = cba.get_status(max_age=0)
+    assert status is not None
+    assert status.is_running()
+    cba.close()
+
+def test_gives_up_while_unplugged():
+    sim, usb_if, cba = make_supervised(reconnect_timeout=0.2)
+    sim.unplug()
+    assert cba.get_status(max_age=0) is None
+    assert cba.get_voltage(0) is None
+    assert usb_if.is_valid()
+    assert not usb_if.is_connected()
+    sim.plug()
+    assert cba.get_voltage(0) is not None
+    assert usb_if.is_connected()
+    cba.close()
+
+def test_close_not_held_up_by_reconnecting():
+    sim, usb_if, cba = make_supervised(reconnect_timeout=5.0)
+    sim.unplug()
+    result = []
+    asker = threading.Thread(target=lambda: result.append(cba.get_status(max_age=0)))
+    asker.start()
+    time.sleep(0.5)
+    assert not usb_if.is_connected()
+    t = time.monotonic()
+    usb_if.get_metrics()
+    usb_if.close()
+    asker.join(1.0)
+    assert not asker.is_alive()
+    assert time.monotonic() - t < 0.5
+    assert result == [None]
+    cba.close()
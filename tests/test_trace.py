@@ -0,0 +1,66 @@
+"""
+Tests of RecordingUsb and ReplayUsb with a SimulatedCBA4, no hardware needed.
+"""
+
+from wmr_cba import wmr_cba
+from wmr_cba import simulator
+from wmr_cba import trace
+import os
+import pytest
+
+def session(usb_if, amps=2.0):
+    """
+    Start a test, sample it, stop it.  Returns the voltages and currents
+    sampled.
+    """
+    cba = wmr_cba.CBA4(interface=usb_if)
+    cba.do_start(amps, 10.5, keep_alive=False)
+    samples = []
+    for i in range(20):
+        status = cba.get_status(max_age=0)
+        samples.append((status.voltage, status.set_current, status.measured_current, status.flags))
+    cba.close()
+    return samples
+
+def record(tmp_path):
+    path = os.path.join(str(tmp_path), "session.cbat")
+    recorder = trace.RecordingUsb(simulator.SimulatedCBA4(serial_number=1234), path)
+    samples = session(recorder)
+    return path, samples, recorder.get_records()
+
+def test_record_and_strict_replay(tmp_path):
+    path, recorded, num_records = record(tmp_path)
+    records = list(trace.read_trace(path))
+    assert len(records) == num_records
+    assert records[0].kind == trace.TraceRecord.WRITE
+    assert records[0].data[0] == 0x43
+    replay = trace.ReplayUsb(path, realtime=False, strict=True)
+    assert session(replay) == recorded
+    stats = replay.get_stats()
+    assert stats["mismatches"] == 0
+    assert stats["remaining"] == 0
+    assert stats["writes"] == len([r for r in records if r.kind == trace.TraceRecord.WRITE])
+
+def test_realtime_replay(tmp_path):
+    path, recorded, num_records = record(tmp_path)
+    replay = trace.ReplayUsb(path, realtime=True, speed=10.0, strict=True)
+    assert session(replay) == recorded
+    assert replay.get_stats()["mismatches"] == 0
+
+def test_strict_replay_rejects_a_different_session(tmp_path):
+    path, recorded, num_records = record(tmp_path)
+    replay = trace.ReplayUsb(path, realtime=False, strict=True)
+    with pytest.raises(ValueError):
+        session(replay, amps=3.0)
+    assert replay.get_stats()["mismatches"] == 1
+    assert not replay.is_valid()
+
+def test_lenient_replay_counts_mismatches(tmp_path):
+    path, recorded, num_records = record(tmp_path)
+    replay = trace.ReplayUsb(path, realtime=False)
+    session(replay, amps=3.0)
+    stats = replay.get_stats()
+    assert stats["mismatches"] > 0
+    index, expected, written = stats["first_mismatch"]
+    assert expected[0] == 0x53
+    assert written[0] == 0x53
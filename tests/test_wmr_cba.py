@@ -0,0 +1,136 @@
+"""
+Tests of CBA4 against a SimulatedCBA4, no hardware needed.
+"""
+
+from wmr_cba import wmr_cba
+from wmr_cba import simulator
+import json
+import threading
+import time
+
+class CountingUsb:
+    """
+    Passes everything on to a SimulatedCBA4, counting the status requests
+    (0x53) written.
+    """
+    def __init__(self, sim):
+        self.sim = sim
+        self.status_writes = 0
+
+    def is_valid(self):
+        return self.sim.is_valid()
+
+    def write(self, data, timeout_ms=0):
+        if data[0] == 0x53:
+            self.status_writes += 1
+        return self.sim.write(data, timeout_ms)
+
+    def read(self, timeout_ms=0):
+        return self.sim.read(timeout_ms)
+
+    def close(self):
+        self.sim.close()
+
+def test_get_status_coalesces_concurrent_requests():
+    # a status request in flight answers every get_status(max_age=0) made
+    # while it was, rather than each sending one of its own
+    # a long round trip, so every thread asks while the first request is
+    # still in flight, even on a loaded machine
+    usb_if = CountingUsb(simulator.SimulatedCBA4(serial_number=1234, latency=0.3))
+    cba = wmr_cba.CBA4(interface=usb_if)
+    statuses = []
+    def ask():
+        statuses.append(cba.get_status(max_age=0))
+    threads = [threading.Thread(target=ask) for i in range(8)]
+    for t in threads:
+        t.start()
+        time.sleep(0.004)
+    for t in threads:
+        t.join()
+    writes = usb_if.status_writes
+    cba.close()
+    assert len(statuses) == 8
+    assert all(statuses)
+    assert writes == 1
+
+def test_get_status_max_age():
+    usb_if = CountingUsb(simulator.SimulatedCBA4(serial_number=1234))
+    cba = wmr_cba.CBA4(interface=usb_if)
+    first = cba.get_status(max_age=0)
+    assert cba.get_status(max_age=10.0) is first
+    assert cba.get_status(max_age=0) is not first
+    assert usb_if.status_writes == 2
+    cba.close()
+
+def test_getters_return_none_when_unplugged():
+    sim = simulator.SimulatedCBA4(serial_number=1234)
+    cba = wmr_cba.CBA4(interface=sim)
+    assert abs(cba.get_voltage(0) - sim.get_battery().get_terminal_volts()) < 0.01
+    sim.unplug()
+    assert cba.get_status(0) is None
+    assert cba.get_voltage(0) is None
+    assert cba.is_running(0) is None
+    cba.close()
+
+def make_status(volts, timestamp, flags=0x02, amps=2.0):
+    rx = bytearray(64)
+    rx[0] = 0x73
+    rx[1] = flags
+    rx[3:7] = int(amps * 1000000).to_bytes(4, "little")
+    rx[16:20] = int(amps * 1000000).to_bytes(4, "little")
+    rx[20:24] = int(volts * 1000000).to_bytes(4, "little")
+    return wmr_cba.CBA4Status(rx, timestamp=timestamp)
+
+def test_adaptive_poll_policy_ignores_flicker():
+    # a steady reading flickering by 1mV backs off to the longest interval
+    policy = wmr_cba.AdaptivePollPolicy(0.05, 0.75)
+    t = 0.0
+    for i in range(200):
+        t += policy.next_interval(make_status(12.600 + 0.001 * (i % 2), t))
+    assert policy.get_stats()["interval"] == 0.75
+    assert policy.get_stats()["by_dvdt"] == 0
+
+def test_adaptive_poll_policy_follows_a_slope():
+    # 20mV/s is more than dvdt, so it polls as fast as it can
+    policy = wmr_cba.AdaptivePollPolicy(0.05, 0.75, dvdt=0.005)
+    t = 0.0
+    for i in range(200):
+        t += policy.next_interval(make_status(12.6 - (0.02 * t), t))
+    assert policy.get_stats()["interval"] == 0.05
+    # a slow drift, under dvdt, doesn't
+    policy = wmr_cba.AdaptivePollPolicy(0.05, 0.75, dvdt=0.005)
+    t = 0.0
+    for i in range(200):
+        t += policy.next_interval(make_status(12.6 - (0.001 * t) + 0.001 * (i % 2), t))
+    assert policy.get_stats()["interval"] == 0.75
+
+def test_config_cache_round_trip(tmp_path):
+    cache = wmr_cba.CBA4ConfigCache(str(tmp_path / "config.json"), max_age=60)
+    config = wmr_cba.CBA4Config(bytes([0x63, 0, 0, 0]) + (1234).to_bytes(4, "little") + bytes(56))
+    cache.put("1-2.3:5", config)
+    assert cache.get("1-2.3:5").serial_number == 1234
+    assert cache.get("1-2.3:6") is None
+
+def test_config_cache_ignores_malformed_file(tmp_path):
+    path = tmp_path / "config.json"
+    cache = wmr_cba.CBA4ConfigCache(str(path), max_age=60)
+    now = time.time()
+    config = {"serial_number": 1234, "raw": (bytes(4) + (1234).to_bytes(4, "little")).hex()}
+    entries = {
+        "no-time": {"config": config},
+        "bad-time": {"time": "yesterday", "config": config},
+        "no-config": {"time": now},
+        "bad-raw": {"time": now, "config": {"raw": "zz"}},
+        "short-raw": {"time": now, "config": {"raw": "00"}},
+        "not-a-dict": [1, 2],
+    }
+    path.write_text(json.dumps(entries))
+    for usb_path in entries:
+        assert cache.get(usb_path) is None
+    for top in ([1, 2, 3], "text", 5, None):
+        path.write_text(json.dumps(top))
+        # make sure the change is seen, whatever the mtime resolution
+        cache = wmr_cba.CBA4ConfigCache(str(path))
+        assert cache.get("1-2.3:5") is None
+    cache.put("1-2.3:5", wmr_cba.CBA4Config(bytes(4) + (1234).to_bytes(4, "little")))
+    assert cache.get("1-2.3:5").serial_number == 1234
@@ -0,0 +1,149 @@
+"""
+Tests of the sample writers, written to a temporary directory.
+"""
+
+from wmr_cba import wmr_cba
+from wmr_cba import writers
+import os
+import pytest
+import threading
+import time
+
+def make_status(volts, timestamp):
+    rx = bytearray(64)
+    rx[0] = 0x73
+    rx[1] = 0x02
+    rx[20:24] = int(volts * 1000000).to_bytes(4, "little")
+    return wmr_cba.CBA4Status(rx, timestamp=timestamp)
+
+def read_rows(path):
+    with open(path) as f:
+        lines = f.read().splitlines()
+    assert lines[0] == ",".join(writers.SampleWriter.COLUMNS)
+    return lines[1:]
+
+class RecordingWriter(writers.CSVSampleWriter):
+    """
+    Records the size of each chunk written and the number of flushes, and can
+    be made to wait in _write_chunk() until released.
+    """
+    def __init__(self, path, **kwargs):
+        self.chunks = []
+        self.flushes = 0
+        self.writing = threading.Event()
+        self.release = threading.Event()
+        self.release.set()
+        writers.CSVSampleWriter.__init__(self, path, **kwargs)
+
+    def _write_chunk(self, rows):
+        self.writing.set()
+        self.release.wait()
+        self.chunks.append(len(rows))
+        writers.CSVSampleWriter._write_chunk(self, rows)
+
+    def _flush_file(self):
+        self.flushes += 1
+        writers.CSVSampleWriter._flush_file(self)
+
+class FailingWriter(writers.CSVSampleWriter):
+    def _write_chunk(self, rows):
+        raise OSError("disk full")
+
+def test_chunking(tmp_path):
+    writer = RecordingWriter(str(tmp_path / "log.csv"), chunk_size=10, flush_interval=5.0)
+    for i in range(25):
+        writer.write(make_status(12.0, i), 1234)
+    writer.close()
+    assert writer.chunks == [10, 10, 5]
+    assert writer.get_rows_written() == 25
+    assert len(read_rows(str(tmp_path / "log.csv"))) == 25
+
+def test_flush_not_every_chunk(tmp_path):
+    writer = RecordingWriter(str(tmp_path / "log.csv"), chunk_size=1, flush_interval=10.0)
+    for i in range(50):
+        writer.write(make_status(12.0, i), 1234)
+    writer.close()
+    assert writer.chunks == [1] * 50
+    assert writer.flushes == 0
+    assert len(read_rows(str(tmp_path / "log.csv"))) == 50
+
+def test_flush_interval(tmp_path):
+    path = str(tmp_path / "log.csv")
+    writer = RecordingWriter(path, chunk_size=1, flush_interval=0.05)
+    for i in range(5):
+        writer.write(make_status(12.0, i), 1234)
+    time.sleep(0.3)
+    # on disk while the file is still open
+    assert len(read_rows(path)) == 5
+    assert writer.flushes >= 1
+    writer.close()
+
+def test_rotate_rows(tmp_path):
+    writer = writers.CSVSampleWriter(str(tmp_path / "log.csv"), chunk_size=7, rotate_rows=10)
+    for i in range(25):
+        writer.write(make_status(12.0, i), 1234)
+    writer.close()
+    files = writer.get_files()
+    assert [os.path.basename(f) for f in files] == ["log-0000.csv", "log-0001.csv", "log-0002.csv"]
+    assert [len(read_rows(f)) for f in files] == [10, 10, 5]
+
+def test_rotate_bytes(tmp_path):
+    writer = writers.CSVSampleWriter(str(tmp_path / "log.csv"), chunk_size=1, rotate_bytes=200)
+    for i in range(25):
+        writer.write(make_status(12.0, i), 1234)
+    writer.close()
+    files = writer.get_files()
+    assert len(files) > 1
+    assert sum(len(read_rows(f)) for f in files) == 25
+    for f in files[:-1]:
+        assert os.path.getsize(f) >= 200
+
+def test_rotate_seconds(tmp_path):
+    writer = writers.CSVSampleWriter(str(tmp_path / "log.csv"), chunk_size=1, flush_interval=0.05, rotate_seconds=0.2)
+    writer.write(make_status(12.0, 0), 1234)
+    time.sleep(0.3)
+    writer.write(make_status(12.0, 1), 1234)
+    writer.close()
+    files = writer.get_files()
+    assert [len(read_rows(f)) for f in files] == [1, 1]
+
+def test_rotation_does_not_overwrite_earlier_run(tmp_path):
+    path = str(tmp_path / "log.csv")
+    for run in range(2):
+        writer = writers.CSVSampleWriter(path, rotate_rows=2)
+        for i in range(3):
+            writer.write(make_status(12.0, i), 1234)
+        writer.close()
+    assert sorted(os.listdir(str(tmp_path))) == ["log-0000.csv", "log-0001.csv", "log-0002.csv", "log-0003.csv"]
+    assert [os.path.basename(f) for f in writer.get_files()] == ["log-0002.csv", "log-0003.csv"]
+
+def test_dropped_when_queue_full(tmp_path):
+    writer = RecordingWriter(str(tmp_path / "log.csv"), chunk_size=1, max_queue=5)
+    writer.release.clear()
+    assert writer.write(make_status(12.0, 0), 1234)
+    # the background thread is now stuck writing the first sample
+    assert writer.writing.wait(5.0)
+    results = [writer.write(make_status(12.0, i), 1234) for i in range(1, 11)]
+    assert results == [True] * 5 + [False] * 5
+    assert writer.get_dropped() == 5
+    writer.release.set()
+    writer.close()
+    assert writer.get_rows_written() == 6
+    assert len(read_rows(str(tmp_path / "log.csv"))) == 6
+
+def test_open_error_raised(tmp_path):
+    with pytest.raises(OSError):
+        writers.CSVSampleWriter(str(tmp_path / "missing" / "log.csv"))
+
+def test_write_error_reported(tmp_path):
+    writer = FailingWriter(str(tmp_path / "log.csv"), chunk_size=1, flush_interval=0.05)
+    writer.write(make_status(12.0, 0), 1234)
+    deadline = time.monotonic() + 5.0
+    while (writer.get_error() is None) and (time.monotonic() < deadline):
+        time.sleep(0.01)
+    assert isinstance(writer.get_error(), OSError)
+    assert not writer.write(make_status(12.0, 1), 1234)
+    with pytest.raises(OSError):
+        writer.close()
+    assert writer.get_dropped() == 2
+    assert writer.get_rows_written() == 0
@@ -0,0 +1,4 @@
+import sys
+from wmr_cba.cli import main
+
+sys.exit(main())
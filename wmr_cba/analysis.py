@@ -0,0 +1,394 @@
+"""
+    SUMMARY:
+
+    Offline analysis of CBA discharge logs.  Needs numpy to be installed.
+
+    All of the calculations are vectorized over columns of samples, rather
+    than done one row at a time, and batches of capture files can be spread
+    over a process pool.
+
+    AVAILABLE CLASSES:
+
+    DischargeCurve - One discharge, as columns of time, voltage and current.
+    Calculates cumulative amp hours and watt hours, average voltage, voltage
+    vs capacity, and finds the plateau and knee of the curve.
+
+    AVAILABLE FUNCTIONS:
+
+    load_capture(path) - Load a CSV or Parquet file written by writers.py,
+    returns a DischargeCurve for every serial number in the file.
+
+    compare_curves(curves) - Compare several DischargeCurves on a common
+    capacity axis.
+
+    analyze_file(path) - Summarize every discharge in a capture file.
+
+    analyze_files(paths, processes) - Summarize many capture files, using a
+    process pool.
+"""
+# Copyright (c) 2025 - Darren Rook (da66en) (route66@gmail.com)
+# Rights to use this code is made available using the MIT license.
+
+import concurrent.futures
+import os
+from wmr_cba.wmr_cba import debug
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+try:
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+class DischargeCurve:
+    """
+    One discharge of a battery, as columns (numpy arrays) of samples.
+
+    __init__(timestamp, voltage, current, breaks) (Constructor) - Columns of
+    the time (seconds), voltage and current (amps) of each sample, oldest
+    first.  'breaks' is an optional column, True for each sample where
+    current wasn't being drawn since the previous sample (e.g. the test was
+    paused); that time is left out of the amp hours and watt hours.
+
+    @staticmethod from_samples(samples, running_only) - Create from a list of
+    CBA4Status.
+
+    @staticmethod from_columns(timestamp, voltage, set_current,
+    measured_current, flags, running_only) - Create from the columns of a
+    capture file.
+
+    get_capacity() - Cumulative amp hours, one per sample.
+
+    get_energy() - Cumulative watt hours, one per sample.
+
+    get_total_capacity(), get_total_energy() - Amp hours / watt hours of the
+    whole discharge.
+
+    get_average_voltage() - Average voltage, weighted by capacity.
+
+    resample(points) - Voltage vs capacity, at 'points' evenly spaced amp
+    hours.
+
+    find_plateau(max_slope, points) - The longest flat region of the curve.
+
+    find_knee(points) - Where the curve bends down at the end of the
+    discharge.
+
+    get_summary() - All of the above in a dict.
+    """
+    def __init__(self, timestamp, voltage, current, breaks=None):
+        if numpy is None:
+            raise ImportError("DischargeCurve needs numpy, which is missing or not installed!")
+        self.timestamp = numpy.asarray(timestamp, dtype=numpy.float64)
+        self.voltage = numpy.asarray(voltage, dtype=numpy.float64)
+        self.current = numpy.asarray(current, dtype=numpy.float64)
+        if breaks is None:
+            breaks = numpy.zeros(len(self.timestamp), dtype=bool)
+        self.breaks = numpy.asarray(breaks, dtype=bool)
+        self.__capacity = None
+        self.__energy = None
+        #end __init__
+
+    @staticmethod
+    def from_columns(timestamp, voltage, set_current, measured_current, flags, running_only=True):
+        """
+        Create from the columns of a capture file (see SampleWriter.COLUMNS).
+
+        The set current is used as the current of each sample, as the
+        measured current of the CBA is only 10 bits.  When the CBA is power
+        limited the set current isn't what is being drawn, so the measured
+        current is used instead.
+
+        Current is only integrated between two samples that were both taken
+        while a test was running, so the time a test was stopped or paused
+        doesn't add to the amp hours and watt hours.
+
+        Parameters: \n
+        running_only - If True, only samples where a test is running are
+        used.
+        """
+        if numpy is None:
+            raise ImportError("DischargeCurve needs numpy, which is missing or not installed!")
+        flags = numpy.asarray(flags, dtype=numpy.int64)
+        power_limited = (flags & 0x10) == 0x10
+        current = numpy.where(power_limited, measured_current, set_current)
+        timestamp = numpy.asarray(timestamp, dtype=numpy.float64)
+        voltage = numpy.asarray(voltage, dtype=numpy.float64)
+        running = (flags & 0x02) == 0x02
+        # a sample breaks the integral unless it and the one before it were
+        # both running, found before any samples are left out
+        breaks = ~(running & numpy.concatenate(([False], running[:-1])))
+        if running_only:
+            timestamp = timestamp[running]
+            voltage = voltage[running]
+            current = current[running]
+            breaks = breaks[running]
+        return DischargeCurve(timestamp, voltage, current, breaks)
+        #end from_columns()
+
+    @staticmethod
+    def from_samples(samples, running_only=True):
+        """
+        Create from a list of CBA4Status, e.g. from CBAFleet.read_samples().
+        """
+        return DischargeCurve.from_columns(
+            [s.timestamp for s in samples],
+            [s.voltage for s in samples],
+            [s.set_current for s in samples],
+            [s.measured_current for s in samples],
+            [s.flags for s in samples],
+            running_only)
+        #end from_samples()
+
+    def __len__(self):
+        return len(self.timestamp)
+        #end __len__()
+
+    @staticmethod
+    def __cumulative_trapezoid(x, y, breaks):
+        if len(x) < 2:
+            return numpy.zeros(len(x))
+        area = numpy.diff(x) * (y[1:] + y[:-1]) * 0.5
+        area[breaks[1:]] = 0.0
+        return numpy.concatenate(([0.0], numpy.cumsum(area)))
+        #end __cumulative_trapezoid()
+
+    def get_capacity(self):
+        """
+        Returns the cumulative amp hours drawn up to each sample (numpy array).
+        """
+        if self.__capacity is None:
+            self.__capacity = DischargeCurve.__cumulative_trapezoid(self.timestamp, self.current, self.breaks) / 3600.0
+        return self.__capacity
+        #end get_capacity()
+
+    def get_energy(self):
+        """
+        Returns the cumulative watt hours drawn up to each sample (numpy array).
+        """
+        if self.__energy is None:
+            self.__energy = DischargeCurve.__cumulative_trapezoid(self.timestamp, self.current * self.voltage, self.breaks) / 3600.0
+        return self.__energy
+        #end get_energy()
+
+    def get_total_capacity(self):
+        capacity = self.get_capacity()
+        return float(capacity[-1]) if len(capacity) else 0.0
+        #end get_total_capacity()
+
+    def get_total_energy(self):
+        energy = self.get_energy()
+        return float(energy[-1]) if len(energy) else 0.0
+        #end get_total_energy()
+
+    def get_average_voltage(self):
+        """
+        Returns the average voltage over the discharge, weighted by the amp
+        hours drawn (watt hours / amp hours).  Returns the plain average if
+        no current was drawn.
+        """
+        capacity = self.get_total_capacity()
+        if capacity <= 0:
+            return float(numpy.mean(self.voltage)) if len(self.voltage) else 0.0
+        return self.get_total_energy() / capacity
+        #end get_average_voltage()
+
+    def resample(self, points=100):
+        """
+        Returns the voltage vs capacity curve at evenly spaced capacities,
+        which makes curves with different sample rates comparable.
+
+        Returns:    \n
+        (capacity, voltage), two numpy arrays of 'points' length.
+        """
+        capacity = self.get_capacity()
+        if len(capacity) < 2:
+            return (capacity.copy(), self.voltage.copy())
+        # capacity only increases, drop samples where it didn't (no current)
+        capacity, index = numpy.unique(capacity, return_index=True)
+        voltage = self.voltage[index]
+        grid = numpy.linspace(capacity[0], capacity[-1], points)
+        return (grid, numpy.interp(grid, capacity, voltage))
+        #end resample()
+
+    def find_plateau(self, max_slope=None, points=200):
+        """
+        Finds the longest region of the curve where the voltage is flat.
+
+        Parameters: \n
+        max_slope - Largest voltage change per amp hour that still counts as
+        flat.  If not provided, the average slope of the whole curve is used,
+        so the plateau is the longest region flatter than average.
+        points - Number of points the curve is resampled to first.
+
+        Returns:    \n
+        (start_ah, end_ah, average_voltage), or None if there isn't one.
+        """
+        capacity, voltage = self.resample(points)
+        if len(capacity) < 3:
+            return None
+        slope = numpy.abs(numpy.gradient(voltage, capacity))
+        if max_slope is None:
+            max_slope = abs(voltage[-1] - voltage[0]) / (capacity[-1] - capacity[0])
+        flat = numpy.concatenate(([False], slope <= max_slope, [False])).astype(numpy.int8)
+        edges = numpy.diff(flat)
+        starts = numpy.flatnonzero(edges == 1)
+        ends = numpy.flatnonzero(edges == -1)
+        if not len(starts):
+            return None
+        longest = numpy.argmax(ends - starts)
+        start = starts[longest]
+        end = ends[longest] - 1
+        return (float(capacity[start]), float(capacity[end]), float(numpy.mean(voltage[start:end+1])))
+        #end find_plateau()
+
+    def find_knee(self, points=200):
+        """
+        Finds the knee of the discharge curve, where the voltage starts
+        falling quickly near the end of the discharge.  This is the point
+        furthest above the straight line joining the start and end of the
+        (normalized) voltage vs capacity curve.
+
+        Returns:    \n
+        (capacity_ah, voltage), or None if the curve is too short.
+        """
+        capacity, voltage = self.resample(points)
+        if len(capacity) < 3:
+            return None
+        x_span = capacity[-1] - capacity[0]
+        y_span = voltage[0] - voltage[-1]
+        if (x_span <= 0) or (y_span <= 0):
+            return None
+        x = (capacity - capacity[0]) / x_span
+        y = (voltage - voltage[-1]) / y_span
+        # the chord runs from (0, 1) to (1, 0)
+        distance = y - (1.0 - x)
+        knee = numpy.argmax(distance)
+        if distance[knee] <= 0:
+            return None
+        return (float(capacity[knee]), float(voltage[knee]))
+        #end find_knee()
+
+    def get_summary(self):
+        """
+        Returns a dict of 'samples', 'duration', 'capacity_ah', 'energy_wh',
+        'average_voltage', 'start_voltage', 'end_voltage', 'plateau' and
+        'knee' (see find_plateau() and find_knee()).
+        """
+        return {
+            "samples": len(self),
+            "duration": float(self.timestamp[-1] - self.timestamp[0]) if len(self) else 0.0,
+            "capacity_ah": self.get_total_capacity(),
+            "energy_wh": self.get_total_energy(),
+            "average_voltage": self.get_average_voltage(),
+            "start_voltage": float(self.voltage[0]) if len(self) else 0.0,
+            "end_voltage": float(self.voltage[-1]) if len(self) else 0.0,
+            "plateau": self.find_plateau(),
+            "knee": self.find_knee(),
+        }
+        #end get_summary()
+    #end class DischargeCurve
+
+def load_capture(path, running_only=True):
+    """
+    Loads a capture file written by CSVSampleWriter or ParquetSampleWriter.
+
+    Returns:    \n
+    A dict of DischargeCurve, by serial number.
+    """
+    debug("analysis.load_capture(" + str(path) + ")")
+    if numpy is None:
+        raise ImportError("load_capture() needs numpy, which is missing or not installed!")
+    names = ["timestamp", "serial", "voltage", "set_current", "measured_current", "flags"]
+    if os.path.splitext(path)[1].lower() == ".parquet":
+        if pyarrow is None:
+            raise ImportError("Reading Parquet files needs pyarrow, which is missing or not installed!")
+        table = pyarrow.parquet.read_table(path, columns=names)
+        columns = dict((name, table.column(name).to_numpy()) for name in names)
+    else:
+        with open(path, "r") as f:
+            header = f.readline().strip().split(",")
+        usecols = [header.index(name) for name in names]
+        data = numpy.loadtxt(path, delimiter=",", skiprows=1, usecols=usecols, ndmin=2)
+        columns = dict((name, data[:, i]) for i, name in enumerate(names))
+    curves = {}
+    serials = columns["serial"].astype(numpy.int64)
+    for serial in numpy.unique(serials):
+        rows = serials == serial
+        curves[int(serial)] = DischargeCurve.from_columns(
+            columns["timestamp"][rows],
+            columns["voltage"][rows],
+            columns["set_current"][rows],
+            columns["measured_current"][rows],
+            columns["flags"][rows],
+            running_only)
+    return curves
+    #end load_capture()
+
+def compare_curves(curves, points=100):
+    """
+    Compares several discharges, e.g. cells from the same batch.
+
+    Parameters: \n
+    curves - A dict of DischargeCurve, by name (or serial number).
+    points - Number of points on the common capacity axis.
+
+    Returns:    \n
+    A dict of:
+    'capacity' - The common capacity axis (numpy array), from 0 to the
+    capacity of the smallest discharge.
+    'voltage' - Dict, by name, of voltage on the common capacity axis.
+    'delta' - Dict, by name, of voltage minus the mean voltage of all the
+    curves, on the common capacity axis.
+    'summary' - Dict, by name, of get_summary().
+    """
+    if numpy is None:
+        raise ImportError("compare_curves() needs numpy, which is missing or not installed!")
+    names = list(curves.keys())
+    max_ah = min(curves[name].get_total_capacity() for name in names) if names else 0.0
+    grid = numpy.linspace(0.0, max_ah, points)
+    voltage = {}
+    for name in names:
+        capacity, v = curves[name].resample(max(points, 2 * len(grid)))
+        voltage[name] = numpy.interp(grid, capacity, v) if len(capacity) else numpy.zeros(points)
+    mean = numpy.mean([voltage[name] for name in names], axis=0) if names else numpy.zeros(points)
+    return {
+        "capacity": grid,
+        "voltage": voltage,
+        "delta": dict((name, voltage[name] - mean) for name in names),
+        "summary": dict((name, curves[name].get_summary()) for name in names),
+    }
+    #end compare_curves()
+
+def analyze_file(path):
+    """
+    Returns a dict, by serial number, of DischargeCurve.get_summary() for
+    every discharge in a capture file.
+    """
+    curves = load_capture(path)
+    return dict((serial, curve.get_summary()) for serial, curve in curves.items() if len(curve))
+    #end analyze_file()
+
+def analyze_files(paths, processes=None):
+    """
+    Runs analyze_file() on many capture files, spread over a pool of
+    'processes' processes (one per CPU if not provided).
+
+    Returns:    \n
+    A dict, by path, of the results of analyze_file().  If a file couldn't
+    be analyzed, its result is the exception.
+    """
+    debug("analysis.analyze_files()")
+    results = {}
+    with concurrent.futures.ProcessPoolExecutor(processes) as pool:
+        futures = dict((path, pool.submit(analyze_file, path)) for path in paths)
+        for path, future in futures.items():
+            try:
+                results[path] = future.result()
+            except Exception as e:
+                results[path] = e
+    return results
+    #end analyze_files()
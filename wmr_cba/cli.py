@@ -0,0 +1,246 @@
+"""
+    SUMMARY:
+
+    The 'wmr-cba' command line tool, for running and monitoring tests on West
+    Mountain Radio CBA devices without writing Python.
+
+        wmr-cba scan
+        wmr-cba info [-s SERIAL ...]
+        wmr-cba start -a AMPS [-v VSTOP] [-d SECONDS] [-s SERIAL ...]
+        wmr-cba stop [-s SERIAL ...]
+        wmr-cba watch [-r RATE] [-a AMPS [-v VSTOP]] [-d SECONDS] [-s SERIAL ...]
+        wmr-cba log -o FILE [-f csv|parquet] [-r RATE] [-a AMPS [-v VSTOP]] [-s SERIAL ...]
+
+    If no serial numbers are given, the command is run on every CBA found.
+    Several CBAs are driven in parallel (see CBAFleet).  Only the modules a
+    command needs are imported, so the tool starts quickly.
+
+    A test only runs while the tool keeps the CBA alive, so 'start', 'watch'
+    and 'log' keep running until every test has ended, the duration has
+    passed, or Ctrl-C is pressed.  They then stop any test still running.
+"""
+# Copyright (c) 2025 - Darren Rook (da66en) (route66@gmail.com)
+# Rights to use this code is made available using the MIT license.
+
+import argparse
+import sys
+import time
+
+def __open(serials):
+    """
+    Opens the CBAs with serial numbers 'serials', or every CBA found if
+    'serials' is empty.  Returns a list of CBA4, exits if one is missing.
+    The other CBAs are released untouched, they may be running tests for
+    another program.
+    """
+    from wmr_cba.wmr_cba import CBA4, CBA4ConfigCache
+    devices = CBA4.open_all(config_cache=CBA4ConfigCache())
+    if not serials:
+        if not devices:
+            print("No CBAs found", file=sys.stderr)
+            sys.exit(1)
+        return devices
+    found = []
+    for cba in devices:
+        if cba.get_serial_number() in serials:
+            found.append(cba)
+        else:
+            cba.release()
+    missing = set(serials) - set(cba.get_serial_number() for cba in found)
+    if missing:
+        print("CBA not found: " + ", ".join(str(sn) for sn in sorted(missing)), file=sys.stderr)
+        for cba in found:
+            cba.release()
+        sys.exit(1)
+    return found
+    #end __open()
+
+def __format_status(serial, status):
+    if not status:
+        return "Serial=" + str(serial) + " ERROR"
+    disp = "Serial=" + str(serial)
+    disp += " Volts=" + ("%.3f" % status.voltage) + "V"
+    disp += " Load=" + ("%.3f" % status.set_current) + "A"
+    disp += " Feedback=" + ("%.3f" % status.measured_current) + "A"
+    disp += " Running=" + str(status.is_running())
+    disp += " PLim=" + str(status.is_power_limited())
+    disp += " HighTemp=" + str(status.is_high_temp())
+    return disp
+    #end __format_status()
+
+def __cmd_scan(args):
+    from wmr_cba.wmr_cba import CBA4, CBA4ConfigCache
+    error = CBA4.test()
+    if error and (error != "No CBAs found"):
+        print(error, file=sys.stderr)
+        return 1
+    for sn in CBA4.scan(CBA4ConfigCache()):
+        print(sn)
+    return 0
+    #end __cmd_scan()
+
+def __cmd_info(args):
+    devices = __open(args.serial)
+    for cba in devices:
+        print(__format_status(cba.get_serial_number(), cba.get_status(max_age=0)))
+        # only looking, leave any test running
+        cba.release()
+    return 0
+    #end __cmd_info()
+
+def __cmd_stop(args):
+    devices = __open(args.serial)
+    for cba in devices:
+        cba.do_stop()
+        print(__format_status(cba.get_serial_number(), cba.get_status(max_age=0)))
+        cba.close()
+    return 0
+    #end __cmd_stop()
+
+def __run(args, on_tick=None):
+    """
+    Opens the CBAs, starts a test if '--amps' was given, then calls
+    'on_tick(latest)' every 1/rate seconds with the latest CBA4Status of each
+    CBA (by serial), until the tests end, the duration passes or Ctrl-C.
+    """
+    from wmr_cba.fleet import CBAFleet
+    devices = __open(args.serial)
+    rate = getattr(args, "rate", 1.0)
+    period = 1.0 / rate
+    # the CBAs need polling at least every 0.75s to keep a test alive
+    fleet = CBAFleet(devices, max_workers=min(len(devices), 16), interval=min(period, 0.5))
+    started = getattr(args, "amps", None) is not None
+    if started:
+        fleet.do_start(args.amps, args.vstop or 0)
+    else:
+        fleet.start()
+    t_end = (time.monotonic() + args.duration) if args.duration else None
+    next_tick = time.monotonic()
+    try:
+        while True:
+            next_tick += period
+            time.sleep(max(next_tick - time.monotonic(), 0))
+            latest = fleet.get_latest()
+            if on_tick:
+                on_tick(latest)
+            if started and all(s and not s.is_running() for s in latest.values()):
+                break
+            if t_end and (time.monotonic() >= t_end):
+                break
+    except KeyboardInterrupt:
+        pass
+    fleet.do_stop()
+    latest = fleet.get_latest()
+    fleet.close()
+    for cba in devices:
+        cba.close()
+    return latest
+    #end __run()
+
+def __cmd_start(args):
+    args.rate = 1.0
+    latest = __run(args)
+    for serial, status in latest.items():
+        print(__format_status(serial, status))
+    return 0
+    #end __cmd_start()
+
+def __cmd_watch(args):
+    last = {}
+    def on_tick(latest):
+        for serial, status in latest.items():
+            if status is not last.get(serial):
+                print(("%.3f" % time.time()) + " " + __format_status(serial, status), flush=True)
+                last[serial] = status
+    __run(args, on_tick)
+    return 0
+    #end __cmd_watch()
+
+def __cmd_log(args):
+    from wmr_cba import writers
+    rotate = {
+        "rotate_rows": args.rotate_rows,
+        "rotate_bytes": args.rotate_bytes,
+        "rotate_seconds": args.rotate_seconds,
+    }
+    if args.format == "parquet":
+        writer = writers.ParquetSampleWriter(args.output, **rotate)
+    else:
+        writer = writers.CSVSampleWriter(args.output, **rotate)
+    last = {}
+    def on_tick(latest):
+        for serial, status in latest.items():
+            if status and (status is not last.get(serial)):
+                writer.write(status, serial)
+                last[serial] = status
+    __run(args, on_tick)
+    result = 0
+    try:
+        writer.close()
+    except Exception as e:
+        print("Error writing samples: " + str(e), file=sys.stderr)
+        result = 1
+    print("Wrote " + str(writer.get_rows_written()) + " samples to " + ", ".join(writer.get_files()))
+    if writer.get_dropped():
+        print("Dropped " + str(writer.get_dropped()) + " samples", file=sys.stderr)
+    return result
+    #end __cmd_log()
+
+def __get_parser():
+    parser = argparse.ArgumentParser(prog="wmr-cba", description="Control West Mountain Radio CBA battery analyzers.")
+    commands = parser.add_subparsers(dest="command", metavar="command")
+    commands.required = True
+
+    def add_serial(p):
+        p.add_argument("-s", "--serial", type=int, nargs="+", default=[], help="serial numbers of the CBAs, all if not given")
+
+    def add_test(p, required):
+        p.add_argument("-a", "--amps", type=float, required=required, help="test current, in amps")
+        p.add_argument("-v", "--vstop", type=float, default=0, help="stop the test below this voltage")
+        p.add_argument("-d", "--duration", type=float, default=0, help="stop after this many seconds")
+
+    p = commands.add_parser("scan", help="list the serial numbers of the CBAs found")
+    p.set_defaults(func=__cmd_scan)
+
+    p = commands.add_parser("info", help="show the status of CBAs")
+    add_serial(p)
+    p.set_defaults(func=__cmd_info)
+
+    p = commands.add_parser("start", help="run a test, until it ends")
+    add_serial(p)
+    add_test(p, True)
+    p.set_defaults(func=__cmd_start)
+
+    p = commands.add_parser("stop", help="stop a test")
+    add_serial(p)
+    p.set_defaults(func=__cmd_stop)
+
+    p = commands.add_parser("watch", help="print the status of CBAs, optionally running a test")
+    add_serial(p)
+    add_test(p, False)
+    p.add_argument("-r", "--rate", type=float, default=1.0, help="samples per second (default 1)")
+    p.set_defaults(func=__cmd_watch)
+
+    p = commands.add_parser("log", help="save the status of CBAs to a file, optionally running a test")
+    add_serial(p)
+    add_test(p, False)
+    p.add_argument("-r", "--rate", type=float, default=1.0, help="samples per second (default 1)")
+    p.add_argument("-o", "--output", required=True, help="file to write")
+    p.add_argument("-f", "--format", choices=["csv", "parquet"], default="csv", help="file format (default csv)")
+    p.add_argument("--rotate-rows", type=int, default=None, help="start a new file after this many samples")
+    p.add_argument("--rotate-bytes", type=int, default=None, help="start a new file at this size")
+    p.add_argument("--rotate-seconds", type=float, default=None, help="start a new file after this many seconds")
+    p.set_defaults(func=__cmd_log)
+    return parser
+    #end __get_parser()
+
+def main(argv=None):
+    """
+    Entry point of the 'wmr-cba' command.  Returns the exit code.
+    """
+    args = __get_parser().parse_args(argv)
+    return args.func(args)
+    #end main()
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,379 @@
+"""
+    SUMMARY:
+
+    Streaming downsamplers for long CBA traces.
+
+    Samples (CBA4Status) are fed in one at a time, e.g. straight from
+    CBA4.add_listener(), and a much smaller number of the original samples
+    are passed on.  Each bucket of samples is reduced to a few candidate
+    samples as they arrive, so memory use doesn't grow with the bucket size
+    or the length of the trace.
+
+    Changes of the status flags (status byte 1, e.g. the start of power
+    limiting, or a high temperature abort) are never downsampled away: the
+    last sample before a change and the first sample after it are always
+    passed on, and buckets never span a change.
+
+    AVAILABLE CLASSES:
+
+    Downsampler - Base class, handles the buckets and flag changes.
+
+    MinMaxDownsampler - Passes on the minimum and maximum sample of each
+    bucket.
+
+    LTTBDownsampler - Largest-Triangle-Three-Buckets, passes on the sample of
+    each bucket that best preserves the shape of the trace.
+
+    Example:
+
+        points = []
+        ds = downsample.LTTBDownsampler(bucket_seconds=60, callback=points.append)
+        ds.attach(cba)
+"""
+# Copyright (c) 2025 - Darren Rook (da66en) (route66@gmail.com)
+# Rights to use this code is made available using the MIT license.
+
+import abc
+import threading
+from wmr_cba.wmr_cba import debug
+
+class Downsampler(abc.ABC):
+    """
+    Base class for the downsamplers.  Subclasses implement _add(),
+    _end_bucket(), _flush() and _restart().
+
+    __init__(bucket_size, bucket_seconds, callback, value) (Constructor) -
+    Buckets are 'bucket_size' samples, or 'bucket_seconds' long.
+    'callback(status)' is called with each sample passed on.  'value(status)'
+    returns the value being downsampled, the voltage if not provided.
+
+    add(status) - Add a CBA4Status.  Returns a list of the samples passed on
+    because of it (usually empty).
+
+    flush() - Pass on whatever is left in the current bucket, at the end of
+    a trace.  Returns the list of samples passed on.
+
+    attach(cba) - Add every status heard by a CBA4 (see CBA4.add_listener()).
+
+    detach(cba) - Stop adding the status of a CBA4 passed to attach().
+
+    get_counts() - Returns (samples added, samples passed on).
+    """
+    def __init__(self, bucket_size=None, bucket_seconds=None, callback=None, value=None):
+        debug("Downsampler.__init__()")
+        if not bucket_size and not bucket_seconds:
+            raise ValueError("bucket_size or bucket_seconds must be provided")
+        self.__bucket_size = bucket_size
+        self.__bucket_seconds = bucket_seconds
+        self.__callback = callback
+        self.value = value if value else (lambda status: status.voltage)
+        self.__lock = threading.Lock()
+        self.__listeners = {}
+        self.__last = None
+        self.__last_emitted = None
+        self.__bucket_count = 0
+        self.__bucket_start = None
+        self.__added = 0
+        self.__emitted = 0
+        #end __init__
+
+    def _emit(self, out, status):
+        """
+        Pass on 'status', unless it was already passed on.
+        """
+        if status is None:
+            return
+        last = self.__last_emitted
+        if last is not None and ((status is last) or (status.timestamp < last.timestamp)):
+            return
+        self.__last_emitted = status
+        self.__emitted += 1
+        out.append(status)
+        #end _emit()
+
+    def add(self, status):
+        """
+        Add the next sample.
+
+        Returns:    \n
+        A list of the samples that are passed on because of this one, oldest
+        first.
+        """
+        out = []
+        with self.__lock:
+            self.__added += 1
+            last = self.__last
+            if (last is not None) and (status.flags != last.flags):
+                # keep both sides of a flag change, and don't let a bucket span it
+                self._flush(out, status)
+                self._emit(out, last)
+                self._emit(out, status)
+                self._restart(status)
+                self.__bucket_count = 0
+                self.__bucket_start = None
+            else:
+                if self.__bucket_start is not None:
+                    full = self.__bucket_size and (self.__bucket_count >= self.__bucket_size)
+                    late = self.__bucket_seconds and ((status.timestamp - self.__bucket_start) >= self.__bucket_seconds)
+                    if full or late:
+                        self._end_bucket(out)
+                        self.__bucket_count = 0
+                        self.__bucket_start = None
+                if self._add(out, status):
+                    if self.__bucket_start is None:
+                        self.__bucket_start = status.timestamp
+                    self.__bucket_count += 1
+            self.__last = status
+        self.__pass_on(out)
+        return out
+        #end add()
+
+    def flush(self):
+        """
+        Pass on everything still waiting in the buckets, including the last
+        sample added.  Call at the end of a trace.
+
+        Returns:    \n
+        A list of the samples passed on, oldest first.
+        """
+        out = []
+        with self.__lock:
+            self._flush(out, None)
+            self._emit(out, self.__last)
+            if self.__last is not None:
+                self._restart(self.__last)
+            self.__bucket_count = 0
+            self.__bucket_start = None
+        self.__pass_on(out)
+        return out
+        #end flush()
+
+    def __pass_on(self, out):
+        if self.__callback:
+            for status in out:
+                self.__callback(status)
+        #end __pass_on()
+
+    def attach(self, cba):
+        listener = lambda status: self.add(status)
+        self.__listeners[id(cba)] = listener
+        cba.add_listener(listener)
+        #end attach()
+
+    def detach(self, cba):
+        listener = self.__listeners.pop(id(cba), None)
+        if listener:
+            cba.remove_listener(listener)
+        #end detach()
+
+    def get_counts(self):
+        """
+        Returns (samples added, samples passed on).
+        """
+        return (self.__added, self.__emitted)
+        #end get_counts()
+
+    @abc.abstractmethod
+    def _add(self, out, status):
+        """
+        Add 'status' to the current bucket.  Returns False if it wasn't added
+        to a bucket (it was passed on by itself).
+        """
+        #end _add()
+
+    @abc.abstractmethod
+    def _end_bucket(self, out):
+        """
+        The current bucket is full.
+        """
+        #end _end_bucket()
+
+    @abc.abstractmethod
+    def _flush(self, out, next_status):
+        """
+        Pass on what's waiting in the buckets.  'next_status' is the first
+        sample after them, None at the end of a trace.
+        """
+        #end _flush()
+
+    @abc.abstractmethod
+    def _restart(self, status):
+        """
+        Start again after 'status', which has already been passed on.
+        """
+        #end _restart()
+    #end class Downsampler
+
+class MinMaxDownsampler(Downsampler):
+    """
+    Passes on the minimum and maximum sample of each bucket, which keeps the
+    envelope of the trace (peaks and dips are never lost).  At most 2 samples
+    per bucket, plus the samples around flag changes.
+
+    __init__(bucket_size, bucket_seconds, callback, value) (Constructor) - See
+    Downsampler.
+    """
+    def __init__(self, bucket_size=None, bucket_seconds=None, callback=None, value=None):
+        Downsampler.__init__(self, bucket_size, bucket_seconds, callback, value)
+        self.__min = None
+        self.__max = None
+        self.__min_value = None
+        self.__max_value = None
+        #end __init__
+
+    def _add(self, out, status):
+        v = self.value(status)
+        if (self.__min is None) or (v < self.__min_value):
+            self.__min = status
+            self.__min_value = v
+        if (self.__max is None) or (v > self.__max_value):
+            self.__max = status
+            self.__max_value = v
+        return True
+        #end _add()
+
+    def _end_bucket(self, out):
+        if self.__min is not None:
+            for status in sorted([self.__min, self.__max], key=lambda s: s.timestamp):
+                self._emit(out, status)
+        self.__min = None
+        self.__max = None
+        #end _end_bucket()
+
+    def _flush(self, out, next_status):
+        self._end_bucket(out)
+        #end _flush()
+
+    def _restart(self, status):
+        pass
+        #end _restart()
+    #end class MinMaxDownsampler
+
+class LTTBDownsampler(Downsampler):
+    """
+    Largest-Triangle-Three-Buckets downsampling, run as a stream.  One sample
+    is passed on per bucket: the one making the largest triangle with the
+    sample passed on for the previous bucket and the average of the next
+    bucket.  So a bucket is passed on once the following bucket is full.
+
+    To keep memory constant, only the first, last, minimum and maximum
+    sample of each bucket are kept as candidates, along with the running
+    average.  The sample picked is always one of the original samples.
+
+    __init__(bucket_size, bucket_seconds, callback, value) (Constructor) - See
+    Downsampler.
+    """
+    def __init__(self, bucket_size=None, bucket_seconds=None, callback=None, value=None):
+        Downsampler.__init__(self, bucket_size, bucket_seconds, callback, value)
+        self.__anchor = None
+        self.__pending = None
+        self.__current = LTTBDownsampler.__Bucket()
+        #end __init__
+
+    class __Bucket:
+        """
+        The candidates and running average of one bucket.
+        """
+        __slots__ = ('first', 'last', 'min', 'max', 'min_value', 'max_value', 'sum_t', 'sum_v', 'count')
+
+        def __init__(self):
+            self.first = None
+            self.last = None
+            self.min = None
+            self.max = None
+            self.min_value = None
+            self.max_value = None
+            self.sum_t = 0.0
+            self.sum_v = 0.0
+            self.count = 0
+            #end __init__
+
+        def add(self, status, v):
+            if self.first is None:
+                self.first = status
+            self.last = status
+            if (self.min is None) or (v < self.min_value):
+                self.min = status
+                self.min_value = v
+            if (self.max is None) or (v > self.max_value):
+                self.max = status
+                self.max_value = v
+            self.sum_t += status.timestamp
+            self.sum_v += v
+            self.count += 1
+            #end add()
+
+        def get_average(self):
+            return (self.sum_t / self.count, self.sum_v / self.count)
+            #end get_average()
+
+        def get_candidates(self):
+            return [self.first, self.last, self.min, self.max]
+            #end get_candidates()
+        #end class __Bucket
+
+    def __select(self, bucket, next_point):
+        """
+        Returns the candidate of 'bucket' making the largest triangle with the
+        anchor (the sample last passed on) and 'next_point' (time, value).
+        """
+        at = self.__anchor.timestamp
+        av = self.value(self.__anchor)
+        nt, nv = next_point
+        best = None
+        best_area = -1.0
+        for status in bucket.get_candidates():
+            area = abs(((at - nt) * (self.value(status) - av)) - ((at - status.timestamp) * (nv - av)))
+            if area > best_area:
+                best = status
+                best_area = area
+        return best
+        #end __select()
+
+    def __pass_on_bucket(self, out, bucket, next_point):
+        status = self.__select(bucket, next_point)
+        self._emit(out, status)
+        self.__anchor = status
+        #end __pass_on_bucket()
+
+    def _add(self, out, status):
+        if self.__anchor is None:
+            # the first sample of a trace is always passed on
+            self._emit(out, status)
+            self.__anchor = status
+            return False
+        self.__current.add(status, self.value(status))
+        return True
+        #end _add()
+
+    def _end_bucket(self, out):
+        if self.__current.count == 0:
+            return
+        if self.__pending is not None:
+            self.__pass_on_bucket(out, self.__pending, self.__current.get_average())
+        self.__pending = self.__current
+        self.__current = LTTBDownsampler.__Bucket()
+        #end _end_bucket()
+
+    def _flush(self, out, next_status):
+        if next_status is not None:
+            next_point = (next_status.timestamp, self.value(next_status))
+        elif self.__current.count:
+            next_point = (self.__current.last.timestamp, self.value(self.__current.last))
+        elif self.__pending is not None:
+            next_point = (self.__pending.last.timestamp, self.value(self.__pending.last))
+        if self.__pending is not None:
+            if self.__current.count:
+                self.__pass_on_bucket(out, self.__pending, self.__current.get_average())
+            else:
+                self.__pass_on_bucket(out, self.__pending, next_point)
+        if self.__current.count:
+            self.__pass_on_bucket(out, self.__current, next_point)
+        self.__pending = None
+        self.__current = LTTBDownsampler.__Bucket()
+        #end _flush()
+
+    def _restart(self, status):
+        self.__anchor = status
+        #end _restart()
+    #end class LTTBDownsampler
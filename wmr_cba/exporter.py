@@ -0,0 +1,303 @@
+"""
+    SUMMARY:
+
+    Prometheus / OpenMetrics exporter for West Mountain Radio CBA devices.
+
+    Every attached CBA is read by a background thread once per refresh
+    interval, using one status transaction per unit (see CBA4.get_status()).
+    The exposition text is rendered once per refresh and cached, so how often
+    the exporter is scraped never changes how much USB traffic is generated.
+
+    AVAILABLE CLASSES:
+
+    CBA4Exporter - Refreshes readings from a list of CBA4s and serves them
+    over HTTP.
+
+    Run this module to export every CBA attached to this host:
+
+        python -m wmr_cba.exporter [port]
+"""
+# Copyright (c) 2025 - Darren Rook (da66en) (route66@gmail.com)
+# Rights to use this code is made available using the MIT license.
+
+import http.server
+import threading
+import time
+import sys
+from wmr_cba.wmr_cba import CBA4, debug
+
+class CBA4Exporter:
+    """
+    Serves CBA readings in the Prometheus / OpenMetrics text format, labelled
+    by each CBA's serial number.
+
+    __init__(devices, refresh_interval) (Constructor) - Export 'devices', a
+    list of CBA4 objects.  If 'devices' isn't provided, every CBA found is
+    opened (CBA4.open_all()).  Readings are refreshed every
+    'refresh_interval' seconds.
+
+    start() - Start the background refresh thread.
+
+    stop() - Stop the background refresh thread.
+
+    refresh() - Read every CBA once and re-render the cached metrics.
+
+    get_metrics(openmetrics) - Returns the cached exposition text (bytes).
+    No USB traffic is generated.
+
+    serve(port, address) - Start an HTTP server thread answering scrapes.
+
+    close() - Stop the HTTP server and refresh thread, and release any CBA4s
+    that were opened by the constructor (see CBA4.release()).
+
+    The exporter's own overhead is exported as well: the duration of the
+    last refresh and render, the number of CBA reads that raised an error,
+    and the number and total duration of scrapes.
+    """
+    CONTENT_TYPE_PROMETHEUS = "text/plain; version=0.0.4; charset=utf-8"
+    CONTENT_TYPE_OPENMETRICS = "application/openmetrics-text; version=1.0.0; charset=utf-8"
+
+    # (metric name, help text, function returning the value from a CBA4Status)
+    METRICS = [
+        ("wmr_cba_voltage_volts", "Measured voltage.", lambda s: s.voltage),
+        ("wmr_cba_set_current_amps", "Test current, 0 if a test isn't running.", lambda s: s.set_current),
+        ("wmr_cba_measured_current_amps", "Measured current.", lambda s: s.measured_current),
+        ("wmr_cba_running", "1 if a test is running and drawing current.", lambda s: int(s.is_running())),
+        ("wmr_cba_power_limited", "1 if the test current is being limited to stay within power limits.", lambda s: int(s.is_power_limited())),
+        ("wmr_cba_high_temp", "1 if the test was aborted because the temperature was too high.", lambda s: int(s.is_high_temp())),
+        ("wmr_cba_sample_timestamp_seconds", "When the status was read, in seconds since the epoch.", lambda s: s.timestamp),
+    ]
+
+    def __init__(self, devices=None, refresh_interval=1.0):
+        debug("CBA4Exporter.__init__()")
+        self.__owns_devices = False
+        if devices is None:
+            devices = CBA4.open_all()
+            self.__owns_devices = True
+        self.__devices = [(str(cba.get_serial_number()), cba) for cba in devices]
+        self.__refresh_interval = refresh_interval
+        self.__lock = threading.Lock()
+        self.__stop_event = threading.Event()
+        self.__thread = None
+        self.__server = None
+        self.__server_thread = None
+        self.__samples = {}
+        self.__body = b""
+        self.__refresh_count = 0
+        self.__refresh_errors = 0
+        self.__refresh_seconds = 0.0
+        self.__render_seconds = 0.0
+        self.__scrape_count = 0
+        self.__scrape_seconds = 0.0
+        #end __init__
+
+    def start(self):
+        """
+        Start the thread that refreshes the readings every 'refresh_interval'
+        seconds.  A first refresh is done before returning, so the first
+        scrape already has data.
+        """
+        debug("CBA4Exporter.start()")
+        if self.__thread and self.__thread.is_alive():
+            return
+        self.refresh()
+        self.__stop_event.clear()
+        self.__thread = threading.Thread(target=self.__run, daemon=True)
+        self.__thread.start()
+        #end start()
+
+    def stop(self):
+        debug("CBA4Exporter.stop()")
+        self.__stop_event.set()
+        if self.__thread:
+            self.__thread.join()
+            self.__thread = None
+        #end stop()
+
+    def __run(self):
+        while not self.__stop_event.wait(self.__refresh_interval):
+            try:
+                self.refresh()
+            except Exception as e:
+                # keep refreshing, the next one may work
+                debug("CBA4Exporter refresh error: " + str(e))
+        #end __run()
+
+    def refresh(self):
+        """
+        Read the status of every CBA once, then re-render the metrics.  A CBA
+        that can't be read is reported down (wmr_cba_up 0).
+        """
+        t = time.perf_counter()
+        samples = {}
+        errors = 0
+        for serial, cba in self.__devices:
+            try:
+                samples[serial] = cba.get_status() if cba.is_valid() else None
+            except Exception as e:
+                debug("CBA4Exporter error reading " + serial + ": " + str(e))
+                samples[serial] = None
+                errors += 1
+        refresh_seconds = time.perf_counter() - t
+        t = time.perf_counter()
+        body = self.__render(samples)
+        render_seconds = time.perf_counter() - t
+        with self.__lock:
+            self.__samples = samples
+            self.__body = body
+            self.__refresh_count += 1
+            self.__refresh_errors += errors
+            self.__refresh_seconds = refresh_seconds
+            self.__render_seconds = render_seconds
+        #end refresh()
+
+    @staticmethod
+    def __format_value(value):
+        return repr(float(value))
+        #end __format_value()
+
+    def __render(self, samples):
+        lines = []
+        lines.append("# HELP wmr_cba_up 1 if the last status read from the CBA succeeded.")
+        lines.append("# TYPE wmr_cba_up gauge")
+        for serial, status in samples.items():
+            lines.append('wmr_cba_up{serial="' + serial + '"} ' + ("1" if status else "0"))
+        for name, help_text, getter in CBA4Exporter.METRICS:
+            lines.append("# HELP " + name + " " + help_text)
+            lines.append("# TYPE " + name + " gauge")
+            for serial, status in samples.items():
+                if status:
+                    lines.append(name + '{serial="' + serial + '"} ' + CBA4Exporter.__format_value(getter(status)))
+        lines.append("")
+        return "\n".join(lines).encode("utf-8")
+        #end __render()
+
+    def __render_self(self, openmetrics):
+        """
+        Renders the exporter's own overhead metrics.  These are cheap, so are
+        rendered at scrape time to keep the scrape counters current.
+        """
+        lines = []
+        gauges = [
+            ("wmr_cba_exporter_refresh_duration_seconds", "Time taken by the last refresh of every CBA.", self.__refresh_seconds),
+            ("wmr_cba_exporter_render_duration_seconds", "Time taken by the last render of the cached metrics.", self.__render_seconds),
+        ]
+        counters = [
+            ("wmr_cba_exporter_refreshes", "Number of refreshes done.", self.__refresh_count),
+            ("wmr_cba_exporter_refresh_errors", "Number of times reading a CBA raised an error.", self.__refresh_errors),
+            ("wmr_cba_exporter_scrapes", "Number of scrapes answered.", self.__scrape_count),
+            ("wmr_cba_exporter_scrape_duration_seconds", "Total time spent answering scrapes.", self.__scrape_seconds),
+        ]
+        for name, help_text, value in gauges:
+            lines.append("# HELP " + name + " " + help_text)
+            lines.append("# TYPE " + name + " gauge")
+            lines.append(name + " " + CBA4Exporter.__format_value(value))
+        for name, help_text, value in counters:
+            # OpenMetrics names the counter family without the _total suffix
+            family = name if openmetrics else name + "_total"
+            lines.append("# HELP " + family + " " + help_text)
+            lines.append("# TYPE " + family + " counter")
+            lines.append(name + "_total " + CBA4Exporter.__format_value(value))
+        if openmetrics:
+            lines.append("# EOF")
+        lines.append("")
+        return "\n".join(lines).encode("utf-8")
+        #end __render_self()
+
+    def get_metrics(self, openmetrics=False):
+        """
+        Returns the exposition text, as bytes.  This only reads the cached
+        metrics, it never talks to a CBA.
+
+        Parameters: \n
+        openmetrics - If True, returns the OpenMetrics format instead of the
+        Prometheus text format.
+        """
+        t = time.perf_counter()
+        with self.__lock:
+            body = self.__body + self.__render_self(openmetrics)
+            self.__scrape_count += 1
+            self.__scrape_seconds += time.perf_counter() - t
+        return body
+        #end get_metrics()
+
+    def get_samples(self):
+        """
+        Returns the readings of the last refresh, as a dict of CBA4Status
+        (None if the read failed) keyed by serial number (string).
+        """
+        with self.__lock:
+            return dict(self.__samples)
+        #end get_samples()
+
+    def serve(self, port=9105, address=""):
+        """
+        Starts the refresh thread, if not already running, and an HTTP server
+        thread that answers scrapes on any path (e.g. /metrics).
+
+        Returns:    \n
+        The http.server.ThreadingHTTPServer.
+        """
+        debug("CBA4Exporter.serve()")
+        self.start()
+        exporter = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                openmetrics = "application/openmetrics-text" in self.headers.get("Accept", "")
+                body = exporter.get_metrics(openmetrics)
+                self.send_response(200)
+                if openmetrics:
+                    self.send_header("Content-Type", CBA4Exporter.CONTENT_TYPE_OPENMETRICS)
+                else:
+                    self.send_header("Content-Type", CBA4Exporter.CONTENT_TYPE_PROMETHEUS)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+                #end do_GET()
+
+            def log_message(self, format, *args):
+                debug("CBA4Exporter: " + (format % args))
+                #end log_message()
+            #end class Handler
+
+        self.__server = http.server.ThreadingHTTPServer((address, port), Handler)
+        self.__server.daemon_threads = True
+        self.__server_thread = threading.Thread(target=self.__server.serve_forever, daemon=True)
+        self.__server_thread.start()
+        return self.__server
+        #end serve()
+
+    def close(self):
+        debug("CBA4Exporter.close()")
+        if self.__server:
+            self.__server.shutdown()
+            self.__server.server_close()
+            self.__server = None
+            self.__server_thread = None
+        self.stop()
+        if self.__owns_devices:
+            # only read, never started a test, so leave any running
+            for serial, cba in self.__devices:
+                cba.release()
+        self.__devices = []
+        #end close()
+    #end class CBA4Exporter
+
+def __run_exporter():
+    port = 9105
+    if len(sys.argv) > 1:
+        port = int(sys.argv[1])
+    exporter = CBA4Exporter()
+    exporter.serve(port)
+    print("Exporting " + str(len(exporter.get_samples())) + " CBAs on port " + str(port))
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    exporter.close()
+    #end __run_exporter()
+
+if __name__ == "__main__":
+    __run_exporter()
@@ -0,0 +1,322 @@
+"""
+    SUMMARY:
+
+    Drives many West Mountain Radio CBA devices attached to one host.
+
+    Instead of every CBA4 running its own keep-alive thread, the status of
+    every CBA is polled from one bounded thread pool.  A scheduler thread
+    hands out the polls each interval, rotating the order so no CBA is always
+    served last, and never queues a second poll for a CBA whose previous poll
+    hasn't finished.
+
+    AVAILABLE CLASSES:
+
+    CBAFleet - Opens and drives a group of CBA4s.
+
+    Example:
+
+        fleet = fleet.CBAFleet()
+        fleet.do_start(1.0, 10.5)
+        ...
+        samples = fleet.read_samples()
+        fleet.do_stop()
+        fleet.close()
+"""
+# Copyright (c) 2025 - Darren Rook (da66en) (route66@gmail.com)
+# Rights to use this code is made available using the MIT license.
+
+import collections
+import concurrent.futures
+import threading
+import time
+from wmr_cba.wmr_cba import CBA4, debug
+
+class CBAFleet:
+    """
+    A group of CBA4s, driven from one thread pool.
+
+    __init__(devices, max_workers, interval, max_samples) (Constructor) -
+    'devices' is a list of CBA4 objects.  If not provided, every CBA found is
+    opened with CBA4.open_all().  'max_workers' is the size of the thread
+    pool doing USB I/O, 'interval' the seconds between polls of each CBA, and
+    'max_samples' how many samples are kept for each CBA until read by
+    read_samples().
+
+    start() - Start polling every CBA.  Called by do_start().
+
+    stop() - Stop polling.  Any running tests will be stopped by the watchdog
+    of the CBAs, so call do_stop() first.
+
+    close() - Stop all tests and polling, and close any CBA4s opened by the
+    constructor.
+
+    get_serial_numbers() - Returns the serial numbers of the CBAs.
+
+    get_device(serial) - Returns the CBA4 with serial number 'serial'.
+
+    do_start(amps, vstop, serials) - Start a test on several CBAs at once.
+
+    do_stop(serials) - Stop the test on several CBAs at once.
+
+    set_load(amps, vstop, serials) - Change the test current of several CBAs
+    at once, without stopping the tests.
+
+    get_latest() - Returns the latest CBA4Status of every CBA, by serial.
+
+    read_samples() - Returns, and removes, every sample heard since the last
+    call, as lists of CBA4Status by serial.
+
+    add_listener(callback) - 'callback(serial, status)' is called for every
+    sample heard from any CBA.
+
+    remove_listener(callback) - Stop calling 'callback'.
+
+    get_stats() - Returns a dict of polling statistics.
+
+    The operations that take 'serials' act on every CBA if 'serials' isn't
+    provided, and return a dict of True/False (success) by serial number.
+    """
+    def __init__(self, devices=None, max_workers=8, interval=0.75, max_samples=1000):
+        debug("CBAFleet.__init__()")
+        self.__owns_devices = False
+        if devices is None:
+            devices = CBA4.open_all()
+            self.__owns_devices = True
+        self.__interval = interval
+        self.__max_workers = max_workers
+        self.__executor = concurrent.futures.ThreadPoolExecutor(max_workers)
+        self.__lock = threading.Lock()
+        self.__units = collections.OrderedDict()
+        self.__samples = {}
+        self.__latest = {}
+        self.__cba_listeners = {}
+        self.__listeners = []
+        self.__in_flight = set()
+        self.__polls = 0
+        self.__errors = 0
+        self.__skipped = 0
+        self.__started = None
+        self.__stop_event = threading.Event()
+        self.__thread = None
+        for cba in devices:
+            serial = cba.get_serial_number()
+            self.__units[serial] = cba
+            self.__samples[serial] = collections.deque(maxlen=max_samples)
+            self.__latest[serial] = None
+            listener = self.__make_listener(serial)
+            self.__cba_listeners[serial] = listener
+            cba.add_listener(listener)
+        #end __init__
+
+    def __make_listener(self, serial):
+        def listener(status):
+            with self.__lock:
+                self.__samples[serial].append(status)
+                self.__latest[serial] = status
+            for callback in self.__listeners:
+                try:
+                    callback(serial, status)
+                except Exception as e:
+                    debug("CBAFleet listener error: " + str(e))
+        return listener
+        #end __make_listener()
+
+    def get_serial_numbers(self):
+        return list(self.__units.keys())
+        #end get_serial_numbers()
+
+    def get_device(self, serial):
+        return self.__units[serial]
+        #end get_device()
+
+    def start(self):
+        """
+        Start the scheduler thread that polls every CBA each 'interval'.  The
+        polls keep running tests alive (see do_start(keep_alive) of CBA4).
+        """
+        debug("CBAFleet.start()")
+        if self.__thread and self.__thread.is_alive():
+            return
+        self.__stop_event.clear()
+        self.__started = time.monotonic()
+        self.__thread = threading.Thread(target=self.__run, daemon=True)
+        self.__thread.start()
+        #end start()
+
+    def stop(self):
+        debug("CBAFleet.stop()")
+        self.__stop_event.set()
+        if self.__thread:
+            self.__thread.join()
+            self.__thread = None
+        #end stop()
+
+    def close(self):
+        debug("CBAFleet.close()")
+        self.do_stop()
+        self.stop()
+        self.__executor.shutdown(wait=True)
+        for serial, cba in self.__units.items():
+            cba.remove_listener(self.__cba_listeners[serial])
+            if self.__owns_devices:
+                cba.close()
+        self.__units.clear()
+        #end close()
+
+    def __poll(self, serial):
+        try:
+            status = self.__units[serial].get_status(max_age=0)
+        except Exception as e:
+            debug("CBAFleet poll error: " + str(e))
+            status = None
+        with self.__lock:
+            self.__in_flight.discard(serial)
+            self.__polls += 1
+            if not status:
+                self.__errors += 1
+        #end __poll()
+
+    def __run(self):
+        rotate = 0
+        next_tick = time.monotonic()
+        while not self.__stop_event.is_set():
+            serials = list(self.__units.keys())
+            if serials:
+                # rotate the order each tick, so every CBA takes turns being first
+                rotate = (rotate + 1) % len(serials)
+                serials = serials[rotate:] + serials[:rotate]
+            for serial in serials:
+                with self.__lock:
+                    if serial in self.__in_flight:
+                        self.__skipped += 1
+                        continue
+                    self.__in_flight.add(serial)
+                self.__executor.submit(self.__poll, serial)
+            next_tick += self.__interval
+            remain = next_tick - time.monotonic()
+            if remain < 0:
+                # fell behind, don't try to catch up with a burst of polls
+                next_tick = time.monotonic()
+                remain = 0
+            self.__stop_event.wait(remain)
+            #end loop
+        #end __run()
+
+    def __group(self, operation, serials):
+        """
+        Run 'operation(serial, cba)' on every CBA in 'serials' concurrently,
+        returns a dict of True/False (success) by serial.
+        """
+        if serials is None:
+            serials = list(self.__units.keys())
+        futures = {}
+        for serial in serials:
+            futures[serial] = self.__executor.submit(operation, serial, self.__units[serial])
+        results = {}
+        for serial, future in futures.items():
+            try:
+                future.result()
+                results[serial] = True
+            except Exception as e:
+                debug("CBAFleet error on " + str(serial) + ": " + str(e))
+                results[serial] = False
+        return results
+        #end __group()
+
+    def do_start(self, amps, vstop=0, serials=None):
+        """
+        Start a test on several CBAs at once.  The CBAs are kept alive by the
+        polling of this fleet, not by threads of their own.
+
+        Parameters: \n
+        amps - Test current (float), or a dict of test current by serial.
+        vstop - Stop voltage (float), or a dict of stop voltage by serial.
+        serials - Serial numbers of the CBAs to start, all if not provided.
+        """
+        debug("CBAFleet.do_start()")
+        def start(serial, cba):
+            a = amps[serial] if isinstance(amps, dict) else amps
+            v = vstop.get(serial, 0) if isinstance(vstop, dict) else vstop
+            cba.do_start(a, v, keep_alive=False)
+        results = self.__group(start, serials)
+        self.start()
+        return results
+        #end do_start()
+
+    def set_load(self, amps, vstop=None, serials=None):
+        """
+        Change the test current of several CBAs at once, without stopping
+        their tests first (see CBA4.set_load()).  'amps' and 'vstop' are the
+        same as do_start(), but the stop voltage is left alone if 'vstop'
+        isn't provided.
+        """
+        debug("CBAFleet.set_load()")
+        def set_load(serial, cba):
+            a = amps[serial] if isinstance(amps, dict) else amps
+            v = vstop.get(serial) if isinstance(vstop, dict) else vstop
+            if cba.set_load(a, v) is None:
+                raise IOError("no response")
+        return self.__group(set_load, serials)
+        #end set_load()
+
+    def do_stop(self, serials=None):
+        """
+        Stop the test on several CBAs at once.
+        """
+        debug("CBAFleet.do_stop()")
+        return self.__group(lambda serial, cba: cba.do_stop(), serials)
+        #end do_stop()
+
+    def get_latest(self):
+        with self.__lock:
+            return dict(self.__latest)
+        #end get_latest()
+
+    def read_samples(self):
+        """
+        Returns every sample heard since the last call, and forgets them.
+
+        Returns:    \n
+        A dict, by serial number, of lists of CBA4Status (oldest first).
+        """
+        result = {}
+        with self.__lock:
+            for serial, samples in self.__samples.items():
+                result[serial] = list(samples)
+                samples.clear()
+        return result
+        #end read_samples()
+
+    def add_listener(self, callback):
+        """
+        Call 'callback(serial, status)' for every status heard from any CBA.
+        It is called from the thread pool, so should return quickly.
+        """
+        self.__listeners = self.__listeners + [callback]
+        #end add_listener()
+
+    def remove_listener(self, callback):
+        self.__listeners = [l for l in self.__listeners if l != callback]
+        #end remove_listener()
+
+    def get_stats(self):
+        """
+        Returns a dict of:
+        'devices' - number of CBAs.
+        'polls' - number of polls done.
+        'errors' - number of polls that failed.
+        'skipped' - polls skipped because the previous poll of the same CBA
+        hadn't finished (the pool can't keep up with 'interval').
+        'polls_per_second' - average poll rate since start().
+        """
+        with self.__lock:
+            elapsed = (time.monotonic() - self.__started) if self.__started else 0
+            return {
+                "devices": len(self.__units),
+                "polls": self.__polls,
+                "errors": self.__errors,
+                "skipped": self.__skipped,
+                "polls_per_second": (self.__polls / elapsed) if elapsed else 0.0,
+            }
+        #end get_stats()
+    #end class CBAFleet
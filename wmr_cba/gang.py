@@ -0,0 +1,473 @@
+"""
+    SUMMARY:
+
+    Gangs several West Mountain Radio CBA devices, connected in parallel to
+    the same battery, into one virtual analyzer for tests beyond the current
+    or power limit of a single CBA.
+
+    The total current is split between the CBAs, which are started and
+    stopped together, and polled on a shared tick (see sync.SyncGroup).
+    When a CBA reports power limiting it can't draw its share, so the power
+    it manages is learned, its share is cut to just under that, and the
+    rest handed to the CBAs with room to spare.  If any CBA stops (vstop,
+    high temperature, watchdog...) the others are stopped straight away.
+    The samples of every CBA on a tick are combined into one GangSample:
+    the mean voltage and the total current.
+
+    AVAILABLE CLASSES:
+
+    GangedCBA4 - A group of CBA4s running one test together.
+
+    GangSample - The combined sample of every CBA in the gang for one tick.
+
+    Example:
+
+        gang = gang.GangedCBA4([cba1, cba2, cba3])
+        gang.do_start(90.0, 10.5)
+        ...
+        for sample in gang.read_samples():
+            print(sample.timestamp, sample.voltage, sample.measured_current)
+        gang.close()
+"""
+# Copyright (c) 2025 - Darren Rook (da66en) (route66@gmail.com)
+# Rights to use this code is made available using the MIT license.
+
+import collections
+import concurrent.futures
+import math
+import queue
+import threading
+from wmr_cba.wmr_cba import CBA4, debug
+from wmr_cba.sync import SyncGroup
+
+class GangSample:
+    """
+    The combined sample of every CBA of a GangedCBA4, for one tick.  Has the
+    same fields as CBA4Status (except 'raw' and 'rtt'), plus:
+
+    timestamp - When the tick was due, as time.time().
+    voltage - Mean voltage of the CBAs that responded.
+    set_current - Total current the gang was asked for.
+    measured_current - Total current measured by the CBAs.
+    power - Total power, in Watts.
+    flags - 0x02 (running) if every CBA that responded is running, 0x10
+    (power limited) and 0x20 (high temperature) if any CBA reported them.
+    units - Dict of CBA4Status by serial number, None for a CBA that didn't
+    respond.
+    skew - Seconds between the earliest and latest sample.
+    """
+    __slots__ = ('timestamp', 'voltage', 'set_current', 'measured_current', 'power', 'flags', 'units', 'skew')
+
+    def __init__(self, frame, set_current):
+        statuses = [s for s in frame.statuses.values() if s]
+        self.timestamp = frame.tick_time
+        self.voltage = (sum(s.voltage for s in statuses) / len(statuses)) if statuses else 0.0
+        self.set_current = set_current
+        self.measured_current = sum(s.measured_current for s in statuses)
+        self.power = sum(s.measured_current * s.voltage for s in statuses)
+        self.flags = 0x02 if (statuses and all(s.is_running() for s in statuses)) else 0
+        for s in statuses:
+            self.flags |= s.flags & 0x30
+        self.units = dict(frame.statuses)
+        self.skew = frame.skew
+        #end __init__
+
+    def is_running(self):
+        return ((self.flags & 2) == 2)
+        #end is_running()
+
+    def is_power_limited(self):
+        return ((self.flags & 0x10) == 0x10)
+        #end is_power_limited()
+
+    def is_high_temp(self):
+        return ((self.flags & 0x20) == 0x20)
+        #end is_high_temp()
+
+    def __repr__(self):
+        return "GangSample(voltage=" + str(self.voltage) + ", set_current=" + str(self.set_current) + \
+            ", measured_current=" + str(self.measured_current) + ", flags=" + hex(self.flags) + ")"
+        #end __repr__()
+    #end class GangSample
+
+class GangedCBA4:
+    """
+    Runs one test on a group of CBA4s connected in parallel to the same
+    battery, sharing the load between them.
+
+    The total current is first split evenly, up to 'max_current' per CBA.
+    Each time a CBA reports power limiting, the power it managed (measured
+    current times voltage) is remembered as its limit for the rest of the
+    test, and the total is split again: every CBA with a known limit gets at
+    most 'margin' under it, and the rest is shared evenly between the
+    others.  If the CBAs can't draw the total between them, each is left at
+    its limit and the samples stay power limited.
+
+    __init__(devices, interval, margin, max_current, max_samples)
+    (Constructor) - 'devices' is a list of CBA4, every CBA found if not
+    provided.  'interval' is the seconds between polls, which keep the tests
+    alive so must be less than 0.75s.  'max_samples' is how many samples
+    are kept until read by read_samples().
+
+    do_start(amps, vstop) - Start a test drawing 'amps' in total from the
+    battery, stopping when the voltage falls below 'vstop' (0 for none).
+    Raises ValueError if 'amps' is more than the CBAs can draw, and IOError
+    (after stopping the others) if a CBA fails to start.
+
+    set_load(amps) - Change the total current of the running test.
+
+    do_stop() - Stop every CBA at once.
+
+    close() - Stop the test and polling, and close any CBA4s opened by the
+    constructor.
+
+    is_running() - True while the test is running.
+
+    get_stop_reason() - Why the test last stopped, None if still running or
+    never started.
+
+    get_serial_numbers() - Returns the serial numbers of the CBAs.
+
+    get_shares() - Returns a dict, by serial, of the current each CBA is
+    set to draw.
+
+    get_latest_sample() - Returns the last GangSample, None if none yet.
+
+    read_samples() - Returns, and removes, the samples since the last call.
+
+    add_listener(callback) - 'callback(sample)' is called for every
+    GangSample.
+
+    remove_listener(callback) - Stop calling 'callback'.
+
+    get_stats() - Returns a dict of rebalancing and timing statistics.
+    """
+    # Most current a CBA IV can draw, in Amps.
+    MAX_CURRENT = 40.0
+
+    def __init__(self, devices=None, interval=0.5, margin=0.05, max_current=MAX_CURRENT, max_samples=10000):
+        debug("GangedCBA4.__init__()")
+        self.__owns_devices = False
+        if devices is None:
+            devices = CBA4.open_all()
+            self.__owns_devices = True
+        self.__units = collections.OrderedDict((cba.get_serial_number(), cba) for cba in devices)
+        self.__group = SyncGroup(devices, interval, max_frames=1)
+        self.__margin = margin
+        self.__max_current = max_current
+        self.__executor = concurrent.futures.ThreadPoolExecutor(max(len(self.__units), 1))
+        self.__lock = threading.RLock()
+        self.__samples_lock = threading.Lock()
+        self.__samples = collections.deque(maxlen=max_samples)
+        self.__latest = None
+        self.__listeners = []
+        self.__frames = queue.Queue()
+        self.__control = None
+        self.__running = False
+        self.__stop_reason = None
+        self.__amps = 0.0
+        self.__vstop = 0
+        self.__shares = {}
+        self.__power_limits = {}
+        self.__settle_tick = -1
+        self.__rebalances = 0
+        self.__saturated = 0
+        self.__group.add_listener(self.__on_frame)
+        #end __init__
+
+    def get_serial_numbers(self):
+        return list(self.__units.keys())
+        #end get_serial_numbers()
+
+    def get_shares(self):
+        with self.__lock:
+            return dict(self.__shares)
+        #end get_shares()
+
+    def is_running(self):
+        return self.__running
+        #end is_running()
+
+    def get_stop_reason(self):
+        return self.__stop_reason
+        #end get_stop_reason()
+
+    def __all(self, operation, serials=None):
+        """
+        Run 'operation(serial, cba)' on every CBA at the same moment, each on
+        its own thread, returns a dict of exceptions by serial for those that
+        failed.
+        """
+        if serials is None:
+            serials = list(self.__units.keys())
+        barrier = threading.Barrier(len(serials))
+        def run(serial):
+            # line every thread up first, so the USB messages go out together
+            barrier.wait()
+            operation(serial, self.__units[serial])
+        futures = dict((serial, self.__executor.submit(run, serial)) for serial in serials)
+        errors = {}
+        for serial, future in futures.items():
+            try:
+                future.result()
+            except Exception as e:
+                debug("GangedCBA4 error on " + str(serial) + ": " + str(e))
+                errors[serial] = e
+        return errors
+        #end __all()
+
+    def __split(self, amps, volts):
+        """
+        Split 'amps' between the CBAs, returns a dict of amps by serial, and
+        whether the CBAs can draw that much between them.
+        """
+        limits = {}
+        for serial in self.__units:
+            limit = self.__max_current
+            watts = self.__power_limits.get(serial)
+            if watts and (volts > 0):
+                limit = min(limit, watts * (1.0 - self.__margin) / volts)
+            limits[serial] = limit
+        saturated = sum(limits.values()) < amps
+        if saturated:
+            # can't be done, every CBA draws all it can
+            for serial in limits:
+                watts = self.__power_limits.get(serial)
+                if watts and (volts > 0):
+                    limits[serial] = min(self.__max_current, watts / volts)
+            return limits, True
+        # fill up the CBAs with the lowest limits first, sharing the rest
+        # evenly between the others
+        shares = {}
+        left = amps
+        remaining = dict(limits)
+        while remaining:
+            even = left / len(remaining)
+            capped = [serial for serial, limit in remaining.items() if limit < even]
+            if not capped:
+                for serial in remaining:
+                    shares[serial] = even
+                break
+            for serial in capped:
+                shares[serial] = remaining.pop(serial)
+                left -= shares[serial]
+        return shares, saturated
+        #end __split()
+
+    def do_start(self, amps, vstop=0):
+        """
+        Start a test drawing 'amps' in total, split between the CBAs, which
+        are all started at the same moment.  Every CBA is given 'vstop' too,
+        so each stops itself if the voltage falls below it, and the others
+        are then stopped by this gang.
+        """
+        debug("GangedCBA4.do_start()")
+        if amps > self.__max_current * len(self.__units):
+            raise ValueError("GangedCBA4 can draw at most " + str(self.__max_current * len(self.__units)) + "A")
+        self.do_stop()
+        with self.__lock:
+            self.__power_limits = {}
+            self.__settle_tick = -1
+            self.__amps = amps
+            self.__vstop = vstop
+            self.__shares, saturated = self.__split(amps, 0.0)
+            shares = dict(self.__shares)
+            errors = self.__all(lambda serial, cba: cba.do_start(shares[serial], vstop, keep_alive=False))
+            if errors:
+                self.__all(lambda serial, cba: cba.do_stop())
+                self.__stop_reason = "start failed on " + ", ".join(str(s) for s in errors)
+                raise IOError("GangedCBA4 failed to start " + ", ".join(str(s) for s in errors))
+            self.__running = True
+            self.__stop_reason = None
+            self.__control = threading.Thread(target=self.__run_control, daemon=True)
+            self.__control.start()
+        self.__group.start()
+        #end do_start()
+
+    def set_load(self, amps):
+        """
+        Change the total current of the running test, split again between
+        the CBAs with what has been learned about their limits.
+        """
+        debug("GangedCBA4.set_load()")
+        with self.__lock:
+            if not self.__running:
+                return
+            self.__amps = amps
+            sample = self.__latest
+            self.__apply(sample.voltage if sample else 0.0, self.__group_tick())
+        #end set_load()
+
+    def do_stop(self):
+        """
+        Stop every CBA at the same moment, and the polling.
+        """
+        debug("GangedCBA4.do_stop()")
+        self.__halt("stopped")
+        control = self.__control
+        if control:
+            self.__frames.put(None)
+            if control is not threading.current_thread():
+                control.join()
+            self.__control = None
+        #end do_stop()
+
+    def close(self):
+        debug("GangedCBA4.close()")
+        self.do_stop()
+        self.__group.close()
+        self.__executor.shutdown()
+        if self.__owns_devices:
+            for cba in self.__units.values():
+                cba.close()
+        self.__units.clear()
+        #end close()
+
+    def __halt(self, reason):
+        """
+        Stop every CBA and the polling, recording 'reason'.
+        """
+        with self.__lock:
+            if not self.__running:
+                return
+            self.__running = False
+            self.__stop_reason = reason
+            self.__all(lambda serial, cba: cba.do_stop())
+        self.__group.stop()
+        #end __halt()
+
+    def __group_tick(self):
+        frame = self.__group.get_latest_frame()
+        return frame.tick if frame else -1
+        #end __group_tick()
+
+    def __apply(self, volts, tick):
+        """
+        Split the total current again, and send the CBAs whose share changed
+        their new share.  Called with __lock held.
+        """
+        shares, saturated = self.__split(self.__amps, volts)
+        if saturated:
+            self.__saturated += 1
+        changed = [serial for serial, amps in shares.items()
+            if abs(amps - self.__shares.get(serial, 0.0)) > 0.001]
+        self.__shares = shares
+        if not changed:
+            return
+        self.__rebalances += 1
+        errors = self.__all(lambda serial, cba: cba.set_load(shares[serial]), changed)
+        for serial in errors:
+            debug("GangedCBA4 couldn't set the load of " + str(serial))
+        # samples of the next tick may have been taken before the change
+        self.__settle_tick = max(tick, self.__group_tick()) + 1
+        #end __apply()
+
+    def __on_frame(self, frame):
+        """
+        Listener of the SyncGroup, combine the frame into a GangSample and pass
+        it on.
+        """
+        sample = GangSample(frame, self.__amps)
+        with self.__samples_lock:
+            self.__samples.append(sample)
+            self.__latest = sample
+        for callback in self.__listeners:
+            try:
+                callback(sample)
+            except Exception as e:
+                debug("GangedCBA4 listener error: " + str(e))
+        self.__frames.put((frame, sample))
+        #end __on_frame()
+
+    def __run_control(self):
+        """
+        Watch the samples of a running test, stopping every CBA if one of them
+        stops, and rebalancing when one is power limited.
+        """
+        while True:
+            item = self.__frames.get()
+            if item is None:
+                break
+            frame, sample = item
+            with self.__lock:
+                if not self.__running:
+                    continue
+                stopped = [serial for serial, s in frame.statuses.items() if s and not s.is_running()]
+                if stopped:
+                    reason = "stopped by " + ", ".join(str(s) for s in stopped)
+                    if any(frame.statuses[s].is_high_temp() for s in stopped):
+                        reason += " (high temperature)"
+                    self.__halt(reason)
+                    continue
+                if self.__vstop and (0 < sample.voltage < self.__vstop):
+                    self.__halt("vstop")
+                    continue
+                if frame.tick < self.__settle_tick:
+                    continue
+                limited = [serial for serial, s in frame.statuses.items() if s and s.is_power_limited()]
+                if not limited:
+                    continue
+                for serial in limited:
+                    status = frame.statuses[serial]
+                    watts = status.measured_current * status.voltage
+                    if watts > 0:
+                        self.__power_limits[serial] = min(self.__power_limits.get(serial, math.inf), watts)
+                self.__apply(sample.voltage, frame.tick)
+            #end loop
+        #end __run_control()
+
+    def get_latest_sample(self):
+        return self.__latest
+        #end get_latest_sample()
+
+    def read_samples(self):
+        """
+        Returns every sample since the last call, and forgets them.
+
+        Returns:    \n
+        A list of GangSample, oldest first.
+        """
+        with self.__samples_lock:
+            samples = list(self.__samples)
+            self.__samples.clear()
+        return samples
+        #end read_samples()
+
+    def add_listener(self, callback):
+        """
+        Call 'callback(sample)' with every GangSample.  It is called from the
+        polling threads, so should return quickly.
+        """
+        self.__listeners = self.__listeners + [callback]
+        #end add_listener()
+
+    def remove_listener(self, callback):
+        self.__listeners = [l for l in self.__listeners if l != callback]
+        #end remove_listener()
+
+    def get_stats(self):
+        """
+        Returns a dict of:
+        'rebalances' - number of times the shares were changed.
+        'saturated' - rebalances that found the CBAs couldn't draw the
+        total between them.
+        'shares' - dict by serial of the current each CBA is set to draw.
+        'power_limits' - dict by serial of the power each CBA was learned
+        to be limited to, in Watts, for those that have been limited.
+        'stop_reason' - see get_stop_reason().
+        'skew_p95', 'skew_max' - seconds between the samples of a tick, see
+        SyncGroup.get_stats().
+        """
+        group = self.__group.get_stats()
+        with self.__lock:
+            return {
+                "rebalances": self.__rebalances,
+                "saturated": self.__saturated,
+                "shares": dict(self.__shares),
+                "power_limits": dict(self.__power_limits),
+                "stop_reason": self.__stop_reason,
+                "skew_p95": group["skew_p95"],
+                "skew_max": group["skew_max"],
+            }
+        #end get_stats()
+    #end class GangedCBA4
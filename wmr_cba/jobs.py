@@ -0,0 +1,547 @@
+"""
+    SUMMARY:
+
+    A queue of battery tests, run on whichever CBA is free.
+
+    Tests are submitted with their current, stop voltage, maximum duration
+    and priority, and are started on the next free CBA, highest priority
+    first (oldest first for equal priorities).  A test is complete when the
+    running flag (status byte 1) of its CBA clears, e.g. when the battery
+    reaches the stop voltage.  The queue is saved to a JSON file on every
+    change, so a restarted service carries on where it left off.
+
+    AVAILABLE CLASSES:
+
+    TestJob - One test, and what happened to it.
+
+    JobScheduler - Runs queued TestJobs on a group of CBAs.
+
+    Example:
+
+        scheduler = jobs.JobScheduler(state_path="queue.json")
+        scheduler.submit(2.0, 10.5, max_duration=4*3600, name="pack 12 cell 3")
+        scheduler.start()
+        ...
+        print(scheduler.get_stats())
+        scheduler.close()
+"""
+# Copyright (c) 2025 - Darren Rook (da66en) (route66@gmail.com)
+# Rights to use this code is made available using the MIT license.
+
+import json
+import os
+import threading
+import time
+from wmr_cba.fleet import CBAFleet
+from wmr_cba.wmr_cba import debug, summarize
+
+class TestJob:
+    """
+    One test in a JobScheduler queue.
+
+    job_id - Unique number, given by JobScheduler.submit().
+    name - Optional label, e.g. which battery.
+    amps, vstop - Test current and stop voltage, see CBA4.do_start().
+    max_duration - The test is stopped after this many seconds, None for no
+    limit.
+    priority - Higher priority jobs are started first.
+    serial - Only run on the CBA with this serial number, None for any.
+    state - One of QUEUED, RUNNING, DONE, FAILED, TIMEOUT, CANCELLED.
+    reason - Why a test ended, e.g. 'vstop', 'high_temp', 'max_duration',
+    'no_cba'.
+    assigned - Serial number of the CBA the test ran on.
+    submitted, started, finished - When (time.time()), None if not yet.
+    amp_hours, watt_hours - Drawn from the battery so far.
+    end_voltage - The last voltage measured while running.
+    attempts - Times the test was started (restarts after a service restart
+    count too).
+    """
+    QUEUED = "queued"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+    TIMEOUT = "timeout"
+    CANCELLED = "cancelled"
+
+    FIELDS = ('job_id', 'name', 'amps', 'vstop', 'max_duration', 'priority', 'serial',
+        'state', 'reason', 'assigned', 'submitted', 'started', 'finished',
+        'amp_hours', 'watt_hours', 'end_voltage', 'attempts')
+
+    __slots__ = FIELDS
+
+    def __init__(self, job_id, amps, vstop=0, max_duration=None, priority=0, serial=None, name=None):
+        self.job_id = job_id
+        self.name = name
+        self.amps = amps
+        self.vstop = vstop
+        self.max_duration = max_duration
+        self.priority = priority
+        self.serial = serial
+        self.state = TestJob.QUEUED
+        self.reason = None
+        self.assigned = None
+        self.submitted = time.time()
+        self.started = None
+        self.finished = None
+        self.amp_hours = 0.0
+        self.watt_hours = 0.0
+        self.end_voltage = None
+        self.attempts = 0
+        #end __init__
+
+    def is_finished(self):
+        return self.state not in (TestJob.QUEUED, TestJob.RUNNING)
+        #end is_finished()
+
+    def get_wait(self):
+        """
+        Returns seconds spent queued before starting, None if not started.
+        """
+        if self.started is None:
+            return None
+        return self.started - self.submitted
+        #end get_wait()
+
+    def to_dict(self):
+        return dict((field, getattr(self, field)) for field in TestJob.FIELDS)
+        #end to_dict()
+
+    @staticmethod
+    def from_dict(d):
+        job = TestJob(d["job_id"], d["amps"])
+        for field in TestJob.FIELDS:
+            if field in d:
+                setattr(job, field, d[field])
+        return job
+        #end from_dict()
+
+    def __repr__(self):
+        return "TestJob(job_id=" + str(self.job_id) + ", name=" + repr(self.name) + ", state=" + self.state + \
+            ", assigned=" + str(self.assigned) + ")"
+        #end __repr__()
+    #end class TestJob
+
+class JobScheduler:
+    """
+    Runs queued TestJobs on a group of CBAs, driven by a CBAFleet.
+
+    __init__(devices, state_path, interval, max_history) (Constructor) -
+    'devices' is a list of CBA4, every CBA found if not provided.  The queue
+    is saved to, and restored from, 'state_path' if provided.  'interval' is
+    the seconds between checks of the CBAs (and polls of the fleet), and
+    'max_history' how many finished jobs are kept.  Jobs that were running
+    when the state was saved are queued again, as their tests will have been
+    stopped by the watchdog of the CBAs.  Unfinished jobs for a CBA that
+    isn't in 'devices' fail, with the reason 'no_cba'.
+
+    submit(amps, vstop, max_duration, priority, serial, name) - Queue a test,
+    returns its job_id.
+
+    cancel(job_id) - Remove a queued test, or stop a running one.
+
+    get_job(job_id) - Returns the TestJob, None if not known.
+
+    get_jobs(state) - Returns a list of TestJob, all if 'state' isn't given.
+
+    start() - Start running tests.
+
+    stop() - Stop starting tests.  Running tests are stopped.
+
+    close() - stop(), and close any CBA4s opened by the constructor.
+
+    wait_idle(timeout) - Wait until every queued test has finished.
+
+    add_listener(callback) - 'callback(job)' is called whenever a job
+    changes state.
+
+    remove_listener(callback) - Stop calling 'callback'.
+
+    get_stats() - Returns a dict of utilization and queue wait statistics.
+    """
+    # Seconds after starting a test before a CBA that hasn't been seen
+    # running is taken as having finished already.
+    START_GRACE = 3.0
+
+    def __init__(self, devices=None, state_path=None, interval=0.5, max_history=1000):
+        debug("JobScheduler.__init__()")
+        self.__fleet = CBAFleet(devices, max_workers=8, interval=min(interval, 0.5))
+        self.__serials = self.__fleet.get_serial_numbers()
+        self.__state_path = state_path
+        self.__interval = interval
+        self.__max_history = max_history
+        self.__cond = threading.Condition()
+        self.__jobs = {}
+        self.__next_id = 1
+        self.__running = {}     # job_id by serial
+        self.__seen_running = set()
+        self.__last_sample = {}
+        self.__listeners = []
+        self.__stop_event = threading.Event()
+        self.__thread = None
+        self.__started = None
+        self.__busy = dict((serial, 0.0) for serial in self.__serials)
+        self.__load()
+        self.__fleet.add_listener(self.__on_sample)
+        #end __init__
+
+    def __load(self):
+        if not self.__state_path:
+            return
+        try:
+            with open(self.__state_path, "r") as f:
+                state = json.load(f)
+        except OSError:
+            return
+        except ValueError as e:
+            debug("JobScheduler state error: " + str(e))
+            return
+        self.__next_id = state.get("next_id", 1)
+        failed = False
+        for d in state.get("jobs", []):
+            job = TestJob.from_dict(d)
+            if job.state == TestJob.RUNNING:
+                # the service stopped mid test, run it again
+                job.state = TestJob.QUEUED
+                job.assigned = None
+                job.started = None
+            if (not job.is_finished()) and (job.serial is not None) and (job.serial not in self.__serials):
+                # submit() would have refused it, and it would wait forever
+                debug("JobScheduler: no CBA with serial number " + str(job.serial) + " for job " + str(job.job_id))
+                self.__finish(job, TestJob.FAILED, "no_cba")
+                failed = True
+            self.__jobs[job.job_id] = job
+        if failed:
+            with self.__cond:
+                self.__save()
+        #end __load()
+
+    def __save(self):
+        """
+        Write the queue to 'state_path'.  Called with __cond held.
+        """
+        if not self.__state_path:
+            return
+        finished = [job for job in self.__jobs.values() if job.is_finished()]
+        if len(finished) > self.__max_history:
+            finished.sort(key=lambda job: job.finished)
+            for job in finished[:len(finished) - self.__max_history]:
+                del self.__jobs[job.job_id]
+        state = {
+            "next_id": self.__next_id,
+            "jobs": [job.to_dict() for job in self.__jobs.values()],
+        }
+        try:
+            directory = os.path.dirname(self.__state_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            tmp = self.__state_path + "." + str(os.getpid()) + ".tmp"
+            with open(tmp, "w") as f:
+                json.dump(state, f)
+            os.replace(tmp, self.__state_path)
+        except OSError as e:
+            debug("JobScheduler save error: " + str(e))
+        #end __save()
+
+    def __changed(self, jobs):
+        """
+        Save the queue and tell the listeners about 'jobs'.  Called without
+        __cond held.
+        """
+        if not jobs:
+            return
+        with self.__cond:
+            self.__save()
+            self.__cond.notify_all()
+        for job in jobs:
+            for callback in self.__listeners:
+                try:
+                    callback(job)
+                except Exception as e:
+                    debug("JobScheduler listener error: " + str(e))
+        #end __changed()
+
+    def submit(self, amps, vstop=0, max_duration=None, priority=0, serial=None, name=None):
+        """
+        Queue a test.
+
+        Parameters: \n
+        amps - Test current.
+        vstop - Stop voltage, 0 for none.
+        max_duration - Stop the test after this many seconds.
+        priority - Higher priority tests are started first.
+        serial - Only run on the CBA with this serial number.
+        name - Optional label.
+
+        Returns:    \n
+        The job_id of the test.
+        """
+        if (serial is not None) and (serial not in self.__serials):
+            raise ValueError("no CBA with serial number " + str(serial))
+        with self.__cond:
+            job = TestJob(self.__next_id, amps, vstop, max_duration, priority, serial, name)
+            self.__next_id += 1
+            self.__jobs[job.job_id] = job
+        self.__changed([job])
+        return job.job_id
+        #end submit()
+
+    def cancel(self, job_id):
+        """
+        Cancel a test.  Returns False if it had already finished.
+        """
+        with self.__cond:
+            job = self.__jobs.get(job_id)
+            if not job or job.is_finished():
+                return False
+            serial = job.assigned if job.state == TestJob.RUNNING else None
+        if serial is not None:
+            self.__fleet.do_stop([serial])
+        with self.__cond:
+            self.__finish(job, TestJob.CANCELLED, "cancelled")
+        self.__changed([job])
+        return True
+        #end cancel()
+
+    def get_job(self, job_id):
+        with self.__cond:
+            return self.__jobs.get(job_id)
+        #end get_job()
+
+    def get_jobs(self, state=None):
+        with self.__cond:
+            jobs = [job for job in self.__jobs.values() if (state is None) or (job.state == state)]
+        jobs.sort(key=lambda job: job.job_id)
+        return jobs
+        #end get_jobs()
+
+    def start(self):
+        debug("JobScheduler.start()")
+        if self.__thread and self.__thread.is_alive():
+            return
+        self.__stop_event.clear()
+        self.__started = time.time()
+        self.__fleet.start()
+        self.__thread = threading.Thread(target=self.__run, daemon=True)
+        self.__thread.start()
+        #end start()
+
+    def stop(self):
+        """
+        Stop starting tests.  Running tests are stopped and queued again.
+        """
+        debug("JobScheduler.stop()")
+        self.__stop_event.set()
+        if self.__thread:
+            self.__thread.join()
+            self.__thread = None
+        with self.__cond:
+            serials = list(self.__running.keys())
+        if serials:
+            self.__fleet.do_stop(serials)
+        requeued = []
+        with self.__cond:
+            now = time.time()
+            for serial, job_id in list(self.__running.items()):
+                job = self.__jobs[job_id]
+                self.__busy[serial] += now - job.started
+                job.state = TestJob.QUEUED
+                job.assigned = None
+                job.started = None
+                requeued.append(job)
+            self.__running.clear()
+        self.__changed(requeued)
+        self.__fleet.stop()
+        #end stop()
+
+    def close(self):
+        debug("JobScheduler.close()")
+        self.stop()
+        self.__fleet.remove_listener(self.__on_sample)
+        self.__fleet.close()
+        #end close()
+
+    def wait_idle(self, timeout=None):
+        """
+        Wait until no test is queued or running.  Returns False on timeout.
+        """
+        with self.__cond:
+            return self.__cond.wait_for(lambda: all(job.is_finished() for job in self.__jobs.values()), timeout)
+        #end wait_idle()
+
+    def add_listener(self, callback):
+        self.__listeners = self.__listeners + [callback]
+        #end add_listener()
+
+    def remove_listener(self, callback):
+        self.__listeners = [l for l in self.__listeners if l != callback]
+        #end remove_listener()
+
+    def __on_sample(self, serial, status):
+        """
+        Called by the fleet for every status heard, adds up the capacity
+        drawn by the running test.
+        """
+        with self.__cond:
+            job_id = self.__running.get(serial)
+            if job_id is None:
+                return
+            job = self.__jobs[job_id]
+            last = self.__last_sample.get(serial)
+            self.__last_sample[serial] = status
+            if not status.is_running() or (status.timestamp < job.started):
+                return
+            self.__seen_running.add(job_id)
+            job.end_voltage = status.voltage
+            if last is not None and last.is_running() and (last.timestamp >= job.started):
+                dt = (status.timestamp - last.timestamp) / 3600.0
+                job.amp_hours += last.measured_current * dt
+                job.watt_hours += last.measured_current * last.voltage * dt
+        #end __on_sample()
+
+    def __finish(self, job, state, reason):
+        """
+        Called with __cond held.
+        """
+        now = time.time()
+        if job.state == TestJob.RUNNING:
+            self.__busy[job.assigned] += now - job.started
+            self.__running.pop(job.assigned, None)
+            self.__last_sample.pop(job.assigned, None)
+            self.__seen_running.discard(job.job_id)
+        job.state = state
+        job.reason = reason
+        job.finished = now
+        #end __finish()
+
+    def __check_running(self):
+        """
+        Finish the tests whose CBA stopped running, or that ran too long.
+        """
+        latest = self.__fleet.get_latest()
+        timed_out = []
+        finished = []
+        with self.__cond:
+            now = time.time()
+            for serial, job_id in list(self.__running.items()):
+                job = self.__jobs[job_id]
+                status = latest.get(serial)
+                if job.max_duration and ((now - job.started) >= job.max_duration):
+                    timed_out.append(job)
+                    continue
+                if not status or (status.timestamp < job.started) or status.is_running():
+                    continue
+                if (job_id not in self.__seen_running) and ((now - job.started) < JobScheduler.START_GRACE):
+                    # may be a poll sent before the test was started
+                    continue
+                if status.is_high_temp():
+                    self.__finish(job, TestJob.FAILED, "high_temp")
+                else:
+                    self.__finish(job, TestJob.DONE, "vstop" if job.vstop else "stopped")
+                finished.append(job)
+        if timed_out:
+            self.__fleet.do_stop([job.assigned for job in timed_out])
+            with self.__cond:
+                for job in timed_out:
+                    self.__finish(job, TestJob.TIMEOUT, "max_duration")
+        return finished + timed_out
+        #end __check_running()
+
+    def __next_job(self, serial):
+        """
+        Returns the queued job to run next on 'serial'.  Called with __cond
+        held.
+        """
+        best = None
+        for job in self.__jobs.values():
+            if (job.state != TestJob.QUEUED) or ((job.serial is not None) and (job.serial != serial)):
+                continue
+            if (best is None) or ((job.priority, -job.job_id) > (best.priority, -best.job_id)):
+                best = job
+        return best
+        #end __next_job()
+
+    def __dispatch(self):
+        """
+        Start queued tests on the free CBAs.
+        """
+        starts = []
+        with self.__cond:
+            now = time.time()
+            for serial in self.__serials:
+                if serial in self.__running:
+                    continue
+                job = self.__next_job(serial)
+                if not job:
+                    continue
+                job.state = TestJob.RUNNING
+                job.assigned = serial
+                job.started = now
+                job.reason = None
+                job.attempts += 1
+                self.__running[serial] = job.job_id
+                starts.append(job)
+        if not starts:
+            return []
+        results = self.__fleet.do_start(dict((job.assigned, job.amps) for job in starts),
+            dict((job.assigned, job.vstop) for job in starts), [job.assigned for job in starts])
+        with self.__cond:
+            for job in starts:
+                if not results.get(job.assigned):
+                    self.__finish(job, TestJob.FAILED, "start_failed")
+        return starts
+        #end __dispatch()
+
+    def __run(self):
+        while not self.__stop_event.is_set():
+            try:
+                changed = self.__check_running()
+                changed += self.__dispatch()
+                self.__changed(changed)
+            except Exception as e:
+                debug("JobScheduler error: " + str(e))
+            self.__stop_event.wait(self.__interval)
+            #end loop
+        #end __run()
+
+    def get_stats(self):
+        """
+        Returns a dict of:
+        'queued', 'running', 'done', 'failed', 'timeout', 'cancelled' -
+        number of jobs in each state.
+        'utilization' - fraction of the time since start() the CBAs spent
+        running tests, over all CBAs.
+        'utilization_by_serial' - the same, for each CBA.
+        'wait_mean', 'wait_p95', 'wait_max' - seconds tests spent queued
+        before starting, for every test started.
+        'jobs_per_hour' - tests finished per hour since start().
+        """
+        with self.__cond:
+            now = time.time()
+            counts = dict((state, 0) for state in (TestJob.QUEUED, TestJob.RUNNING, TestJob.DONE,
+                TestJob.FAILED, TestJob.TIMEOUT, TestJob.CANCELLED))
+            waits = []
+            finished_since_start = 0
+            for job in self.__jobs.values():
+                counts[job.state] += 1
+                if job.get_wait() is not None:
+                    waits.append(job.get_wait())
+                if job.is_finished() and self.__started and (job.finished >= self.__started):
+                    finished_since_start += 1
+            busy = dict(self.__busy)
+            for serial, job_id in self.__running.items():
+                busy[serial] += now - self.__jobs[job_id].started
+            elapsed = (now - self.__started) if self.__started else 0.0
+            by_serial = dict((serial, (b / elapsed) if elapsed else 0.0) for serial, b in busy.items())
+            wait = summarize(waits)
+            stats = {
+                "utilization": (sum(busy.values()) / (elapsed * len(busy))) if (elapsed and busy) else 0.0,
+                "utilization_by_serial": by_serial,
+                "wait_mean": wait[0],
+                "wait_p95": wait[1],
+                "wait_max": wait[2],
+                "jobs_per_hour": (finished_since_start * 3600.0 / elapsed) if elapsed else 0.0,
+            }
+            stats.update(counts)
+            return stats
+        #end get_stats()
+    #end class JobScheduler
@@ -0,0 +1,390 @@
+"""
+    SUMMARY:
+
+    A USB interface for CBA devices built on the asynchronous transfer API
+    of libusb, through the python-libusb1 package ('pip install libusb1').
+
+    MpOrLibUsb (pyusb) writes a message, then starts a blocking read of the
+    response, so each transaction waits for a read to be scheduled after the
+    write, and one thread can only have one read outstanding.
+    AsyncLibUsb keeps several IN transfers queued on endpoint 0x81 all the
+    time, completed by a libusb event thread, so a response is picked up by
+    the next bus poll after it's ready, and read() just takes it off a
+    queue.  One event thread serves every AsyncLibUsb, however many CBAs
+    are open.
+
+    AVAILABLE CLASSES:
+
+    AsyncLibUsb - A CBA4 'interface' using queued asynchronous transfers.
+
+    Example:
+
+        cbas = [wmr_cba.CBA4(interface=usb_if) for usb_if in libusb_async.AsyncLibUsb.open_all()]
+        for cba in cbas:
+            print(cba.get_serial_number(), cba.get_status())
+"""
+# Copyright (c) 2025 - Darren Rook (da66en) (route66@gmail.com)
+# Rights to use this code is made available using the MIT license.
+
+import collections
+import threading
+import time
+from wmr_cba.wmr_cba import debug
+
+try:
+    import usb1
+except ImportError:
+    usb1 = None
+
+VENDOR_ID = 0x2405
+PRODUCT_ID = 0x0005
+ENDPOINT_IN = 0x81
+ENDPOINT_OUT = 0x01
+PACKET_SIZE = 64
+
+class _EventThread(threading.Thread):
+    """
+    Owns the libusb context shared by every AsyncLibUsb, and handles its
+    events (completing transfers) until the last AsyncLibUsb is closed.
+    """
+    # Seconds each wait for events may last, how long close() waits at most
+    # for the thread to notice it should stop.
+    EVENT_TIMEOUT = 0.1
+
+    __lock = threading.Lock()
+    __shared = None
+
+    def __init__(self):
+        debug("_EventThread.__init__()")
+        threading.Thread.__init__(self, name="libusb events", daemon=True)
+        self.context = usb1.USBContext()
+        self.context.open()
+        self.__users = 0
+        self.__run = True
+        #end __init__()
+
+    @staticmethod
+    def acquire():
+        """
+        Returns the shared event thread, starting it if needed.  Each call
+        must be matched by a call to release().
+        """
+        with _EventThread.__lock:
+            thread = _EventThread.__shared
+            if thread is None:
+                thread = _EventThread()
+                thread.start()
+                _EventThread.__shared = thread
+            thread.__users += 1
+            return thread
+        #end acquire()
+
+    def release(self):
+        with _EventThread.__lock:
+            self.__users -= 1
+            if self.__users > 0:
+                return
+            if _EventThread.__shared is self:
+                _EventThread.__shared = None
+            self.__run = False
+        if self is not threading.current_thread():
+            self.join()
+        #end release()
+
+    def run(self):
+        debug("_EventThread.run()")
+        while self.__run:
+            try:
+                self.context.handleEventsTimeout(_EventThread.EVENT_TIMEOUT)
+            except usb1.USBErrorInterrupted:
+                pass
+            except usb1.USBError as e:
+                debug("_EventThread error: " + str(e))
+                time.sleep(_EventThread.EVENT_TIMEOUT)
+        self.context.close()
+        #end run()
+    #end class _EventThread
+
+class AsyncLibUsb:
+    """
+    Provides the same functions as MpOrLibUsb, so can be used as the
+    'interface' of a CBA4 (or returned by the 'opener' of a SupervisedUsb),
+    but keeps 'num_transfers' reads queued on the device at all times.
+
+    Responses are queued as they arrive, up to 'max_queued'; if nobody reads
+    them the oldest are dropped.  write() discards the responses still
+    queued, which were meant for earlier messages whose reader gave up
+    waiting, so the next read() gets the response to this message.
+
+    __init__(interface_number, usb_device, num_transfers, max_queued)
+    (Constructor) - Connect to the CBA found 'interface_number'th, or to
+    'usb_device' (a usb1.USBDevice of the shared context, see open_all()) if
+    provided.
+
+    @staticmethod open_all(num_transfers, max_queued) - Returns an
+    AsyncLibUsb for every CBA connected, enumerating them once.
+
+    is_valid() - True if connected, False once closed or unplugged.
+
+    get_path() - Where the device is connected, the same string as
+    MpOrLibUsb.get_path().
+
+    close() - Cancel the queued transfers and close the device.
+
+    write(data, timeout_ms), read(timeout_ms) - Same as MpOrLibUsb.
+
+    get_stats() - Returns a dict of transfer statistics.
+    """
+    def __init__(self, interface_number=0, usb_device=None, num_transfers=4, max_queued=64):
+        debug("AsyncLibUsb.__init__()")
+        if usb1 is None:
+            raise ImportError("AsyncLibUsb needs python-libusb1 (libusb1), which is missing or not installed!")
+        self.__handle = None
+        self.__path = None
+        self.__transfers = []
+        self.__pending = 0
+        self.__rx = collections.deque()
+        self.__max_queued = max_queued
+        self.__rx_cond = threading.Condition()
+        self.__running = False
+        self.__gone = False
+        self.__interrupt = True
+        self.__completed = 0
+        self.__dropped = 0
+        self.__discarded = 0
+        self.__max_depth = 0
+        self.__events = _EventThread.acquire()
+        try:
+            if usb_device is None:
+                devs = AsyncLibUsb.__find_devices(self.__events.context)
+                if interface_number < len(devs):
+                    usb_device = devs[interface_number]
+            if usb_device is not None:
+                self.__open(usb_device, num_transfers)
+        except usb1.USBError as e:
+            debug("AsyncLibUsb open error: " + str(e))
+            self.close()
+        if not self.__handle:
+            self.close()
+        #end __init__
+
+    @staticmethod
+    def __find_devices(context):
+        return [dev for dev in context.getDeviceIterator(skip_on_error=True)
+            if (dev.getVendorID() == VENDOR_ID) and (dev.getProductID() == PRODUCT_ID)]
+        #end __find_devices()
+
+    @staticmethod
+    def open_all(num_transfers=4, max_queued=64):
+        """
+        Opens every matching device.
+
+        Returns:    \n
+        An array of AsyncLibUsb, one for each device.
+        """
+        debug("AsyncLibUsb.open_all()")
+        if usb1 is None:
+            raise ImportError("AsyncLibUsb needs python-libusb1 (libusb1), which is missing or not installed!")
+        events = _EventThread.acquire()
+        try:
+            devs = AsyncLibUsb.__find_devices(events.context)
+            interfaces = [AsyncLibUsb(usb_device=dev, num_transfers=num_transfers, max_queued=max_queued) for dev in devs]
+        finally:
+            events.release()
+        return [usb_if for usb_if in interfaces if usb_if.is_valid()]
+        #end open_all()
+
+    def __open(self, usb_device, num_transfers):
+        """
+        Open 'usb_device', claim its interface and queue the IN transfers.
+        """
+        ports = usb_device.getPortNumberList()
+        if ports:
+            self.__path = "libusb:" + str(usb_device.getBusNumber()) + "-" + ".".join(str(p) for p in ports) + \
+                "@" + str(usb_device.getDeviceAddress())
+        for setting in usb_device.iterSettings():
+            for endpoint in setting.iterEndpoints():
+                if endpoint.getAddress() == ENDPOINT_IN:
+                    # transfer type is in the low 2 bits, 2 is bulk
+                    self.__interrupt = (endpoint.getAttributes() & 0x03) != 0x02
+        handle = usb_device.open()
+        try:
+            handle.setAutoDetachKernelDriver(True)
+        except usb1.USBError:
+            pass    # not supported on this platform
+        handle.claimInterface(0)
+        self.__handle = handle
+        self.__running = True
+        for i in range(num_transfers):
+            transfer = handle.getTransfer()
+            if self.__interrupt:
+                transfer.setInterrupt(ENDPOINT_IN, PACKET_SIZE, callback=self.__on_read, timeout=0)
+            else:
+                transfer.setBulk(ENDPOINT_IN, PACKET_SIZE, callback=self.__on_read, timeout=0)
+            self.__transfers.append(transfer)
+        for transfer in self.__transfers:
+            with self.__rx_cond:
+                self.__pending += 1
+            try:
+                transfer.submit()
+            except usb1.USBError:
+                with self.__rx_cond:
+                    self.__pending -= 1
+                raise
+        #end __open()
+
+    def __on_read(self, transfer):
+        """
+        Called by the event thread when an IN transfer completes.  Queues the
+        response and submits the transfer again.
+        """
+        status = transfer.getStatus()
+        with self.__rx_cond:
+            if status == usb1.TRANSFER_COMPLETED:
+                length = transfer.getActualLength()
+                if length > 0:
+                    if len(self.__rx) >= self.__max_queued:
+                        self.__rx.popleft()
+                        self.__dropped += 1
+                    self.__rx.append(bytearray(transfer.getBuffer()[:length]))
+                    self.__completed += 1
+                    self.__max_depth = max(self.__max_depth, len(self.__rx))
+                    self.__rx_cond.notify_all()
+            elif status == usb1.TRANSFER_NO_DEVICE:
+                debug("AsyncLibUsb: device gone")
+                self.__gone = True
+            elif status != usb1.TRANSFER_CANCELLED:
+                debug("AsyncLibUsb read status " + str(status))
+            if self.__running and not self.__gone and (status != usb1.TRANSFER_CANCELLED):
+                try:
+                    transfer.submit()
+                    return
+                except usb1.USBError as e:
+                    debug("AsyncLibUsb resubmit error: " + str(e))
+                    if isinstance(e, usb1.USBErrorNoDevice):
+                        self.__gone = True
+            self.__pending -= 1
+            self.__rx_cond.notify_all()
+        #end __on_read()
+
+    def is_valid(self):
+        """
+        Checks to see if connection is valid.
+
+        Returns:    \n
+        true if connected OK, false if error.
+        """
+        return (self.__handle is not None) and not self.__gone
+        #end is_valid()
+
+    def get_path(self):
+        """
+        Returns a string identifying where the device is connected, see
+        MpOrLibUsb.get_path().  None if not known.
+        """
+        return self.__path
+        #end get_path()
+
+    def get_stats(self):
+        """
+        Returns a dict of:
+
+        completed - IN transfers completed with a response.
+        dropped - Responses dropped because 'max_queued' were waiting.
+        discarded - Stale responses discarded by write().
+        queued - Responses waiting to be read.
+        max_queued - Most responses ever waiting.
+        in_flight - IN transfers currently submitted.
+        """
+        with self.__rx_cond:
+            return {
+                "completed": self.__completed,
+                "dropped": self.__dropped,
+                "discarded": self.__discarded,
+                "queued": len(self.__rx),
+                "max_queued": self.__max_depth,
+                "in_flight": self.__pending,
+            }
+        #end get_stats()
+
+    def close(self):
+        """
+        Gracefully close USB connection to CBA.
+        """
+        debug("AsyncLibUsb.close()")
+        handle = self.__handle
+        self.__handle = None
+        if handle:
+            with self.__rx_cond:
+                self.__running = False
+            for transfer in self.__transfers:
+                try:
+                    transfer.cancel()
+                except usb1.USBError:
+                    pass    # already completed, or the device is gone
+            # the event thread completes the cancelled transfers
+            with self.__rx_cond:
+                t_end = time.monotonic() + 1.0
+                while (self.__pending > 0) and (time.monotonic() < t_end):
+                    self.__rx_cond.wait(t_end - time.monotonic())
+            try:
+                if not self.__gone:
+                    handle.releaseInterface(0)
+            except usb1.USBError:
+                pass
+            try:
+                handle.close()
+            except usb1.USBError as e:
+                debug("AsyncLibUsb close error: " + str(e))
+            self.__transfers = []
+        if self.__events:
+            self.__events.release()
+            self.__events = None
+        #end close()
+
+    def __del__(self):
+        debug("AsyncLibUsb.__del__()")
+        try:
+            self.close()
+        except Exception:
+            pass
+        #end __del__
+
+    def write(self, data, timeout_ms=0):
+        """
+        Write 'data' (bytearray) to CBA4, waits 'timeout_ms' for endpoint to be available for writing (0 is wait forever).
+        Returns number of bytes actually written, 0 or less if an error (such as the device being unplugged).
+        """
+        handle = self.__handle
+        if not handle or self.__gone:
+            return 0
+        with self.__rx_cond:
+            self.__discarded += len(self.__rx)
+            self.__rx.clear()
+        try:
+            if self.__interrupt:
+                return handle.interruptWrite(ENDPOINT_OUT, bytes(data), timeout_ms)
+            return handle.bulkWrite(ENDPOINT_OUT, bytes(data), timeout_ms)
+        except usb1.USBError as e:
+            debug("AsyncLibUsb.write() error: " + str(e))
+            if isinstance(e, usb1.USBErrorNoDevice):
+                self.__gone = True
+            return 0
+        #end write()
+
+    def read(self, timeout_ms=0):
+        """
+        Read from CBA4, returns bytearray if success or None if nothing available or an error.  Will wait 'timeout_ms', forever if set to 0.
+        """
+        with self.__rx_cond:
+            t_end = None if timeout_ms == 0 else time.monotonic() + (timeout_ms / 1000.0)
+            while not self.__rx:
+                if not self.is_valid() or (self.__pending == 0):
+                    return None
+                remain = None if t_end is None else t_end - time.monotonic()
+                if (remain is not None) and (remain <= 0):
+                    return None
+                self.__rx_cond.wait(remain)
+            return self.__rx.popleft()
+        #end read()
+    #end class AsyncLibUsb
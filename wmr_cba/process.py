@@ -0,0 +1,412 @@
+"""
+    SUMMARY:
+
+    Runs each West Mountain Radio CBA device in its own worker process.
+
+    A host driving dozens of CBAs from threads has every keep-alive thread,
+    USB read loop, decode and user control loop competing for the one GIL,
+    so a busy control loop delays the keep-alives.  In process mode the USB
+    I/O, keep-alive thread and sampling of each CBA run in a separate
+    process, and the parent talks to it through a thin proxy, CBA4Process,
+    with the same functions as CBA4.  Samples are sent to the parent in
+    batches, rather than one message per sample.
+
+    The worker processes are started with the 'spawn' method, so scripts
+    using this module need the usual 'if __name__ == "__main__":' guard.
+
+    AVAILABLE CLASSES:
+
+    CBA4Process - Proxy for a CBA4 running in a worker process.
+
+    Example:
+
+        if __name__ == "__main__":
+            devices = process.CBA4Process.open_all(sample_interval=0.1)
+            for cba in devices:
+                cba.do_start(1.0, 10.5)
+            ...
+            for cba in devices:
+                samples = cba.read_samples()
+                cba.close()
+"""
+# Copyright (c) 2025 - Darren Rook (da66en) (route66@gmail.com)
+# Rights to use this code is made available using the MIT license.
+
+import collections
+import multiprocessing
+import threading
+import time
+from wmr_cba.wmr_cba import CBA4, CBA4Status, MpOrLibUsb, debug
+
+def _open_device(serial_number, usb_path, interface_factory):
+    """
+    Open the CBA4 for a worker process.  Opens only the USB device at
+    'usb_path', if known, so the other CBAs (owned by other workers) aren't
+    touched.
+    """
+    if interface_factory:
+        return CBA4(interface=interface_factory())
+    if usb_path and usb_path.startswith("libusb:"):
+        import usb.core
+        for dev in usb.core.find(find_all=True, idVendor=0x2405, idProduct=0x0005):
+            if MpOrLibUsb.get_device_path(dev) == usb_path:
+                return CBA4(interface=MpOrLibUsb(usb_device=dev))
+    return CBA4(serial_number=serial_number)
+    #end _open_device()
+
+def _worker_main(conn, serial_number, usb_path, interface_factory, sample_interval, batch_size, batch_interval):
+    """
+    Body of a worker process.  Runs commands sent by the CBA4Process and
+    sends back their results, and batches of samples.
+
+    Messages to the worker: (request_id, function name, args, kwargs), or
+    None to exit.  Messages from the worker: ("result", request_id, ok,
+    value) and ("samples", [(raw, timestamp, rtt), ...]).
+    """
+    try:
+        cba = _open_device(serial_number, usb_path, interface_factory)
+    except Exception as e:
+        conn.send(("opened", False, str(e)))
+        return
+    if not cba.is_valid():
+        conn.send(("opened", False, "CBA not found"))
+        return
+    conn.send(("opened", True, (cba.get_serial_number(), cba.get_config(), cba.get_usb_path())))
+    lock = threading.Lock()
+    batch = []
+    def listener(status):
+        with lock:
+            batch.append((bytes(status.raw), status.timestamp, status.rtt))
+    cba.add_listener(listener)
+    next_sample = time.monotonic()
+    last_flush = time.monotonic()
+    running = True
+    while running:
+        now = time.monotonic()
+        timeout = batch_interval - (now - last_flush)
+        if sample_interval:
+            timeout = min(timeout, next_sample - now)
+        if conn.poll(max(timeout, 0)):
+            try:
+                msg = conn.recv()
+            except EOFError:
+                break
+            if msg is None:
+                running = False
+            else:
+                request_id, name, args, kwargs = msg
+                try:
+                    value = getattr(cba, name)(*args, **kwargs)
+                    reply = ("result", request_id, True, value)
+                except Exception as e:
+                    reply = ("result", request_id, False, repr(e))
+                conn.send(reply)
+        now = time.monotonic()
+        if sample_interval and (now >= next_sample):
+            cba.get_status(max_age=0)
+            next_sample += sample_interval
+            if next_sample < now:
+                next_sample = now + sample_interval
+        with lock:
+            flush = batch and ((len(batch) >= batch_size) or ((now - last_flush) >= batch_interval) or not running)
+            if flush:
+                out = list(batch)
+                del batch[:]
+        if flush:
+            conn.send(("samples", out))
+        if flush or not batch:
+            last_flush = now
+        #end loop
+    cba.close()
+    #end _worker_main()
+
+class CBA4Process:
+    """
+    Proxy for a CBA4 running in its own worker process.  Has the same
+    functions as CBA4; each is run in the worker and its result sent back.
+
+    __init__(serial_number, usb_path, interface_factory, sample_interval,
+    batch_size, batch_interval, max_samples) (Constructor) - Start a worker
+    process for the CBA with serial number 'serial_number' (at 'usb_path' if
+    known, see open_all()), or for the interface returned by
+    'interface_factory()', a picklable function run in the worker, e.g.
+    functools.partial(simulator.SimulatedCBA4, serial_number=1234).  If
+    'sample_interval' is given, the worker samples the status that often,
+    besides the keep-alives.  Samples are sent to the parent when 'batch_size'
+    have been heard or 'batch_interval' seconds have passed.  The parent keeps
+    the last 'max_samples' samples until read by read_samples().
+
+    @staticmethod open_all(**kwargs) - Start a worker for every CBA found,
+    returns a list of CBA4Process.
+
+    read_samples() - Returns, and removes, every sample heard since the last
+    call, a list of CBA4Status.
+
+    get_status(max_age) - Same as CBA4, but the latest sample sent by the
+    worker is used if recent enough, without asking the worker.
+
+    add_listener(callback) - 'callback(status)' is called in the parent, for
+    every sample, when its batch arrives.
+
+    get_stats() - Returns a dict of the batches and samples received.
+
+    Other functions (do_start(), do_stop(), set_load(), set_fan(),
+    get_config(), ...) are the same as CBA4.
+    """
+    def __init__(self, serial_number=None, usb_path=None, interface_factory=None,
+            sample_interval=None, batch_size=64, batch_interval=0.05, max_samples=10000,
+            timeout=10.0):
+        debug("CBA4Process.__init__()")
+        ctx = multiprocessing.get_context("spawn")
+        self.__conn, child_conn = ctx.Pipe()
+        self.__timeout = timeout
+        self.__process = ctx.Process(target=_worker_main, daemon=True, args=(child_conn, serial_number,
+            usb_path, interface_factory, sample_interval, batch_size, batch_interval))
+        self.__process.start()
+        child_conn.close()
+        self.__send_lock = threading.Lock()
+        self.__cond = threading.Condition()
+        self.__results = {}
+        self.__next_request = 1
+        self.__samples = collections.deque(maxlen=max_samples)
+        self.__latest = None
+        self.__listeners = []
+        self.__max_age = 0
+        self.__batches = 0
+        self.__num_samples = 0
+        self.__serial_number = None
+        self.__config = None
+        self.__usb_path = None
+        self.__valid = False
+        if self.__conn.poll(timeout):
+            try:
+                kind, ok, value = self.__conn.recv()
+                if ok:
+                    self.__serial_number, self.__config, self.__usb_path = value
+                    self.__valid = True
+                else:
+                    debug("CBA4Process open error: " + str(value))
+            except EOFError:
+                pass
+        if not self.__valid:
+            self.__process.join(1.0)
+            return
+        self.__thread = threading.Thread(target=self.__receive, daemon=True)
+        self.__thread.start()
+        #end __init__
+
+    @staticmethod
+    def open_all(**kwargs):
+        """
+        Finds every CBA, then starts a worker process for each.  'kwargs' are
+        passed to the constructor.
+        """
+        debug("CBA4Process.open_all()")
+        found = []
+        for cba in CBA4.open_all():
+            found.append((cba.get_serial_number(), cba.get_usb_path()))
+            cba.close()
+        devices = []
+        for serial_number, usb_path in found:
+            cba = CBA4Process(serial_number, usb_path, **kwargs)
+            if cba.is_valid():
+                devices.append(cba)
+        return devices
+        #end open_all()
+
+    def __receive(self):
+        while True:
+            try:
+                msg = self.__conn.recv()
+            except (EOFError, OSError):
+                break
+            if msg[0] == "samples":
+                statuses = [CBA4Status(raw, timestamp, rtt) for raw, timestamp, rtt in msg[1]]
+                with self.__cond:
+                    self.__samples.extend(statuses)
+                    if statuses:
+                        self.__latest = statuses[-1]
+                    self.__batches += 1
+                    self.__num_samples += len(statuses)
+                for status in statuses:
+                    for callback in self.__listeners:
+                        try:
+                            callback(status)
+                        except Exception as e:
+                            debug("CBA4Process listener error: " + str(e))
+            elif msg[0] == "result":
+                with self.__cond:
+                    self.__results[msg[1]] = (msg[2], msg[3])
+                    self.__cond.notify_all()
+            #end loop
+        with self.__cond:
+            self.__valid = False
+            self.__cond.notify_all()
+        #end __receive()
+
+    def __call(self, name, *args, **kwargs):
+        """
+        Run 'name(*args, **kwargs)' on the CBA4 in the worker, and return its
+        result.  Raises IOError if the worker doesn't answer.
+        """
+        if not self.__valid:
+            raise IOError("CBA4Process worker isn't running")
+        with self.__cond:
+            request_id = self.__next_request
+            self.__next_request += 1
+        with self.__send_lock:
+            self.__conn.send((request_id, name, args, kwargs))
+        with self.__cond:
+            if not self.__cond.wait_for(lambda: (request_id in self.__results) or not self.__valid, self.__timeout):
+                raise IOError("CBA4Process worker didn't answer " + name + "()")
+            if request_id not in self.__results:
+                raise IOError("CBA4Process worker exited")
+            ok, value = self.__results.pop(request_id)
+        if not ok:
+            raise IOError("CBA4Process " + name + "() failed: " + value)
+        return value
+        #end __call()
+
+    def is_valid(self):
+        return self.__valid
+        #end is_valid()
+
+    def close(self):
+        debug("CBA4Process.close()")
+        if self.__valid:
+            try:
+                with self.__send_lock:
+                    self.__conn.send(None)
+            except OSError:
+                pass
+        self.__process.join(self.__timeout)
+        if self.__process.is_alive():
+            self.__process.terminate()
+        self.__valid = False
+        self.__conn.close()
+        #end close()
+
+    def get_serial_number(self):
+        return self.__serial_number
+        #end get_serial_number()
+
+    def get_config(self):
+        return self.__config
+        #end get_config()
+
+    def get_usb_path(self):
+        return self.__usb_path
+        #end get_usb_path()
+
+    def get_pid(self):
+        return self.__process.pid
+        #end get_pid()
+
+    def do_start(self, amps, vstop=0, keep_alive=True, fan=None):
+        return self.__call("do_start", amps, vstop, keep_alive, fan)
+        #end do_start()
+
+    def do_stop(self):
+        return self.__call("do_stop")
+        #end do_stop()
+
+    def set_load(self, amps, vstop=None, fan=None):
+        return self.__call("set_load", amps, vstop, fan)
+        #end set_load()
+
+    def set_fan(self, fan):
+        return self.__call("set_fan", fan)
+        #end set_fan()
+
+    def get_fan(self):
+        return self.__call("get_fan")
+        #end get_fan()
+
+    def get_status(self, max_age=None):
+        """
+        Returns the status of the CBA, see CBA4.get_status().  The latest
+        sample sent by the worker is used if no older than 'max_age' (the age
+        set by set_max_age() if not provided).
+        """
+        if max_age is None:
+            max_age = self.__max_age
+        status = self.__latest
+        if status and (status.get_age() <= max_age):
+            return status
+        return self.__call("get_status", 0)
+        #end get_status()
+
+    def get_voltage(self, max_age=None):
+        status = self.get_status(max_age)
+        return status.voltage if status else None
+        #end get_voltage()
+
+    def get_set_current(self, max_age=None):
+        status = self.get_status(max_age)
+        return status.set_current if status else None
+        #end get_set_current()
+
+    def get_measured_current(self, max_age=None):
+        status = self.get_status(max_age)
+        return status.measured_current if status else None
+        #end get_measured_current()
+
+    def is_running(self, max_age=None):
+        status = self.get_status(max_age)
+        return status.is_running() if status else None
+        #end is_running()
+
+    def is_power_limited(self, max_age=None):
+        status = self.get_status(max_age)
+        return status.is_power_limited() if status else None
+        #end is_power_limited()
+
+    def is_high_temp(self, max_age=None):
+        status = self.get_status(max_age)
+        return status.is_high_temp() if status else None
+        #end is_high_temp()
+
+    def set_max_age(self, seconds):
+        self.__max_age = seconds
+        #end set_max_age()
+
+    def get_max_age(self):
+        return self.__max_age
+        #end get_max_age()
+
+    def read_samples(self):
+        """
+        Returns every sample received since the last call, and forgets them.
+
+        Returns:    \n
+        A list of CBA4Status, oldest first.
+        """
+        with self.__cond:
+            samples = list(self.__samples)
+            self.__samples.clear()
+        return samples
+        #end read_samples()
+
+    def add_listener(self, callback):
+        self.__listeners = self.__listeners + [callback]
+        #end add_listener()
+
+    def remove_listener(self, callback):
+        self.__listeners = [l for l in self.__listeners if l != callback]
+        #end remove_listener()
+
+    def get_stats(self):
+        """
+        Returns a dict of:
+        'batches' - number of batches of samples received.
+        'samples' - number of samples received.
+        'samples_per_batch' - average batch size.
+        """
+        with self.__cond:
+            return {
+                "batches": self.__batches,
+                "samples": self.__num_samples,
+                "samples_per_batch": (self.__num_samples / self.__batches) if self.__batches else 0.0,
+            }
+        #end get_stats()
+    #end class CBA4Process
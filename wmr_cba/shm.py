@@ -0,0 +1,319 @@
+"""
+    SUMMARY:
+
+    Shares CBA samples with other processes through a ring buffer in shared
+    memory (multiprocessing.shared_memory).
+
+    One process, the publisher, writes each sample into the next slot of the
+    ring.  Any number of reader processes attach to the ring by name and read
+    the new samples straight out of shared memory.  Nothing is pickled or
+    sent over a pipe, and the publisher never waits for, or locks against,
+    the readers: a reader that falls more than a ring behind loses the oldest
+    samples, and counts them.
+
+    Each slot starts with a sequence number, written last by the publisher
+    after the rest of the slot, and cleared before the slot is written again.
+    A reader checks the sequence number before and after copying a slot, so
+    a slot overwritten while being read is spotted and skipped.
+
+    AVAILABLE CLASSES:
+
+    SamplePublisher - Creates the ring and writes samples to it.
+
+    SampleReader - Attaches to a ring from another process and reads it.
+
+    RingSample - A sample read by a SampleReader.
+
+    Example:
+
+        # acquisition process
+        publisher = shm.SamplePublisher("cba_samples")
+        publisher.attach(cba)
+
+        # analysis process
+        reader = shm.SampleReader("cba_samples")
+        while True:
+            for sample in reader.read(timeout=1.0):
+                print(sample.serial, sample.voltage)
+"""
+# Copyright (c) 2025 - Darren Rook (da66en) (route66@gmail.com)
+# Rights to use this code is made available using the MIT license.
+
+import math
+import struct
+import sys
+import threading
+import time
+from multiprocessing import shared_memory
+from wmr_cba.wmr_cba import debug
+
+# magic, version, slot size, number of slots, flags, samples written
+_HEADER = struct.Struct("<4sIIIIxxxxQ")
+HEADER_SIZE = 64
+MAGIC = b"CBA4"
+VERSION = 1
+# ring flag: the slots hold the raw status response
+FLAG_RAW = 0x01
+
+# slot sequence number, then serial, flags, timestamp, rtt, voltage, set
+# current, measured current
+_SEQ = struct.Struct("<Q")
+_FIELDS = struct.Struct("<IIddddd")
+SLOT_SIZE = 64
+RAW_SLOT_SIZE = 128
+RAW_SIZE = 64
+
+# names of the rings created by this process
+_created = set()
+
+def _open_shared_memory(name):
+    """
+    Attach to an existing shared memory block, without the resource tracker
+    of this process unlinking it when this process exits.
+    """
+    if sys.version_info >= (3, 13):
+        return shared_memory.SharedMemory(name=name, track=False)
+    shm = shared_memory.SharedMemory(name=name)
+    if shm.name in _created:
+        return shm  # the tracker entry belongs to our SamplePublisher
+    try:
+        from multiprocessing import resource_tracker
+        resource_tracker.unregister(shm._name, "shared_memory")
+    except Exception as e:
+        debug("shm resource tracker: " + str(e))
+    return shm
+    #end _open_shared_memory()
+
+class RingSample:
+    """
+    A sample read from the ring.  Has the same fields as CBA4Status, plus:
+
+    seq - Number of the sample, counting from 1 for the first sample
+    published.
+    serial - Serial number of the CBA, as given to SamplePublisher.write().
+    raw - The status response (bytes), None if the ring doesn't hold them.
+    """
+    __slots__ = ('seq', 'serial', 'timestamp', 'rtt', 'flags', 'voltage', 'set_current', 'measured_current', 'raw')
+
+    def is_running(self):
+        return ((self.flags & 2) == 2)
+        #end is_running()
+
+    def is_power_limited(self):
+        return ((self.flags & 0x10) == 0x10)
+        #end is_power_limited()
+
+    def is_high_temp(self):
+        return ((self.flags & 0x20) == 0x20)
+        #end is_high_temp()
+
+    def __repr__(self):
+        return "RingSample(seq=" + str(self.seq) + ", serial=" + str(self.serial) + ", voltage=" + str(self.voltage) + \
+            ", set_current=" + str(self.set_current) + ", measured_current=" + str(self.measured_current) + \
+            ", flags=" + hex(self.flags) + ")"
+        #end __repr__()
+    #end class RingSample
+
+class SamplePublisher:
+    """
+    Creates a ring of 'num_slots' samples in shared memory, and writes
+    samples to it.
+
+    __init__(name, num_slots, raw) (Constructor) - Create the shared memory
+    block 'name', a random name if not provided (see get_name()).  If 'raw'
+    is True the raw status response is stored with each sample, doubling the
+    size of a slot.
+
+    get_name() - Returns the name readers attach with.
+
+    write(status, serial) - Publish a CBA4Status, from the CBA with serial
+    number 'serial'.
+
+    attach(cba) - Publish every status heard by a CBA4 (see
+    CBA4.add_listener()).
+
+    detach(cba) - Stop publishing the status of a CBA4 passed to attach().
+
+    get_count() - Returns the number of samples published.
+
+    close() - Close and remove the shared memory.  Readers still attached
+    keep their mapping until they close.
+    """
+    def __init__(self, name=None, num_slots=4096, raw=False):
+        debug("SamplePublisher.__init__()")
+        self.__num_slots = num_slots
+        self.__slot_size = RAW_SLOT_SIZE if raw else SLOT_SIZE
+        self.__raw = raw
+        self.__shm = shared_memory.SharedMemory(name=name, create=True, size=HEADER_SIZE + (num_slots * self.__slot_size))
+        self.__buf = self.__shm.buf
+        self.__buf[:HEADER_SIZE + (num_slots * self.__slot_size)] = bytes(HEADER_SIZE + (num_slots * self.__slot_size))
+        self.__count = 0
+        self.__lock = threading.Lock()
+        self.__listeners = {}
+        _created.add(self.__shm.name)
+        _HEADER.pack_into(self.__buf, 0, MAGIC, VERSION, self.__slot_size, num_slots, FLAG_RAW if raw else 0, 0)
+        #end __init__
+
+    def get_name(self):
+        return self.__shm.name
+        #end get_name()
+
+    def get_count(self):
+        return self.__count
+        #end get_count()
+
+    def write(self, status, serial=0):
+        """
+        Publish 'status' (a CBA4Status), from the CBA with serial number
+        'serial'.  Never waits for the readers.
+        """
+        with self.__lock:
+            seq = self.__count + 1
+            offset = HEADER_SIZE + (((seq - 1) % self.__num_slots) * self.__slot_size)
+            buf = self.__buf
+            # mark the slot as being written, then fill it, then publish it
+            _SEQ.pack_into(buf, offset, 0)
+            rtt = status.rtt if status.rtt is not None else math.nan
+            _FIELDS.pack_into(buf, offset + 8, serial, status.flags, status.timestamp, rtt,
+                status.voltage, status.set_current, status.measured_current)
+            if self.__raw:
+                raw = status.raw[:RAW_SIZE]
+                buf[offset + 56:offset + 56 + len(raw)] = raw
+            _SEQ.pack_into(buf, offset, seq)
+            self.__count = seq
+            struct.pack_into("<Q", buf, _HEADER.size - 8, seq)
+        #end write()
+
+    def attach(self, cba):
+        serial = cba.get_serial_number()
+        listener = lambda status: self.write(status, serial)
+        self.__listeners[id(cba)] = listener
+        cba.add_listener(listener)
+        #end attach()
+
+    def detach(self, cba):
+        listener = self.__listeners.pop(id(cba), None)
+        if listener:
+            cba.remove_listener(listener)
+        #end detach()
+
+    def close(self):
+        debug("SamplePublisher.close()")
+        if self.__shm is None:
+            return
+        self.__buf = None
+        self.__shm.close()
+        try:
+            self.__shm.unlink()
+        except FileNotFoundError:
+            pass
+        _created.discard(self.__shm.name)
+        self.__shm = None
+        #end close()
+    #end class SamplePublisher
+
+class SampleReader:
+    """
+    Reads the samples of a SamplePublisher, from any process.
+
+    __init__(name, from_start) (Constructor) - Attach to the ring 'name'.
+    Only samples published from now on are read, unless 'from_start' is
+    True, then every sample still in the ring is read too.
+
+    read(max_samples, timeout) - Returns a list of the new RingSample, oldest
+    first.  Waits up to 'timeout' seconds for at least one if there are
+    none.
+
+    get_available() - Returns the number of new samples waiting.
+
+    get_lost() - Returns the number of samples that were overwritten before
+    they could be read.
+
+    close() - Detach from the ring.
+    """
+    # Seconds between checks for new samples, while read() is waiting.
+    POLL_INTERVAL = 0.001
+
+    def __init__(self, name, from_start=False):
+        debug("SampleReader.__init__()")
+        self.__shm = _open_shared_memory(name)
+        self.__buf = self.__shm.buf
+        magic, version, slot_size, num_slots, flags, count = _HEADER.unpack_from(self.__buf, 0)
+        if (magic != MAGIC) or (version != VERSION):
+            self.close()
+            raise ValueError("'" + name + "' isn't a CBA4 sample ring")
+        self.__slot_size = slot_size
+        self.__num_slots = num_slots
+        self.__raw = (flags & FLAG_RAW) != 0
+        self.__lost = 0
+        if from_start:
+            self.__next = max(count - num_slots + 1, 1)
+        else:
+            self.__next = count + 1
+        #end __init__
+
+    def __get_count(self):
+        return struct.unpack_from("<Q", self.__buf, _HEADER.size - 8)[0]
+        #end __get_count()
+
+    def get_available(self):
+        return max(self.__get_count() - self.__next + 1, 0)
+        #end get_available()
+
+    def get_lost(self):
+        return self.__lost
+        #end get_lost()
+
+    def read(self, max_samples=None, timeout=0):
+        """
+        Read the samples published since the last read().
+
+        Returns:    \n
+        A list of RingSample, oldest first, empty if there were none within
+        'timeout' seconds.
+        """
+        count = self.__get_count()
+        if (count < self.__next) and timeout:
+            t_end = time.monotonic() + timeout
+            while (count < self.__next) and (time.monotonic() < t_end):
+                time.sleep(SampleReader.POLL_INTERVAL)
+                count = self.__get_count()
+        out = []
+        if count < self.__next:
+            return out
+        if (count - self.__next) >= self.__num_slots:
+            # lapped by the publisher, skip to the oldest sample still there
+            skip = count - self.__num_slots + 1
+            self.__lost += skip - self.__next
+            self.__next = skip
+        last = count if max_samples is None else min(count, self.__next + max_samples - 1)
+        buf = self.__buf
+        while self.__next <= last:
+            seq = self.__next
+            offset = HEADER_SIZE + (((seq - 1) % self.__num_slots) * self.__slot_size)
+            before = _SEQ.unpack_from(buf, offset)[0]
+            fields = _FIELDS.unpack_from(buf, offset + 8)
+            raw = bytes(buf[offset + 56:offset + 56 + RAW_SIZE]) if self.__raw else None
+            after = _SEQ.unpack_from(buf, offset)[0]
+            self.__next += 1
+            if (before != seq) or (after != seq):
+                # overwritten while reading, the publisher is a lap ahead
+                self.__lost += 1
+                continue
+            sample = RingSample()
+            sample.seq = seq
+            sample.serial, sample.flags, sample.timestamp, rtt, sample.voltage, sample.set_current, sample.measured_current = fields
+            sample.rtt = None if math.isnan(rtt) else rtt
+            sample.raw = raw
+            out.append(sample)
+        return out
+        #end read()
+
+    def close(self):
+        if self.__shm is None:
+            return
+        self.__buf = None
+        self.__shm.close()
+        self.__shm = None
+        #end close()
+    #end class SampleReader
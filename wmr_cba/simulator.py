@@ -0,0 +1,463 @@
+"""
+    SUMMARY:
+
+    A simulated CBA IV, for exercising the wmr_cba library without hardware.
+
+    AVAILABLE CLASSES:
+
+    SimulatedCBA4 - Speaks the CBA IV USB protocol (0x43/0x63 config and
+    0x53/0x73 status messages) and models a battery being discharged, and
+    the CBA heating up.  Pass it as the 'interface' of a CBA4:
+
+        cba = wmr_cba.CBA4(interface=simulator.SimulatedCBA4(serial_number=1234))
+
+    SimulatedBattery - The battery discharged by a SimulatedCBA4.  Can be
+    shared by several SimulatedCBA4, connected to it in parallel:
+
+        battery = simulator.SimulatedBattery(capacity_ah=20.0)
+        sims = [simulator.SimulatedCBA4(serial_number=n, battery=battery) for n in (1, 2)]
+"""
+# Copyright (c) 2025 - Darren Rook (da66en) (route66@gmail.com)
+# Rights to use this code is made available using the MIT license.
+
+import collections
+import math
+import random
+import threading
+import time
+from wmr_cba.wmr_cba import debug
+
+class SimulatedBattery:
+    """
+    Simulated battery, with a mostly flat discharge curve and a knee as it
+    empties, and an internal resistance.  Every SimulatedCBA4 connected to
+    it draws from the same capacity, and the current of each drops the
+    terminal voltage seen by all of them.
+
+    __init__(capacity_ah, volts_full, volts_empty, resistance) (Constructor)
+    - Create a fully charged battery.
+
+    get_open_circuit_volts() - Returns the voltage with no load.
+
+    get_terminal_volts() - Returns the voltage under the current load.
+
+    get_load() - Returns the total current drawn, in amps.
+
+    get_capacity_used() - Returns the amp hours drawn so far.
+
+    recharge() - Fully charge the battery again.
+    """
+    def __init__(self, capacity_ah=2.0, volts_full=13.4, volts_empty=10.5, resistance=0.05):
+        self.__capacity_ah = capacity_ah
+        self.__volts_full = volts_full
+        self.__volts_empty = volts_empty
+        self.__resistance = resistance
+        self.__lock = threading.Lock()
+        self.__ah_used = 0.0
+        self.__loads = {}
+        #end __init__
+
+    def get_open_circuit_volts(self):
+        with self.__lock:
+            soc = 1.0 - (self.__ah_used / self.__capacity_ah)
+        soc = min(max(soc, 0.0), 1.0)
+        span = self.__volts_full - self.__volts_empty
+        # mostly flat plateau, with a knee as the battery empties
+        volts = self.__volts_empty + (span * (0.35 + (0.55 * soc)))
+        volts += (span * 0.1) * math.exp(-30.0 * (1.0 - soc))
+        volts -= (span * 0.35) * math.exp(-30.0 * soc)
+        return volts
+        #end get_open_circuit_volts()
+
+    def get_terminal_volts(self):
+        return self.get_open_circuit_volts() - (self.get_load() * self.__resistance)
+        #end get_terminal_volts()
+
+    def get_load(self):
+        with self.__lock:
+            return sum(self.__loads.values())
+        #end get_load()
+
+    def get_capacity_used(self):
+        with self.__lock:
+            return self.__ah_used
+        #end get_capacity_used()
+
+    def recharge(self):
+        with self.__lock:
+            self.__ah_used = 0.0
+        #end recharge()
+
+    def _volts_if(self, load, amps):
+        """
+        Returns the terminal voltage if 'load' drew 'amps', and the other
+        loads what they draw now.
+        """
+        with self.__lock:
+            others = sum(a for l, a in self.__loads.items() if l is not load)
+        return self.get_open_circuit_volts() - ((others + amps) * self.__resistance)
+        #end _volts_if()
+
+    def _set_load(self, load, amps):
+        with self.__lock:
+            self.__loads[load] = amps
+        #end _set_load()
+
+    def _draw(self, amps, dt):
+        with self.__lock:
+            self.__ah_used += amps * dt / 3600.0
+        #end _draw()
+    #end class SimulatedBattery
+
+class SimulatedCBA4:
+    """
+    Simulated CBA IV.  Provides the same functions as MpOrLibUsb, so it can
+    be used anywhere a CBA4 'interface' is expected.
+
+    __init__(serial_number, ...) (Constructor) - Create a simulated CBAIV with
+    a fully charged battery connected.  See the constructor for the battery
+    model parameters.
+
+    is_valid() - returns True until close() is called.
+
+    close() - disconnect the simulated device.
+
+    num = write(bytearray) - write a message to the simulated CBA.
+
+    bytearray = read(timeout_ms) - read the next response, None if there isn't
+    one within 'timeout_ms'.
+
+    get_path() - returns a USB path made up from the serial number.
+
+    unplug() - simulate the USB cable being pulled: writes return 0 and
+    reads return None, and with no keep-alive the watchdog stops the test.
+
+    plug() - reconnect the USB cable.  Like a real device, the connection
+    has to be opened again, with open().
+
+    open() - reopen after close() or plug(), returns this object, or None if
+    unplugged.
+
+    get_capacity_used() - returns the amp hours drawn from the battery so far.
+
+    recharge() - fully charge the simulated battery again.
+
+    get_battery() - returns the SimulatedBattery being discharged.
+
+    get_temperature() - returns the temperature of the simulated CBA.
+
+    The heat sink is modelled as a heat capacity with a thermal resistance to
+    ambient, lower when the fan is running (FAN byte of the set status
+    message, 0 to 255).  If it gets hotter than 'temp_abort' the test is
+    aborted and the high temperature flag (0x20) set, like a real CBA.
+    """
+    # Maximum power the CBA IV can dissipate, in Watts.
+    MAX_POWER = 150.0
+
+    # Maximum current the CBA IV can draw, in Amps.
+    MAX_CURRENT = 40.0
+
+    def __init__(self, serial_number=1234, capacity_ah=2.0, volts_full=13.4,
+            volts_empty=10.5, resistance=0.05, latency=0.0, watchdog=3.0,
+            clock=None, ambient=25.0, thermal_resistance=0.5,
+            fan_thermal_resistance=0.4, heat_capacity=300.0, temp_abort=85.0,
+            battery=None, max_power=None, noise=0.0):
+        """
+        Create a simulated CBA4.
+
+        Parameters: \n
+        serial_number - Serial number reported in the config (0x63) response.
+        capacity_ah - Capacity of the simulated battery, in amp hours.
+        volts_full - Open circuit voltage of a full battery.
+        volts_empty - Open circuit voltage of an empty battery.
+        resistance - Internal resistance of the battery, in Ohms.
+        latency - Seconds each read() takes, to simulate USB round trip time.
+        watchdog - If a status (0x53) message isn't heard for this many
+        seconds the test is stopped, like the WDT of a real CBA.
+        clock - Function returning the current time in seconds, defaults to
+        time.monotonic.  Supply your own to run the battery faster than real
+        time.
+        ambient - Ambient temperature, in C.
+        thermal_resistance - Heat sink to ambient, in C/W, with the fan off.
+        fan_thermal_resistance - Heat sink to ambient with the fan at 255.
+        heat_capacity - Of the heat sink, in J/C.
+        temp_abort - The test is aborted above this temperature, in C.
+        battery - A SimulatedBattery, to share one battery between several
+        simulated CBAs.  If not provided, one is created from 'capacity_ah',
+        'volts_full', 'volts_empty' and 'resistance'.
+        max_power - Power limit in Watts, MAX_POWER if not provided.
+        noise - Each voltage reported is off by up to this many volts, at
+        random, like the flicker of the last digits of a real CBA.
+        """
+        debug("SimulatedCBA4.__init__()")
+        self.__serial_number = serial_number
+        if battery is None:
+            battery = SimulatedBattery(capacity_ah, volts_full, volts_empty, resistance)
+        self.__battery = battery
+        self.__max_power = max_power if max_power else SimulatedCBA4.MAX_POWER
+        self.__latency = latency
+        self.__noise = noise
+        self.__watchdog = watchdog
+        self.__clock = clock if clock else time.monotonic
+        self.__ambient = ambient
+        self.__thermal_resistance = thermal_resistance
+        self.__fan_thermal_resistance = fan_thermal_resistance
+        self.__heat_capacity = heat_capacity
+        self.__temp_abort = temp_abort
+        self.__temperature = ambient
+        self.__cond = threading.Condition()
+        self.__responses = collections.deque()
+        self.__valid = True
+        self.__plugged = True
+        self.__running = False
+        self.__amps = 0
+        self.__vstop = 0
+        self.__vstop_enabled = False
+        self.__fan = 0
+        self.__flags = 0
+        self.__actual_amps = 0.0
+        self.__battery._set_load(self, 0.0)
+        self.__last_time = self.__clock()
+        self.__last_keep_alive = self.__last_time
+        #end __init__
+
+    def is_valid(self):
+        return self.__valid
+        #end is_valid()
+
+    def get_path(self):
+        return "simulator:" + str(self.__serial_number)
+        #end get_path()
+
+    def close(self):
+        debug("SimulatedCBA4.close()")
+        with self.__cond:
+            self.__valid = False
+            self.__responses.clear()
+            self.__cond.notify_all()
+        #end close()
+
+    def unplug(self):
+        debug("SimulatedCBA4.unplug()")
+        with self.__cond:
+            self.__step()
+            self.__plugged = False
+            self.__responses.clear()
+            self.__cond.notify_all()
+        #end unplug()
+
+    def plug(self):
+        debug("SimulatedCBA4.plug()")
+        with self.__cond:
+            self.__step()
+            self.__plugged = True
+            # the old connection doesn't survive being unplugged
+            self.__valid = False
+        #end plug()
+
+    def is_plugged(self):
+        return self.__plugged
+        #end is_plugged()
+
+    def open(self):
+        """
+        Reopen the simulated device after close() or plug().
+
+        Returns:    \n
+        This object, None if unplugged.
+        """
+        with self.__cond:
+            if not self.__plugged:
+                return None
+            self.__valid = True
+        return self
+        #end open()
+
+    def recharge(self):
+        with self.__cond:
+            self.__step()
+        self.__battery.recharge()
+        #end recharge()
+
+    def get_battery(self):
+        return self.__battery
+        #end get_battery()
+
+    def get_temperature(self):
+        with self.__cond:
+            self.__step()
+            return self.__temperature
+        #end get_temperature()
+
+    def get_capacity_used(self):
+        """
+        Returns the amp hours that have been drawn from the simulated battery.
+        """
+        with self.__cond:
+            self.__step()
+        return self.__battery.get_capacity_used()
+        #end get_capacity_used()
+
+    def __terminal_volts(self):
+        return self.__battery.get_terminal_volts()
+        #end __terminal_volts()
+
+    def __set_amps(self, amps):
+        self.__actual_amps = amps
+        self.__battery._set_load(self, amps)
+        #end __set_amps()
+
+    def __step(self):
+        """
+        Advance the battery model up to the current time.
+        """
+        now = self.__clock()
+        dt = now - self.__last_time
+        self.__last_time = now
+        self.__heat(dt)
+        if not self.__running:
+            self.__set_amps(0.0)
+            return
+        if (now - self.__last_keep_alive) > self.__watchdog:
+            self.__running = False
+            self.__set_amps(0.0)
+            return
+        self.__battery._draw(self.__actual_amps, dt)
+        if self.__temperature > self.__temp_abort:
+            self.__running = False
+            self.__set_amps(0.0)
+            self.__flags |= 0x20
+            return
+        self.__update_load()
+        if self.__vstop_enabled and (self.__terminal_volts() < self.__vstop):
+            self.__running = False
+            self.__set_amps(0.0)
+        #end __step()
+
+    def __heat(self, dt):
+        """
+        Advance the temperature of the heat sink by 'dt' seconds, with the
+        power dissipated over that time.
+        """
+        if dt <= 0:
+            return
+        power = self.__actual_amps * max(self.__terminal_volts(), 0.0)
+        rth = self.__thermal_resistance + ((self.__fan_thermal_resistance - self.__thermal_resistance) * self.__fan / 255.0)
+        tau = rth * self.__heat_capacity
+        # exact for a constant power over 'dt', so large steps stay stable
+        target = self.__ambient + (power * rth)
+        self.__temperature = target + ((self.__temperature - target) * math.exp(-dt / tau))
+        #end __heat()
+
+    def __update_load(self):
+        amps = min(self.__amps, SimulatedCBA4.MAX_CURRENT)
+        volts = self.__battery._volts_if(self, amps)
+        self.__flags &= ~0x10
+        if (amps * volts) > self.__max_power:
+            amps = self.__max_power / max(volts, 0.1)
+            self.__flags |= 0x10
+        if amps < self.__amps:
+            self.__flags |= 0x10
+        self.__set_amps(amps)
+        #end __update_load()
+
+    @staticmethod
+    def __put_u32(b, offset, value):
+        value = int(value)
+        b[offset] = (value >> 0) & 0xff
+        b[offset+1] = (value >> 8) & 0xff
+        b[offset+2] = (value >> 16) & 0xff
+        b[offset+3] = (value >> 24) & 0xff
+        #end __put_u32()
+
+    @staticmethod
+    def __get_u32(b, offset):
+        return b[offset] + (b[offset+1] * 0x100) + (b[offset+2] * 0x10000) + (b[offset+3] * 0x1000000)
+        #end __get_u32()
+
+    def __config_response(self):
+        rx = bytearray(64)
+        rx[0] = 0x63
+        SimulatedCBA4.__put_u32(rx, 4, self.__serial_number)
+        return rx
+        #end __config_response()
+
+    def __status_response(self):
+        rx = bytearray(64)
+        rx[0] = 0x73
+        flags = self.__flags
+        if self.__running:
+            flags |= 0x02
+        else:
+            flags &= ~0x10
+        if self.__vstop_enabled:
+            flags |= 0x40
+        rx[1] = flags
+        SimulatedCBA4.__put_u32(rx, 3, self.__amps * 1000.0 * 1000.0)
+        rx[7] = self.__fan
+        # the feedback is 10bits for the entire 40 Amps range
+        step = SimulatedCBA4.MAX_CURRENT / 1024.0
+        measured = round(self.__actual_amps / step) * step
+        SimulatedCBA4.__put_u32(rx, 16, measured * 1000.0 * 1000.0)
+        volts = self.__terminal_volts()
+        if self.__noise:
+            volts += random.uniform(-self.__noise, self.__noise)
+        SimulatedCBA4.__put_u32(rx, 20, max(volts, 0.0) * 1000.0 * 1000.0)
+        return rx
+        #end __status_response()
+
+    def __set_status(self, tx):
+        self.__last_keep_alive = self.__clock()
+        if len(tx) < 16:
+            return
+        flags = tx[1]
+        if (flags & 0x01) == 0:
+            return  #status request only
+        self.__fan = tx[7]
+        if (flags & 0x02) == 0:
+            self.__running = False
+            self.__set_amps(0.0)
+            return
+        self.__amps = SimulatedCBA4.__get_u32(tx, 3) / (1000.0 * 1000.0)
+        self.__vstop_enabled = ((flags & 0x40) == 0x40)
+        self.__vstop = SimulatedCBA4.__get_u32(tx, 12) / (1000.0 * 1000.0)
+        self.__flags &= ~0x20
+        self.__running = True
+        self.__update_load()
+        #end __set_status()
+
+    def write(self, data, timeout_ms=0):
+        """
+        Write 'data' (bytearray) to the simulated CBA4.  Returns number of
+        bytes written, 0 if closed.
+        """
+        with self.__cond:
+            if not self.__valid or not self.__plugged:
+                return 0
+            self.__step()
+            if data[0] == 0x43:
+                self.__responses.append(self.__config_response())
+            elif data[0] == 0x53:
+                self.__set_status(data)
+                self.__responses.append(self.__status_response())
+            self.__cond.notify_all()
+        return len(data)
+        #end write()
+
+    def read(self, timeout_ms=0):
+        """
+        Read from the simulated CBA4, returns bytearray if success or None if
+        nothing available.  Will wait 'timeout_ms', forever if set to 0.
+        """
+        if self.__latency:
+            time.sleep(self.__latency)
+        with self.__cond:
+            if timeout_ms:
+                self.__cond.wait_for(lambda: self.__responses or not self.__valid or not self.__plugged, timeout_ms / 1000.0)
+            else:
+                self.__cond.wait_for(lambda: self.__responses or not self.__valid or not self.__plugged)
+            if not self.__valid or not self.__plugged or not self.__responses:
+                return None
+            return self.__responses.popleft()
+        #end read()
+    #end class SimulatedCBA4
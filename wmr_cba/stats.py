@@ -0,0 +1,461 @@
+"""
+    SUMMARY:
+
+    Running statistics of CBA status streams, in constant memory.
+
+    Dashboards watching a fleet of CBAs want the mean, spread, minimum and
+    maximum of the voltage and current of each, and how long it has spent
+    power limited, without keeping every sample to work them out.  Each
+    sample is folded into accumulators as it arrives (Welford's method for
+    the mean and variance, which stays accurate over millions of samples),
+    and thrown away.
+
+    Windowed statistics, over the last hour say, keep the window as a ring
+    of buckets of accumulators, e.g. 60 buckets of 1 minute.  Adding a
+    sample touches one bucket; a snapshot merges the buckets still inside
+    the window.  The window moves a bucket at a time, so covers between
+    'horizon' less one bucket and 'horizon'.
+
+    AVAILABLE CLASSES:
+
+    RunningStats - Count, mean, variance, minimum and maximum of one value.
+
+    StatusStats - RunningStats of the voltage, current and power of a stream
+    of CBA4Status, and the time spent running and power limited.
+
+    WindowedStatusStats - StatusStats over a moving time window.
+
+    StatsMonitor - StatusStats, and any number of windows, for each CBA4
+    attached.
+
+    Example:
+
+        monitor = stats.StatsMonitor(windows=[60, 3600])
+        monitor.attach(cba)
+        ...
+        snap = monitor.snapshot()[cba.get_serial_number()]
+        print(snap["all"]["voltage"]["mean"], snap[3600]["power_limited_fraction"])
+"""
+# Copyright (c) 2025 - Darren Rook (da66en) (route66@gmail.com)
+# Rights to use this code is made available using the MIT license.
+
+import math
+import threading
+import time
+from wmr_cba.wmr_cba import debug
+
+class RunningStats:
+    """
+    Count, mean, variance, minimum and maximum of a value, updated one
+    sample at a time in constant memory.
+
+    add(value) - Add a sample.
+
+    merge(other) - Add every sample of another RunningStats, as if they had
+    been added to this one.
+
+    copy() - Returns a copy.
+
+    reset() - Forget every sample.
+
+    get_count(), get_mean(), get_min(), get_max() - None for the mean,
+    minimum and maximum if there are no samples.
+
+    get_variance(), get_stddev() - Population variance and standard
+    deviation, 0.0 if fewer than 2 samples.
+
+    to_dict() - Returns all of the above as a dict.
+    """
+    __slots__ = ('__count', '__mean', '__m2', '__min', '__max')
+
+    def __init__(self):
+        self.reset()
+        #end __init__
+
+    def reset(self):
+        self.__count = 0
+        self.__mean = 0.0
+        self.__m2 = 0.0
+        self.__min = math.inf
+        self.__max = -math.inf
+        #end reset()
+
+    def add(self, value):
+        self.__count += 1
+        delta = value - self.__mean
+        self.__mean += delta / self.__count
+        self.__m2 += delta * (value - self.__mean)
+        if value < self.__min:
+            self.__min = value
+        if value > self.__max:
+            self.__max = value
+        #end add()
+
+    def merge(self, other):
+        """
+        Combine the samples of 'other' into this one (Chan et al.'s parallel
+        form of Welford's method).
+        """
+        if other.__count == 0:
+            return
+        if self.__count == 0:
+            self.__count, self.__mean, self.__m2 = other.__count, other.__mean, other.__m2
+            self.__min, self.__max = other.__min, other.__max
+            return
+        count = self.__count + other.__count
+        delta = other.__mean - self.__mean
+        self.__mean += delta * other.__count / count
+        self.__m2 += other.__m2 + (delta * delta * self.__count * other.__count / count)
+        self.__count = count
+        self.__min = min(self.__min, other.__min)
+        self.__max = max(self.__max, other.__max)
+        #end merge()
+
+    def copy(self):
+        c = RunningStats()
+        c.merge(self)
+        return c
+        #end copy()
+
+    def get_count(self):
+        return self.__count
+        #end get_count()
+
+    def get_mean(self):
+        return self.__mean if self.__count else None
+        #end get_mean()
+
+    def get_min(self):
+        return self.__min if self.__count else None
+        #end get_min()
+
+    def get_max(self):
+        return self.__max if self.__count else None
+        #end get_max()
+
+    def get_variance(self):
+        if self.__count < 2:
+            return 0.0
+        return max(self.__m2 / self.__count, 0.0)
+        #end get_variance()
+
+    def get_stddev(self):
+        return math.sqrt(self.get_variance())
+        #end get_stddev()
+
+    def to_dict(self):
+        return {
+            "count": self.__count,
+            "mean": self.get_mean(),
+            "stddev": self.get_stddev(),
+            "min": self.get_min(),
+            "max": self.get_max(),
+        }
+        #end to_dict()
+
+    def __repr__(self):
+        return "RunningStats(" + str(self.to_dict()) + ")"
+        #end __repr__()
+    #end class RunningStats
+
+class StatusStats:
+    """
+    Running statistics of a stream of CBA4Status (or anything with the same
+    fields, such as shm.RingSample or gang.GangSample), oldest first.
+
+    Each sample's state (running, power limited) is taken to last until the
+    next sample, up to 'max_gap' seconds, so a stream that stops doesn't go
+    on being counted.
+
+    __init__(running_only, max_gap) (Constructor) - If 'running_only' is
+    True, the voltage, current and power of samples taken while a test
+    isn't running are left out (they are still counted in 'samples').
+
+    add(status) - Add a sample.
+
+    merge(other) - Add the samples of another StatusStats, which followed
+    the samples of this one.
+
+    copy() - Returns a copy.
+
+    reset() - Forget every sample.
+
+    to_dict() - Returns a dict of:
+    'samples' - Number of samples added.
+    'first', 'last' - Timestamps of the first and last, None if none.
+    'time_running' - Seconds a test was running.
+    'time_power_limited' - Seconds a test was running and power limited.
+    'power_limited_fraction' - 'time_power_limited' over 'time_running', 0.0
+    if no time running.
+    'high_temp' - Number of samples with the high temperature flag.
+    'voltage', 'current', 'power' - RunningStats.to_dict() of the voltage,
+    measured current and power.
+    """
+    __slots__ = ('running_only', 'max_gap', 'voltage', 'current', 'power', 'samples', 'first', 'last',
+        'time_running', 'time_power_limited', 'high_temp', '_last_flags')
+
+    def __init__(self, running_only=False, max_gap=5.0):
+        self.running_only = running_only
+        self.max_gap = max_gap
+        self.voltage = RunningStats()
+        self.current = RunningStats()
+        self.power = RunningStats()
+        self.reset()
+        #end __init__
+
+    def reset(self):
+        self.voltage.reset()
+        self.current.reset()
+        self.power.reset()
+        self.samples = 0
+        self.first = None
+        self.last = None
+        self.time_running = 0.0
+        self.time_power_limited = 0.0
+        self.high_temp = 0
+        self._last_flags = 0
+        #end reset()
+
+    def add(self, status):
+        timestamp = status.timestamp
+        flags = status.flags
+        if self.last is not None:
+            dt = timestamp - self.last
+            if 0.0 < dt <= self.max_gap:
+                if self._last_flags & 0x02:
+                    self.time_running += dt
+                    if self._last_flags & 0x10:
+                        self.time_power_limited += dt
+        else:
+            self.first = timestamp
+        self.last = timestamp
+        self._last_flags = flags
+        self.samples += 1
+        if flags & 0x20:
+            self.high_temp += 1
+        if self.running_only and not (flags & 0x02):
+            return
+        self.voltage.add(status.voltage)
+        self.current.add(status.measured_current)
+        self.power.add(status.voltage * status.measured_current)
+        #end add()
+
+    def merge(self, other):
+        if other.samples == 0:
+            return
+        if self.last is not None and other.first is not None:
+            # the gap between the two, as if the samples had been added here
+            dt = other.first - self.last
+            if (0.0 < dt <= self.max_gap) and (self._last_flags & 0x02):
+                self.time_running += dt
+                if self._last_flags & 0x10:
+                    self.time_power_limited += dt
+        self.voltage.merge(other.voltage)
+        self.current.merge(other.current)
+        self.power.merge(other.power)
+        if self.first is None:
+            self.first = other.first
+        self.last = other.last
+        self._last_flags = other._last_flags
+        self.samples += other.samples
+        self.time_running += other.time_running
+        self.time_power_limited += other.time_power_limited
+        self.high_temp += other.high_temp
+        #end merge()
+
+    def copy(self):
+        c = StatusStats(self.running_only, self.max_gap)
+        c.merge(self)
+        return c
+        #end copy()
+
+    def to_dict(self):
+        return {
+            "samples": self.samples,
+            "first": self.first,
+            "last": self.last,
+            "time_running": self.time_running,
+            "time_power_limited": self.time_power_limited,
+            "power_limited_fraction": (self.time_power_limited / self.time_running) if self.time_running else 0.0,
+            "high_temp": self.high_temp,
+            "voltage": self.voltage.to_dict(),
+            "current": self.current.to_dict(),
+            "power": self.power.to_dict(),
+        }
+        #end to_dict()
+    #end class StatusStats
+
+class WindowedStatusStats:
+    """
+    StatusStats of the samples of the last 'horizon' seconds, kept as a ring
+    of 'num_buckets' StatusStats.  Samples are put in buckets by their
+    timestamp, so must be added oldest first.
+
+    __init__(horizon, num_buckets, running_only, max_gap) (Constructor) -
+    See StatusStats for 'running_only' and 'max_gap'.
+
+    add(status) - Add a sample.
+
+    get_stats(now) - Returns a StatusStats of the samples in the window
+    ending at 'now' (time.time() if not provided).
+
+    to_dict(now) - Returns get_stats(now).to_dict(), plus 'horizon'.
+
+    reset() - Forget every sample.
+    """
+    def __init__(self, horizon, num_buckets=60, running_only=False, max_gap=5.0):
+        if horizon <= 0 or num_buckets < 1:
+            raise ValueError("horizon and num_buckets must be positive")
+        self.__horizon = horizon
+        self.__bucket_seconds = float(horizon) / num_buckets
+        self.__running_only = running_only
+        self.__max_gap = max_gap
+        self.__buckets = [StatusStats(running_only, max_gap) for i in range(num_buckets)]
+        self.__indexes = [None] * num_buckets
+        #end __init__
+
+    def get_horizon(self):
+        return self.__horizon
+        #end get_horizon()
+
+    def reset(self):
+        for bucket in self.__buckets:
+            bucket.reset()
+        self.__indexes = [None] * len(self.__buckets)
+        #end reset()
+
+    def add(self, status):
+        index = int(status.timestamp // self.__bucket_seconds)
+        slot = index % len(self.__buckets)
+        bucket = self.__buckets[slot]
+        if self.__indexes[slot] != index:
+            # the bucket held samples from a lap ago, reuse it
+            bucket.reset()
+            self.__indexes[slot] = index
+        bucket.add(status)
+        #end add()
+
+    def get_stats(self, now=None):
+        if now is None:
+            now = time.time()
+        newest = int(now // self.__bucket_seconds)
+        oldest = newest - len(self.__buckets) + 1
+        out = StatusStats(self.__running_only, self.__max_gap)
+        for index, bucket in sorted((i, b) for i, b in zip(self.__indexes, self.__buckets)
+                if (i is not None) and (oldest <= i <= newest)):
+            out.merge(bucket)
+        return out
+        #end get_stats()
+
+    def to_dict(self, now=None):
+        d = self.get_stats(now).to_dict()
+        d["horizon"] = self.__horizon
+        return d
+        #end to_dict()
+    #end class WindowedStatusStats
+
+class StatsMonitor:
+    """
+    Keeps a StatusStats of everything, and a WindowedStatusStats for each
+    window, for every CBA attached, by serial number.
+
+    __init__(windows, num_buckets, running_only, max_gap) (Constructor) -
+    'windows' is a list of window lengths, in seconds, each made of
+    'num_buckets' buckets.  See StatusStats for 'running_only' and
+    'max_gap'.
+
+    add(status, serial) - Add a sample from the CBA with serial number
+    'serial'.
+
+    attach(cba) - Add every status heard by a CBA4 (see
+    CBA4.add_listener()).
+
+    detach(cba) - Stop adding the status of a CBA4 passed to attach().
+
+    get_serial_numbers() - Returns the serial numbers seen.
+
+    snapshot(serial, reset, now) - Returns a dict, by serial (only 'serial'
+    if provided), of dicts with the StatusStats.to_dict() of everything
+    under the key 'all', and of each window under its length.  If 'reset'
+    is True the statistics are reset in the same step, so no sample is
+    missed or counted twice between snapshots.
+
+    reset(serial) - Forget the samples of 'serial', of every CBA if not
+    provided.
+    """
+    def __init__(self, windows=(), num_buckets=60, running_only=False, max_gap=5.0):
+        debug("StatsMonitor.__init__()")
+        self.__windows = list(windows)
+        self.__num_buckets = num_buckets
+        self.__running_only = running_only
+        self.__max_gap = max_gap
+        self.__lock = threading.Lock()
+        self.__units = {}
+        self.__listeners = {}
+        #end __init__
+
+    def __new_unit(self):
+        windows = [WindowedStatusStats(w, self.__num_buckets, self.__running_only, self.__max_gap) for w in self.__windows]
+        return (StatusStats(self.__running_only, self.__max_gap), windows)
+        #end __new_unit()
+
+    def add(self, status, serial=0):
+        with self.__lock:
+            unit = self.__units.get(serial)
+            if unit is None:
+                unit = self.__new_unit()
+                self.__units[serial] = unit
+            unit[0].add(status)
+            for window in unit[1]:
+                window.add(status)
+        #end add()
+
+    def attach(self, cba):
+        serial = cba.get_serial_number()
+        listener = lambda status: self.add(status, serial)
+        self.__listeners[id(cba)] = listener
+        cba.add_listener(listener)
+        #end attach()
+
+    def detach(self, cba):
+        listener = self.__listeners.pop(id(cba), None)
+        if listener:
+            cba.remove_listener(listener)
+        #end detach()
+
+    def get_serial_numbers(self):
+        with self.__lock:
+            return list(self.__units.keys())
+        #end get_serial_numbers()
+
+    def snapshot(self, serial=None, reset=False, now=None):
+        """
+        Returns the statistics of every CBA, or of 'serial' only.  Takes
+        time proportional to the number of buckets, not of samples.
+        """
+        if now is None:
+            now = time.time()
+        out = {}
+        with self.__lock:
+            serials = list(self.__units.keys()) if serial is None else [serial]
+            for s in serials:
+                unit = self.__units.get(s)
+                if unit is None:
+                    continue
+                d = {"all": unit[0].to_dict()}
+                for window in unit[1]:
+                    d[window.get_horizon()] = window.to_dict(now)
+                out[s] = d
+                if reset:
+                    self.__units[s] = self.__new_unit()
+        return out
+        #end snapshot()
+
+    def reset(self, serial=None):
+        with self.__lock:
+            if serial is None:
+                self.__units.clear()
+            else:
+                self.__units.pop(serial, None)
+        #end reset()
+    #end class StatsMonitor
@@ -0,0 +1,459 @@
+"""
+    SUMMARY:
+
+    Keeps a CBA connected through USB drop outs.
+
+    If the USB link to a CBA blips, the CBA's watchdog stops the test unless
+    the connection is restored quickly.  SupervisedUsb wraps the USB
+    interface of one CBA, detects the drop out, finds the CBA again by its
+    serial number, reopens it, and re-sends the last test settings, all
+    without the CBA4 using it noticing anything but a slow response.
+
+    AVAILABLE CLASSES:
+
+    SupervisedUsb - A CBA4 'interface' that reconnects by itself.
+
+    Example:
+
+        usb_if = supervisor.SupervisedUsb(1234)
+        cba = wmr_cba.CBA4(interface=usb_if)
+        cba.do_start(1.0, 10.5)
+        ...
+        print(usb_if.get_metrics())
+"""
+# Copyright (c) 2025 - Darren Rook (da66en) (route66@gmail.com)
+# Rights to use this code is made available using the MIT license.
+
+import collections
+import threading
+import time
+import usb.core
+from wmr_cba.wmr_cba import MpOrLibUsb, CBA4Config, debug
+
+class SupervisedUsb:
+    """
+    Provides the same functions as MpOrLibUsb, so can be used as the
+    'interface' of a CBA4, but reconnects to the CBA if the connection is
+    lost.
+
+    A drop out is detected when a write fails, or when a response isn't
+    heard within 'response_timeout' seconds of a write (a CBA always answers
+    straight away).  The CBA is then searched for by serial number until it
+    is found, or 'reconnect_timeout' seconds pass.  Once reopened, the last
+    set status (0x53) message that changed the test settings is sent again,
+    restarting the test if the watchdog of the CBA had already stopped it,
+    followed by the message that was waiting for a response.
+
+    __init__(serial_number, opener, ...) (Constructor) - Connect to the CBA
+    with serial number 'serial_number'.  'opener(serial_number)' returns a
+    newly opened interface to the CBA, or None if it can't be found; if not
+    provided, find() is used.  See the constructor for the timeouts.
+
+    @staticmethod find(serial_number, port_path) - Returns a MpOrLibUsb for
+    the CBA with serial number 'serial_number', None if not found.
+
+    is_valid() - True until close() is called, even while disconnected, so
+    the CBA4 keeps trying.
+
+    is_connected() - True if currently connected.
+
+    close() - Close the connection and stop reconnecting.
+
+    write(data, timeout_ms), read(timeout_ms) - Same as MpOrLibUsb.
+
+    get_metrics() - Returns a dict of drop out and reconnect statistics.
+    """
+    def __init__(self, serial_number, opener=None, response_timeout=0.5,
+            reconnect_timeout=10.0, retry_interval=0.05, on_disconnect=None,
+            on_reconnect=None):
+        """
+        Parameters: \n
+        serial_number - Serial number of the CBA.
+        opener - 'opener(serial_number)' returns a newly opened interface to
+        the CBA, or None if not found.  Uses find() if not provided.
+        response_timeout - Seconds without a response to a write before the
+        connection is considered lost.
+        reconnect_timeout - Seconds to keep searching for the CBA after a drop
+        out, before giving up until the next write.
+        retry_interval - Seconds between searches for the CBA.
+        on_disconnect - Optional 'on_disconnect()' called when a drop out is
+        detected.
+        on_reconnect - Optional 'on_reconnect(gap_seconds)' called once
+        reconnected.
+        """
+        debug("SupervisedUsb.__init__()")
+        self.__serial_number = serial_number
+        self.__opener = opener
+        self.__response_timeout = response_timeout
+        self.__reconnect_timeout = reconnect_timeout
+        self.__retry_interval = retry_interval
+        self.__on_disconnect = on_disconnect
+        self.__on_reconnect = on_reconnect
+        self.__lock = threading.RLock()
+        self.__cond = threading.Condition(self.__lock)
+        self.__reconnecting = False
+        self.__usb_if = None
+        self.__port_path = None
+        self.__closed = False
+        self.__setpoint = None
+        self.__last_write = None
+        self.__awaiting_since = None
+        self.__last_response = None
+        self.__disconnected_at = None
+        self.__disconnects = 0
+        self.__reconnects = 0
+        self.__failed_attempts = 0
+        self.__gaps = collections.deque(maxlen=1000)
+        self.__latencies = collections.deque(maxlen=1000)
+        usb_if = self.__open()
+        if usb_if:
+            self.__adopt(usb_if)
+        #end __init__
+
+    @staticmethod
+    def __get_serial_number(usb_if):
+        """
+        Ask 'usb_if' for its config, returns its serial number or 0.
+        """
+        bw = bytearray(1)
+        bw[0] = 0x43
+        if usb_if.write(bw, 1000) <= 0:
+            return 0
+        t_end = time.monotonic() + 1.0
+        while time.monotonic() < t_end:
+            rx = usb_if.read(int((t_end - time.monotonic()) * 1000) + 1)
+            if rx and (rx[0] == 0x63):
+                return CBA4Config(rx).serial_number
+        return 0
+        #end __get_serial_number()
+
+    @staticmethod
+    def find(serial_number, port_path=None):
+        """
+        Finds and opens the CBA with serial number 'serial_number'.
+
+        If 'port_path' (a MpOrLibUsb.get_path() without the '@address') is
+        provided, the device at that path is tried first, without touching
+        any other device.  Otherwise every CBA is asked for its serial
+        number.  The CBAs that don't match are released without being reset,
+        and a libusb CBA in use by another program (or another CBA4) can't be
+        claimed so isn't disturbed, so this is safe while other CBAs on the
+        host are running tests.
+
+        Returns:    \n
+        A MpOrLibUsb, None if not found.
+        """
+        debug("SupervisedUsb.find()")
+        if port_path:
+            try:
+                devs = list(usb.core.find(find_all=True, idVendor=0x2405, idProduct=0x0005))
+            except:
+                devs = []
+            for dev in devs:
+                path = MpOrLibUsb.get_device_path(dev)
+                if path and (path.split("@")[0] == port_path):
+                    usb_if = MpOrLibUsb(usb_device=dev)
+                    if SupervisedUsb.__get_serial_number(usb_if) == serial_number:
+                        return usb_if
+                    usb_if.close(reset=False)
+        found = None
+        for usb_if in MpOrLibUsb.open_all():
+            if (not found) and (SupervisedUsb.__get_serial_number(usb_if) == serial_number):
+                found = usb_if
+            else:
+                # not ours, it may be running a test, so don't reset it
+                usb_if.close(reset=False)
+        return found
+        #end find()
+
+    def __open(self):
+        """
+        Try once to open the CBA.  Called without __lock held, as finding the
+        CBA can take a while.  Returns the interface, None if not found.
+        """
+        try:
+            if self.__opener:
+                usb_if = self.__opener(self.__serial_number)
+            else:
+                usb_if = SupervisedUsb.find(self.__serial_number, self.__port_path)
+        except Exception as e:
+            debug("SupervisedUsb open error: " + str(e))
+            usb_if = None
+        if not usb_if or not usb_if.is_valid():
+            return None
+        return usb_if
+        #end __open()
+
+    def __adopt(self, usb_if):
+        """
+        Use 'usb_if', returned by __open().
+        """
+        self.__usb_if = usb_if
+        get_path = getattr(usb_if, "get_path", None)
+        path = get_path() if get_path else None
+        if path:
+            self.__port_path = path.split("@")[0]
+        #end __adopt()
+
+    @staticmethod
+    def __release(usb_if):
+        """
+        Close 'usb_if' without resetting the device.  A response that was
+        only slow doesn't mean the CBA is gone, and resetting it would stop
+        its test; if it is gone there's nothing to reset.
+        """
+        try:
+            if isinstance(usb_if, MpOrLibUsb):
+                usb_if.close(reset=False)
+            else:
+                usb_if.close()
+        except Exception as e:
+            debug("SupervisedUsb close error: " + str(e))
+        #end __release()
+
+    def __drop(self):
+        """
+        The connection was lost, close what's left of it.  Called with __lock
+        held.
+        """
+        if self.__usb_if:
+            debug("SupervisedUsb: lost connection to " + str(self.__serial_number))
+            SupervisedUsb.__release(self.__usb_if)
+            self.__usb_if = None
+            self.__disconnects += 1
+            self.__disconnected_at = time.monotonic()
+            if self.__on_disconnect:
+                self.__on_disconnect()
+        #end __drop()
+
+    def __reconnect(self):
+        """
+        Search for the CBA until found, close() or 'reconnect_timeout'.  Once
+        found, re-send the last test settings.  Returns True if connected.
+
+        Called without __lock held: it's only taken to check and update the
+        state, so close() and the other callers aren't held up while the CBA
+        is searched for.  Only one thread searches, the others wait for it.
+        """
+        with self.__cond:
+            if self.__usb_if:
+                return True
+            if self.__closed:
+                return False
+            if self.__reconnecting:
+                self.__cond.wait_for(lambda: self.__closed or not self.__reconnecting, self.__reconnect_timeout)
+                return (self.__usb_if is not None) and not self.__closed
+            self.__reconnecting = True
+        try:
+            return self.__search()
+        finally:
+            with self.__cond:
+                self.__reconnecting = False
+                self.__cond.notify_all()
+        #end __reconnect()
+
+    def __search(self):
+        """
+        The search of __reconnect().
+        """
+        t_start = time.monotonic()
+        with self.__cond:
+            if self.__disconnected_at is None:
+                self.__disconnected_at = t_start
+        while True:
+            usb_if = self.__open()
+            with self.__cond:
+                if self.__closed:
+                    if usb_if:
+                        SupervisedUsb.__release(usb_if)
+                    return False
+                if usb_if:
+                    self.__adopt(usb_if)
+                    break
+                self.__failed_attempts += 1
+                if (time.monotonic() - t_start) >= self.__reconnect_timeout:
+                    return False
+                # woken early by close()
+                self.__cond.wait(self.__retry_interval)
+        with self.__cond:
+            return self.__restore(t_start)
+        #end __search()
+
+    def __restore(self, t_start):
+        """
+        Just reconnected, re-send the last test settings.  Called with
+        __lock held.  Returns True if still connected.
+        """
+        last_heard = self.__last_response if self.__last_response else self.__disconnected_at
+        if self.__setpoint:
+            # restore the test settings, and throw away the response
+            if self.__raw_write(self.__setpoint, 1000) > 0:
+                self.__raw_wait_for(0x73)
+        now = time.monotonic()
+        latency = now - t_start
+        gap = now - last_heard
+        self.__reconnects += 1
+        self.__latencies.append(latency)
+        self.__gaps.append(gap)
+        self.__disconnected_at = None
+        debug("SupervisedUsb: reconnected to " + str(self.__serial_number) + " after " + str(gap) + "s")
+        if self.__on_reconnect:
+            self.__on_reconnect(gap)
+        return self.__usb_if is not None
+        #end __restore()
+
+    def __raw_write(self, data, timeout_ms):
+        try:
+            num = self.__usb_if.write(data, timeout_ms)
+        except Exception as e:
+            debug("SupervisedUsb write error: " + str(e))
+            num = 0
+        if num is None or num <= 0:
+            self.__drop()
+            return 0
+        return num
+        #end __raw_write()
+
+    def __raw_wait_for(self, cmd_byte):
+        t_end = time.monotonic() + self.__response_timeout
+        while self.__usb_if and (time.monotonic() < t_end):
+            try:
+                rx = self.__usb_if.read(int((t_end - time.monotonic()) * 1000) + 1)
+            except Exception:
+                rx = None
+            if rx and (rx[0] == cmd_byte):
+                self.__last_response = time.monotonic()
+                return rx
+        return None
+        #end __raw_wait_for()
+
+    def is_valid(self):
+        return not self.__closed
+        #end is_valid()
+
+    def is_connected(self):
+        return self.__usb_if is not None
+        #end is_connected()
+
+    def get_path(self):
+        if not self.__usb_if:
+            return None
+        get_path = getattr(self.__usb_if, "get_path", None)
+        return get_path() if get_path else None
+        #end get_path()
+
+    def close(self):
+        debug("SupervisedUsb.close()")
+        with self.__cond:
+            self.__closed = True
+            self.__cond.notify_all()
+            if self.__usb_if:
+                self.__usb_if.close()
+                self.__usb_if = None
+        #end close()
+
+    def write(self, data, timeout_ms=0):
+        """
+        Write 'data' to the CBA, reconnecting first if needed.  If the write
+        fails the CBA is reconnected and the write tried again.
+
+        Returns:    \n
+        Number of bytes written, 0 if the CBA couldn't be reconnected.
+        """
+        with self.__lock:
+            if self.__closed:
+                return 0
+            if (len(data) >= 2) and (data[0] == 0x53) and (data[1] & 0x01):
+                # a message that changes the test settings, remember it
+                self.__setpoint = bytes(data)
+            self.__last_write = bytes(data)
+        for attempt in range(2):
+            if not self.__reconnect():
+                return 0
+            with self.__lock:
+                if self.__closed:
+                    return 0
+                if not self.__usb_if:
+                    continue
+                num = self.__raw_write(data, timeout_ms)
+                if num > 0:
+                    self.__awaiting_since = time.monotonic()
+                    return num
+        return 0
+        #end write()
+
+    def read(self, timeout_ms=0):
+        """
+        Read from the CBA, same as MpOrLibUsb.read().  If nothing is heard
+        for 'response_timeout' after a write, the connection is considered
+        lost: the CBA is reconnected and the write sent again, so the
+        response being waited for still arrives.
+        """
+        if not self.__reconnect():
+            return None
+        with self.__lock:
+            if self.__closed or not self.__usb_if:
+                return None
+            if self.__awaiting_since:
+                remain = self.__response_timeout - (time.monotonic() - self.__awaiting_since)
+                wait_ms = max(int(remain * 1000), 1)
+                if timeout_ms:
+                    wait_ms = min(wait_ms, timeout_ms)
+            else:
+                wait_ms = timeout_ms
+            try:
+                rx = self.__usb_if.read(wait_ms)
+            except Exception as e:
+                debug("SupervisedUsb read error: " + str(e))
+                rx = None
+            if rx:
+                self.__awaiting_since = None
+                self.__last_response = time.monotonic()
+                return rx
+            if not (self.__awaiting_since and ((time.monotonic() - self.__awaiting_since) >= self.__response_timeout)):
+                return None
+            self.__drop()
+        if self.__reconnect():
+            with self.__lock:
+                if self.__usb_if and self.__last_write:
+                    if self.__raw_write(self.__last_write, 1000) > 0:
+                        self.__awaiting_since = time.monotonic()
+        return None
+        #end read()
+
+    def get_metrics(self):
+        """
+        Returns a dict of:
+        'connected' - True if currently connected.
+        'disconnects' - Number of drop outs detected.
+        'reconnects' - Number of times reconnected.
+        'failed_attempts' - Number of times the CBA was searched for and not
+        found.
+        'last_gap', 'max_gap', 'mean_gap' - Seconds between the last response
+        before a drop out and the CBA being reconnected.
+        'last_latency', 'max_latency', 'mean_latency' - Seconds from starting
+        to search for the CBA to it being reconnected and the test settings
+        re-sent.
+        'gap' - Seconds since the current drop out, 0 if connected.
+        """
+        with self.__lock:
+            gaps = list(self.__gaps)
+            latencies = list(self.__latencies)
+            gap = 0.0
+            if self.__disconnected_at is not None:
+                gap = time.monotonic() - self.__disconnected_at
+            return {
+                "connected": self.__usb_if is not None,
+                "disconnects": self.__disconnects,
+                "reconnects": self.__reconnects,
+                "failed_attempts": self.__failed_attempts,
+                "last_gap": gaps[-1] if gaps else 0.0,
+                "max_gap": max(gaps) if gaps else 0.0,
+                "mean_gap": (sum(gaps) / len(gaps)) if gaps else 0.0,
+                "last_latency": latencies[-1] if latencies else 0.0,
+                "max_latency": max(latencies) if latencies else 0.0,
+                "mean_latency": (sum(latencies) / len(latencies)) if latencies else 0.0,
+                "gap": gap,
+            }
+        #end get_metrics()
+    #end class SupervisedUsb
@@ -0,0 +1,404 @@
+"""
+    SUMMARY:
+
+    Time synchronized sampling of several West Mountain Radio CBA devices.
+
+    When testing the cells of a series pack, or cells in parallel, the
+    voltages of several CBAs need comparing at the same instant.  A CBA4
+    polls on its own thread, so samples from different CBAs can be up to a
+    whole interval apart.  A SyncGroup instead queries every CBA on the same
+    tick of a shared clock, and pairs the responses up into frames.
+
+    Each CBA has its own thread, waiting for the tick, so the queries go out
+    together instead of one after another.  Each sample is timestamped half
+    way between its query being sent and its response being heard (see
+    CBA4Status.rtt), and each frame records the skew, how far apart in time
+    its samples are.
+
+    AVAILABLE CLASSES:
+
+    SyncGroup - Polls a group of CBA4s on a shared tick.
+
+    SyncFrame - The samples of every CBA in the group for one tick.
+
+    Example:
+
+        group = sync.SyncGroup([cba1, cba2, cba3], interval=0.5)
+        group.do_start(2.0, 3.0)
+        ...
+        for frame in group.read_frames():
+            print(frame.tick_time, frame.get_values(), frame.skew)
+        group.close()
+"""
+# Copyright (c) 2025 - Darren Rook (da66en) (route66@gmail.com)
+# Rights to use this code is made available using the MIT license.
+
+import collections
+import threading
+import time
+from wmr_cba.wmr_cba import CBA4, debug, summarize
+
+class SyncFrame:
+    """
+    The samples of every CBA of a SyncGroup, for one tick.
+
+    tick - Number of the tick, counting from 0 at start().
+    tick_time - When the tick was due, as time.time().
+    statuses - Dict of CBA4Status by serial number, None for a CBA that
+    didn't respond before the next tick.
+    skew - Seconds between the earliest and latest sample, 0.0 if fewer than
+    2 samples.
+    max_rtt - Largest round trip time of the samples, 0.0 if none.
+
+    is_complete() - True if every CBA responded.
+
+    get_missing() - Returns the serial numbers of the CBAs that didn't.
+
+    get_values(attr) - Returns a dict, by serial, of the attribute 'attr'
+    (default 'voltage') of each sample.
+    """
+    __slots__ = ('tick', 'tick_time', 'statuses', 'skew', 'max_rtt')
+
+    def __init__(self, tick, tick_time, serials):
+        self.tick = tick
+        self.tick_time = tick_time
+        self.statuses = collections.OrderedDict((serial, None) for serial in serials)
+        self.skew = 0.0
+        self.max_rtt = 0.0
+        #end __init__
+
+    def _finish(self):
+        """
+        Work out the skew once every sample is in.
+        """
+        times = [s.timestamp for s in self.statuses.values() if s]
+        rtts = [s.rtt for s in self.statuses.values() if s and s.rtt]
+        self.skew = (max(times) - min(times)) if len(times) >= 2 else 0.0
+        self.max_rtt = max(rtts) if rtts else 0.0
+        #end _finish()
+
+    def is_complete(self):
+        return all(s is not None for s in self.statuses.values())
+        #end is_complete()
+
+    def get_missing(self):
+        return [serial for serial, s in self.statuses.items() if s is None]
+        #end get_missing()
+
+    def get_values(self, attr="voltage"):
+        return collections.OrderedDict((serial, getattr(s, attr)) for serial, s in self.statuses.items() if s)
+        #end get_values()
+
+    def __repr__(self):
+        return "SyncFrame(tick=" + str(self.tick) + ", skew=" + ("%.6f" % self.skew) + \
+            ", missing=" + str(self.get_missing()) + ")"
+        #end __repr__()
+    #end class SyncFrame
+
+class SyncGroup:
+    """
+    Polls a group of CBA4s on a shared tick, and pairs up their responses
+    into SyncFrame.
+
+    Ticks are every 'interval' seconds of time.monotonic(), counted from
+    start(), so they don't drift.  If the group falls behind, the ticks
+    missed are skipped rather than bunched up.  A frame is passed on once
+    every CBA has responded, or at the next tick with the missing samples
+    set to None.  A CBA still busy with the previous tick skips this one.
+
+    The polls keep running tests alive, so 'interval' must be less than the
+    0.75s watchdog of the CBAs if tests are started with do_start().
+
+    __init__(devices, interval, max_frames) (Constructor) - 'devices' is a
+    list of CBA4, every CBA found if not provided.  'max_frames' is how many
+    frames are kept until read by read_frames().
+
+    start() - Start polling.  Called by do_start().
+
+    stop() - Stop polling.
+
+    close() - Stop all tests and polling, and close any CBA4s opened by the
+    constructor.
+
+    do_start(amps, vstop) - Start a test on every CBA, then polling.  'amps'
+    and 'vstop' can be a dict by serial number.
+
+    do_stop() - Stop the test on every CBA.
+
+    get_serial_numbers() - Returns the serial numbers of the CBAs.
+
+    get_latest_frame() - Returns the last SyncFrame, None if none yet.
+
+    read_frames() - Returns, and removes, the frames since the last call.
+
+    add_listener(callback) - 'callback(frame)' is called for every frame.
+
+    remove_listener(callback) - Stop calling 'callback'.
+
+    get_stats() - Returns a dict of skew, round trip and tick statistics.
+    """
+    # Number of recent frames the skew statistics are worked out over.
+    STATS_WINDOW = 1000
+
+    def __init__(self, devices=None, interval=0.5, max_frames=1000):
+        debug("SyncGroup.__init__()")
+        self.__owns_devices = False
+        if devices is None:
+            devices = CBA4.open_all()
+            self.__owns_devices = True
+        self.__interval = interval
+        self.__units = collections.OrderedDict()
+        for cba in devices:
+            self.__units[cba.get_serial_number()] = cba
+        self.__cond = threading.Condition()
+        self.__emit_lock = threading.Lock()
+        self.__tick = -1
+        self.__tick_time = 0.0
+        self.__tick_mono = 0.0
+        self.__pending = collections.OrderedDict()
+        self.__ready = collections.deque()
+        self.__frames = collections.deque(maxlen=max_frames)
+        self.__latest = None
+        self.__listeners = []
+        self.__running = False
+        self.__threads = []
+        self.__num_frames = 0
+        self.__incomplete = 0
+        self.__missed_ticks = 0
+        self.__late = 0
+        self.__errors = 0
+        self.__skews = collections.deque(maxlen=SyncGroup.STATS_WINDOW)
+        self.__rtts = {}
+        self.__lags = collections.deque(maxlen=SyncGroup.STATS_WINDOW)
+        #end __init__
+
+    def get_serial_numbers(self):
+        return list(self.__units.keys())
+        #end get_serial_numbers()
+
+    def start(self):
+        debug("SyncGroup.start()")
+        with self.__cond:
+            if self.__running:
+                return
+            self.__running = True
+            self.__tick = -1
+        self.__threads = [threading.Thread(target=self.__run_ticks, daemon=True)]
+        for serial in self.__units:
+            self.__rtts.setdefault(serial, collections.deque(maxlen=SyncGroup.STATS_WINDOW))
+            self.__threads.append(threading.Thread(target=self.__run_device, args=(serial,), daemon=True))
+        for thread in self.__threads:
+            thread.start()
+        #end start()
+
+    def stop(self):
+        debug("SyncGroup.stop()")
+        with self.__cond:
+            self.__running = False
+            self.__cond.notify_all()
+        for thread in self.__threads:
+            thread.join()
+        self.__threads = []
+        with self.__cond:
+            # pass on whatever was still being waited for
+            while self.__pending:
+                self.__ready_frame(self.__pending.popitem(last=False)[1])
+        self.__emit()
+        #end stop()
+
+    def close(self):
+        debug("SyncGroup.close()")
+        self.do_stop()
+        self.stop()
+        if self.__owns_devices:
+            for cba in self.__units.values():
+                cba.close()
+        self.__units.clear()
+        #end close()
+
+    def do_start(self, amps, vstop=0):
+        """
+        Start a test on every CBA, kept alive by the polling of this group.
+        """
+        debug("SyncGroup.do_start()")
+        for serial, cba in self.__units.items():
+            a = amps[serial] if isinstance(amps, dict) else amps
+            v = vstop.get(serial, 0) if isinstance(vstop, dict) else vstop
+            cba.do_start(a, v, keep_alive=False)
+        self.start()
+        #end do_start()
+
+    def do_stop(self):
+        debug("SyncGroup.do_stop()")
+        for cba in self.__units.values():
+            try:
+                cba.do_stop()
+            except Exception as e:
+                debug("SyncGroup do_stop error: " + str(e))
+        #end do_stop()
+
+    def __run_ticks(self):
+        start_mono = time.monotonic()
+        start_wall = time.time()
+        tick = 0
+        while True:
+            due = start_mono + (tick * self.__interval)
+            with self.__cond:
+                remain = due - time.monotonic()
+                if remain > 0:
+                    self.__cond.wait_for(lambda: not self.__running, remain)
+                if not self.__running:
+                    break
+                # frames not finished by now never will be
+                while self.__pending:
+                    self.__ready_frame(self.__pending.popitem(last=False)[1])
+                self.__tick = tick
+                self.__tick_mono = due
+                self.__tick_time = start_wall + (due - start_mono)
+                self.__pending[tick] = SyncFrame(tick, self.__tick_time, self.__units.keys())
+                self.__cond.notify_all()
+            self.__emit()
+            behind = int((time.monotonic() - start_mono) / self.__interval)
+            if behind > tick + 1:
+                # fell behind, skip the ticks missed instead of bunching up
+                with self.__cond:
+                    self.__missed_ticks += behind - (tick + 1)
+                tick = behind
+            else:
+                tick += 1
+            #end loop
+        #end __run_ticks()
+
+    def __run_device(self, serial):
+        cba = self.__units[serial]
+        last_tick = -1
+        while True:
+            with self.__cond:
+                self.__cond.wait_for(lambda: (self.__tick != last_tick) or not self.__running)
+                if not self.__running:
+                    break
+                last_tick = self.__tick
+                tick_mono = self.__tick_mono
+            self.__lags.append(time.monotonic() - tick_mono)
+            try:
+                status = cba.get_status(max_age=0)
+            except Exception as e:
+                debug("SyncGroup poll error on " + str(serial) + ": " + str(e))
+                status = None
+            with self.__cond:
+                if not status:
+                    self.__errors += 1
+                    continue
+                if status.rtt is not None:
+                    self.__rtts[serial].append(status.rtt)
+                frame = self.__pending.get(last_tick)
+                if frame is None:
+                    # the next tick came first, the frame was passed on without it
+                    self.__late += 1
+                    continue
+                frame.statuses[serial] = status
+                if frame.is_complete():
+                    # frames finish in tick order, as a CBA answers its ticks in order
+                    del self.__pending[last_tick]
+                    self.__ready_frame(frame)
+            self.__emit()
+            #end loop
+        #end __run_device()
+
+    def __ready_frame(self, frame):
+        """
+        'frame' is done, queue it to be passed on.  Called with __cond held.
+        """
+        frame._finish()
+        self.__num_frames += 1
+        if not frame.is_complete():
+            self.__incomplete += 1
+        self.__skews.append(frame.skew)
+        self.__frames.append(frame)
+        self.__latest = frame
+        self.__ready.append(frame)
+        #end __ready_frame()
+
+    def __emit(self):
+        """
+        Call the listeners with the frames that are done, in tick order.
+        """
+        with self.__emit_lock:
+            while True:
+                with self.__cond:
+                    if not self.__ready:
+                        break
+                    frame = self.__ready.popleft()
+                for callback in self.__listeners:
+                    try:
+                        callback(frame)
+                    except Exception as e:
+                        debug("SyncGroup listener error: " + str(e))
+        #end __emit()
+
+    def get_latest_frame(self):
+        return self.__latest
+        #end get_latest_frame()
+
+    def read_frames(self):
+        """
+        Returns every frame since the last call, and forgets them.
+
+        Returns:    \n
+        A list of SyncFrame, oldest first.
+        """
+        with self.__cond:
+            frames = list(self.__frames)
+            self.__frames.clear()
+        return frames
+        #end read_frames()
+
+    def add_listener(self, callback):
+        """
+        Call 'callback(frame)' with every SyncFrame.  It is called from the
+        polling threads, so should return quickly.
+        """
+        self.__listeners = self.__listeners + [callback]
+        #end add_listener()
+
+    def remove_listener(self, callback):
+        self.__listeners = [l for l in self.__listeners if l != callback]
+        #end remove_listener()
+
+    def get_stats(self):
+        """
+        Returns a dict of:
+        'frames' - number of frames passed on.
+        'incomplete' - frames missing the sample of at least one CBA.
+        'missed_ticks' - ticks skipped because the group fell behind.
+        'late' - samples that arrived after their frame was passed on.
+        'errors' - queries that failed.
+        'skew_mean', 'skew_p95', 'skew_max' - seconds between the earliest
+        and latest sample of a frame, over the last STATS_WINDOW frames.
+        'lag_mean', 'lag_p95', 'lag_max' - seconds from a tick being due to
+        a query starting.
+        'rtt' - dict by serial of {'mean', 'p95', 'max'} round trip times.
+        """
+        with self.__cond:
+            skew = summarize(list(self.__skews))
+            lag = summarize(list(self.__lags))
+            rtt = {}
+            for serial, rtts in self.__rtts.items():
+                r = summarize(list(rtts))
+                rtt[serial] = {"mean": r[0], "p95": r[1], "max": r[2]}
+            return {
+                "frames": self.__num_frames,
+                "incomplete": self.__incomplete,
+                "missed_ticks": self.__missed_ticks,
+                "late": self.__late,
+                "errors": self.__errors,
+                "skew_mean": skew[0],
+                "skew_p95": skew[1],
+                "skew_max": skew[2],
+                "lag_mean": lag[0],
+                "lag_p95": lag[1],
+                "lag_max": lag[2],
+                "rtt": rtt,
+            }
+        #end get_stats()
+    #end class SyncGroup
@@ -0,0 +1,355 @@
+"""
+    SUMMARY:
+
+    Keeps West Mountain Radio CBA devices out of high temperature aborts.
+
+    A CBA only reports that it got too hot once it has already aborted the
+    test (status flag 0x20), and power limiting (status flag 0x10) quietly
+    stretches a test out.  The CBA doesn't report its temperature, so a
+    ThermalManager estimates it from the power being dissipated, using a
+    simple model of the heat sink, and acts before an abort would happen:
+
+      - turns the fan on when the CBA is warm or dissipating a lot of power,
+        and off again once it has cooled down.
+      - derates the load (less current) to what the heat sink can get rid of
+        when the CBA is hot.
+      - pauses the load (0 amps, the test keeps running) if it gets hotter
+        still, and restores it once cooled down.
+      - keeps track of the time spent power limited, and if the CBA power
+        limits for long, sets the load just under the power limit so the
+        current is known instead of being cut by the CBA.
+      - if the CBA aborts anyway, restarts the test once cooled down.
+
+    The model parameters are estimates, tune them to the CBA and how it's
+    mounted.
+
+    AVAILABLE CLASSES:
+
+    ThermalManager - Runs a test on a CBA4 with thermal management.
+
+    Example:
+
+        manager = thermal.ThermalManager(cba)
+        manager.do_start(10.0, 10.5)
+        ...
+        print(manager.get_stats())
+        manager.close()
+"""
+# Copyright (c) 2025 - Darren Rook (da66en) (route66@gmail.com)
+# Rights to use this code is made available using the MIT license.
+
+import math
+import threading
+import time
+from wmr_cba.wmr_cba import debug
+
+class ThermalManager:
+    """
+    Runs tests on a CBA4, adjusting the fan and load as the estimated
+    temperature changes.  Decisions are made on every status heard (see
+    CBA4.add_listener()), so the CBA must be polled, by the thread started by
+    do_start() or by something like CBAFleet.
+
+    __init__(cba, ...) (Constructor) - Manage 'cba'.  See the constructor for
+    the thermal model and the temperatures acted on.
+
+    do_start(amps, vstop, keep_alive) - Start a test on the CBA, see
+    CBA4.do_start().  'amps' is the current wanted, it may be derated.
+
+    do_stop() - Stop the test.  The fan keeps running until cooled down.
+
+    close() - Stop managing the CBA, turning off the fan.
+
+    get_estimated_temp() - Returns the estimated temperature, in C.
+
+    get_amps() - Returns the current the CBA was last set to.
+
+    get_stats() - Returns a dict of the state and what has been done.
+    """
+    # Maximum power the CBA IV can dissipate, in Watts.
+    MAX_POWER = 150.0
+
+    def __init__(self, cba, ambient=25.0, thermal_resistance=0.5,
+            fan_thermal_resistance=0.4, heat_capacity=300.0, fan_speed=255,
+            fan_on_temp=40.0, fan_off_temp=35.0, fan_on_power=50.0,
+            derate_temp=70.0, pause_temp=78.0, resume_temp=60.0,
+            power_limit_grace=5.0, min_adjust_interval=1.0, clock=None,
+            abort_temp=85.0):
+        """
+        Parameters: \n
+        cba - The CBA4 to manage.
+        ambient - Ambient temperature, in C.
+        thermal_resistance - Heat sink to ambient, in C/W, fan off.
+        fan_thermal_resistance - Heat sink to ambient, in C/W, fan at 255.
+        heat_capacity - Of the heat sink, in J/C.
+        fan_speed - Speed (0 to 255) to run the fan at when it's on.
+        fan_on_temp, fan_off_temp - The fan is turned on above 'fan_on_temp',
+        or when dissipating more than 'fan_on_power' Watts, and off again
+        below 'fan_off_temp'.
+        derate_temp - Above this the load is limited to the power the heat
+        sink can get rid of while staying at 'derate_temp', until cooled
+        below 'resume_temp'.
+        pause_temp - Above this the load is paused, until below
+        'resume_temp'.  Also when a test aborted by the CBA is restarted.
+        power_limit_grace - Seconds of power limiting before the load is set
+        just under the power limit.
+        min_adjust_interval - Minimum seconds between changes to the load.
+        clock - Function returning the current time in seconds, defaults to
+        time.monotonic.
+        abort_temp - Temperature the CBA aborts a test at, in C.  If it aborts
+        while estimated cooler than this, the model was too optimistic, and
+        the thermal resistances are scaled up to match (at most doubled per
+        abort).
+        """
+        debug("ThermalManager.__init__()")
+        self.__cba = cba
+        self.__ambient = ambient
+        self.__thermal_resistance = thermal_resistance
+        self.__fan_thermal_resistance = fan_thermal_resistance
+        self.__heat_capacity = heat_capacity
+        self.__fan_speed = fan_speed
+        self.__fan_on_temp = fan_on_temp
+        self.__fan_off_temp = fan_off_temp
+        self.__fan_on_power = fan_on_power
+        self.__derate_temp = derate_temp
+        self.__pause_temp = pause_temp
+        self.__resume_temp = resume_temp
+        self.__power_limit_grace = power_limit_grace
+        self.__min_adjust_interval = min_adjust_interval
+        self.__clock = clock if clock else time.monotonic
+        self.__abort_temp = abort_temp
+        self.__rth_scale = 1.0
+        self.__lock = threading.RLock()
+        self.__acting = False
+        self.__temperature = ambient
+        self.__last_time = None
+        self.__last_adjust = None
+        self.__requested = 0.0
+        self.__vstop = 0
+        self.__active = False
+        self.__amps = 0.0
+        self.__fan = 0
+        self.__paused = False
+        self.__derated = False
+        self.__aborted = False
+        self.__limited_since = None
+        self.__power_cap = None
+        self.__time_power_limited = 0.0
+        self.__time_derated = 0.0
+        self.__time_paused = 0.0
+        self.__derates = 0
+        self.__pauses = 0
+        self.__aborts = 0
+        self.__restarts = 0
+        self.__max_temperature = ambient
+        self.__listener = lambda status: self.__on_status(status)
+        cba.add_listener(self.__listener)
+        #end __init__
+
+    def __rth(self, fan):
+        rth = self.__thermal_resistance + ((self.__fan_thermal_resistance - self.__thermal_resistance) * fan / 255.0)
+        return rth * self.__rth_scale
+        #end __rth()
+
+    def do_start(self, amps, vstop=0, keep_alive=True):
+        """
+        Start a test drawing 'amps', or less if the CBA is hot.
+        """
+        debug("ThermalManager.do_start()")
+        with self.__lock:
+            self.__requested = amps
+            self.__vstop = vstop
+            self.__active = True
+            self.__paused = False
+            self.__aborted = False
+            self.__power_cap = None
+            self.__limited_since = None
+            self.__amps = self.__get_target(None)
+            self.__last_adjust = self.__clock()
+            self.__acting = True
+        try:
+            self.__cba.do_start(self.__amps, vstop, keep_alive, fan=self.__fan)
+        finally:
+            self.__acting = False
+        #end do_start()
+
+    def do_stop(self):
+        debug("ThermalManager.do_stop()")
+        with self.__lock:
+            self.__active = False
+        self.__cba.do_stop()
+        #end do_stop()
+
+    def close(self):
+        debug("ThermalManager.close()")
+        self.__cba.remove_listener(self.__listener)
+        with self.__lock:
+            self.__active = False
+        if self.__fan:
+            self.__fan = 0
+            self.__cba.set_fan(0)
+        #end close()
+
+    def get_estimated_temp(self):
+        return self.__temperature
+        #end get_estimated_temp()
+
+    def get_amps(self):
+        return self.__amps
+        #end get_amps()
+
+    def __get_target(self, status):
+        """
+        Returns the current to draw, from the estimated temperature and
+        whether the CBA is power limiting.
+        """
+        if self.__paused:
+            return 0.0
+        amps = self.__requested
+        volts = status.voltage if status else 0.0
+        if volts <= 0:
+            return amps
+        if self.__power_cap is not None:
+            amps = min(amps, self.__power_cap / volts)
+        if self.__derated:
+            # the power that would settle at 'derate_temp'
+            power = (self.__derate_temp - self.__ambient) / self.__rth(self.__fan)
+            amps = min(amps, power / volts)
+        return amps
+        #end __get_target()
+
+    def __on_status(self, status):
+        if self.__acting:
+            return  # the response to our own change
+        with self.__lock:
+            now = self.__clock()
+            dt = (now - self.__last_time) if (self.__last_time is not None) else 0.0
+            self.__last_time = now
+            power = status.measured_current * status.voltage
+            rth = self.__rth(self.__fan)
+            if dt > 0:
+                target = self.__ambient + (power * rth)
+                self.__temperature = target + ((self.__temperature - target) * math.exp(-dt / (rth * self.__heat_capacity)))
+            self.__max_temperature = max(self.__max_temperature, self.__temperature)
+            if status.is_power_limited():
+                self.__time_power_limited += dt
+            if self.__paused:
+                self.__time_paused += dt
+            elif self.__active and (self.__amps < self.__requested):
+                self.__time_derated += dt
+
+            fan = self.__fan
+            if (self.__temperature > self.__fan_on_temp) or (power > self.__fan_on_power):
+                fan = self.__fan_speed
+            elif self.__temperature < self.__fan_off_temp:
+                fan = 0
+
+            if not self.__active:
+                self.__apply(None, fan)
+                return
+            if status.is_high_temp() or (self.__aborted and not status.is_running()):
+                if not self.__aborted:
+                    self.__aborted = True
+                    self.__aborts += 1
+                    # it was hotter than we thought, at least 'abort_temp'
+                    rise = self.__temperature - self.__ambient
+                    if (rise > 0) and (self.__temperature < self.__abort_temp):
+                        self.__rth_scale *= min((self.__abort_temp - self.__ambient) / rise, 2.0)
+                    self.__temperature = max(self.__temperature, self.__abort_temp)
+                if self.__temperature < self.__resume_temp:
+                    self.__aborted = False
+                    self.__restarts += 1
+                    self.__apply(self.__get_target(status), fan, restart=True)
+                else:
+                    self.__apply(None, fan)
+                return
+            if not status.is_running():
+                # ended by vstop or stopped by someone else
+                self.__active = False
+                self.__apply(None, fan)
+                return
+
+            if status.is_power_limited():
+                if self.__limited_since is None:
+                    self.__limited_since = now
+                elif (now - self.__limited_since) >= self.__power_limit_grace:
+                    self.__power_cap = 0.95 * ThermalManager.MAX_POWER
+            else:
+                self.__limited_since = None
+            if self.__temperature >= self.__derate_temp:
+                self.__derated = True
+            elif self.__temperature < self.__resume_temp:
+                self.__derated = False
+            if (not self.__paused) and (self.__temperature >= self.__pause_temp):
+                self.__paused = True
+                self.__pauses += 1
+            elif self.__paused and (self.__temperature < self.__resume_temp):
+                self.__paused = False
+            amps = self.__get_target(status)
+            if (amps < self.__amps) and (amps > 0) and (self.__amps >= self.__requested):
+                self.__derates += 1
+            self.__apply(amps, fan)
+        #end __on_status()
+
+    def __apply(self, amps, fan, restart=False):
+        """
+        Send the new load and fan speed to the CBA, if they changed.
+        'amps' None leaves the load alone.
+        """
+        now = self.__clock()
+        change_amps = (amps is not None) and (restart or (abs(amps - self.__amps) > max(0.01 * self.__requested, 0.001)))
+        if change_amps and not restart:
+            # don't chase every sample, except to cut the load right down
+            recent = (self.__last_adjust is not None) and ((now - self.__last_adjust) < self.__min_adjust_interval)
+            if recent and (amps > 0) and (amps >= self.__amps):
+                change_amps = False
+        if not change_amps and (fan == self.__fan):
+            return
+        self.__acting = True
+        try:
+            self.__fan = fan
+            if change_amps:
+                self.__amps = amps
+                self.__last_adjust = now
+                self.__cba.set_load(amps, self.__vstop, fan=fan)
+            else:
+                self.__cba.set_fan(fan)
+        finally:
+            self.__acting = False
+        #end __apply()
+
+    def get_stats(self):
+        """
+        Returns a dict of:
+        'temperature' - estimated temperature, in C.
+        'max_temperature' - highest estimated temperature.
+        'fan' - fan speed.
+        'amps' - current the CBA is set to.
+        'requested_amps' - current asked for by do_start().
+        'paused' - True if the load is paused.
+        'time_power_limited', 'time_derated', 'time_paused' - seconds.
+        'derates', 'pauses' - number of times the load was cut.
+        'aborts' - number of high temperature aborts by the CBA.
+        'restarts' - number of tests restarted after an abort.
+        'rth_scale' - how much the thermal resistances have been scaled up
+        by aborts.
+        """
+        with self.__lock:
+            return {
+                "temperature": self.__temperature,
+                "max_temperature": self.__max_temperature,
+                "fan": self.__fan,
+                "amps": self.__amps,
+                "requested_amps": self.__requested,
+                "paused": self.__paused,
+                "time_power_limited": self.__time_power_limited,
+                "time_derated": self.__time_derated,
+                "time_paused": self.__time_paused,
+                "derates": self.__derates,
+                "pauses": self.__pauses,
+                "aborts": self.__aborts,
+                "restarts": self.__restarts,
+                "rth_scale": self.__rth_scale,
+            }
+        #end get_stats()
+    #end class ThermalManager
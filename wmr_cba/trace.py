@@ -0,0 +1,365 @@
+"""
+    SUMMARY:
+
+    Records the USB exchange of a CBA session to a file, and replays it.
+
+    RecordingUsb wraps the interface of a CBA4 (a MpOrLibUsb, or anything
+    with the same functions) and logs every write() and read() with when it
+    happened.  ReplayUsb is an interface that serves a recording back to a
+    CBA4: the responses come from the file instead of a CBA, in real time or
+    as fast as they are asked for, and the messages written can be checked
+    against those recorded.  A session captured in the field can then be
+    used as a deterministic protocol regression test, or to benchmark the
+    decoding and sampling of CBA data many times faster than real time.
+
+    The file is a header, then one record per write() or read():
+
+        header - magic 'CBAT', version (u16), flags (u16), time.time() at
+        the start of the recording (f64), length (u16) and UTF-8 text of the
+        USB path of the device.
+        record - kind (u8, see TraceRecord), microseconds since the start
+        (u64), length of the data (u16), then the data.
+
+    All little endian.  A status round trip (a 16 byte write and a 64 byte
+    read) takes 102 bytes.
+
+    AVAILABLE CLASSES:
+
+    RecordingUsb - A CBA4 'interface' that records what passes through it.
+
+    ReplayUsb - A CBA4 'interface' that replays a recording.
+
+    TraceRecord - One write() or read() of a recording, see read_trace().
+
+    Example:
+
+        usb_if = trace.RecordingUsb(wmr_cba.MpOrLibUsb(), "session.cbat")
+        cba = wmr_cba.CBA4(interface=usb_if)
+        ...
+        cba.close()
+
+        cba = wmr_cba.CBA4(interface=trace.ReplayUsb("session.cbat", realtime=False))
+"""
+# Copyright (c) 2025 - Darren Rook (da66en) (route66@gmail.com)
+# Rights to use this code is made available using the MIT license.
+
+import struct
+import threading
+import time
+from wmr_cba.wmr_cba import debug
+
+MAGIC = b"CBAT"
+VERSION = 1
+# magic, version, flags, start time
+_HEADER = struct.Struct("<4sHHd")
+_PATH_LENGTH = struct.Struct("<H")
+# kind, microseconds since the start, length of the data
+_RECORD = struct.Struct("<BQH")
+
+class TraceRecord:
+    """
+    One write() or read() of a recording.
+
+    kind - WRITE, READ, or READ_NONE for a read() that returned None (timed
+    out, or an error).
+    offset - Seconds from the start of the recording to the write() being
+    called, or the read() returning.
+    data - The bytes written or read, empty for READ_NONE.
+    """
+    WRITE = 1
+    READ = 2
+    READ_NONE = 3
+
+    __slots__ = ('kind', 'offset', 'data')
+
+    def __init__(self, kind, offset, data):
+        self.kind = kind
+        self.offset = offset
+        self.data = data
+        #end __init__
+
+    def __repr__(self):
+        names = {TraceRecord.WRITE: "WRITE", TraceRecord.READ: "READ", TraceRecord.READ_NONE: "READ_NONE"}
+        return "TraceRecord(" + names.get(self.kind, str(self.kind)) + ", offset=" + ("%.6f" % self.offset) + \
+            ", data=" + self.data.hex() + ")"
+        #end __repr__()
+    #end class TraceRecord
+
+def _read_header(f):
+    """
+    Read the header of a recording from file 'f', returns (start time, USB
+    path).
+    """
+    raw = f.read(_HEADER.size)
+    if len(raw) < _HEADER.size:
+        raise ValueError("not a CBA trace, too short")
+    magic, version, flags, start = _HEADER.unpack(raw)
+    if (magic != MAGIC) or (version != VERSION):
+        raise ValueError("not a CBA trace, or an unsupported version")
+    length = _PATH_LENGTH.unpack(f.read(_PATH_LENGTH.size))[0]
+    path = f.read(length).decode("utf-8") if length else None
+    return start, path
+    #end _read_header()
+
+def read_header(path):
+    """
+    Returns (start time, USB path) of the recording in file 'path', the start
+    as time.time() and the USB path None if it wasn't known.
+    """
+    with open(path, "rb") as f:
+        return _read_header(f)
+    #end read_header()
+
+def read_trace(path):
+    """
+    Iterates over the records of the recording in file 'path', yielding a
+    TraceRecord for each.  A record cut short (the recording didn't end
+    cleanly) ends the iteration.
+    """
+    with open(path, "rb") as f:
+        _read_header(f)
+        while True:
+            raw = f.read(_RECORD.size)
+            if len(raw) < _RECORD.size:
+                break
+            kind, micros, length = _RECORD.unpack(raw)
+            data = f.read(length)
+            if len(data) < length:
+                break
+            yield TraceRecord(kind, micros / 1000000.0, data)
+    #end read_trace()
+
+class RecordingUsb:
+    """
+    Provides the same functions as MpOrLibUsb, so can be used as the
+    'interface' of a CBA4.  Passes everything on to another interface,
+    recording each write() and read() to a file.
+
+    __init__(interface, path, buffer_size) (Constructor) - Record what passes
+    through 'interface' (a MpOrLibUsb, SimulatedCBA4, SupervisedUsb...) to
+    the file 'path', which is overwritten.  Records are buffered in memory
+    up to 'buffer_size' bytes.
+
+    is_valid(), get_path(), write(data, timeout_ms), read(timeout_ms) - Same
+    as MpOrLibUsb.
+
+    flush() - Write the buffered records to the file.
+
+    close() - Close the interface, and the file.
+
+    get_records() - Returns the number of records written.
+    """
+    def __init__(self, interface, path, buffer_size=64*1024):
+        debug("RecordingUsb.__init__()")
+        self.__usb_if = interface
+        self.__lock = threading.Lock()
+        self.__file = open(path, "wb", buffering=buffer_size)
+        self.__start = time.perf_counter()
+        self.__records = 0
+        usb_path = self.get_path()
+        usb_path = usb_path.encode("utf-8") if usb_path else b""
+        self.__file.write(_HEADER.pack(MAGIC, VERSION, 0, time.time()))
+        self.__file.write(_PATH_LENGTH.pack(len(usb_path)))
+        self.__file.write(usb_path)
+        #end __init__
+
+    def __record(self, kind, data, when):
+        data = bytes(data) if data else b""
+        micros = int((when - self.__start) * 1000000.0)
+        with self.__lock:
+            if self.__file is None:
+                return
+            self.__file.write(_RECORD.pack(kind, max(micros, 0), len(data)))
+            self.__file.write(data)
+            self.__records += 1
+        #end __record()
+
+    def is_valid(self):
+        return bool(self.__usb_if) and self.__usb_if.is_valid()
+        #end is_valid()
+
+    def get_path(self):
+        get_path = getattr(self.__usb_if, "get_path", None)
+        if not get_path:
+            return None
+        return get_path()
+        #end get_path()
+
+    def get_records(self):
+        return self.__records
+        #end get_records()
+
+    def write(self, data, timeout_ms=0):
+        self.__record(TraceRecord.WRITE, data, time.perf_counter())
+        return self.__usb_if.write(data, timeout_ms)
+        #end write()
+
+    def read(self, timeout_ms=0):
+        rx = self.__usb_if.read(timeout_ms)
+        if rx:
+            self.__record(TraceRecord.READ, rx, time.perf_counter())
+        else:
+            self.__record(TraceRecord.READ_NONE, None, time.perf_counter())
+        return rx
+        #end read()
+
+    def flush(self):
+        with self.__lock:
+            if self.__file:
+                self.__file.flush()
+        #end flush()
+
+    def close(self):
+        debug("RecordingUsb.close()")
+        if self.__usb_if:
+            self.__usb_if.close()
+        with self.__lock:
+            if self.__file:
+                self.__file.close()
+                self.__file = None
+        #end close()
+
+    def __del__(self):
+        try:
+            self.close()
+        except Exception:
+            pass
+        #end __del__
+    #end class RecordingUsb
+
+class ReplayUsb:
+    """
+    Provides the same functions as MpOrLibUsb, so can be used as the
+    'interface' of a CBA4, serving back a recording made by RecordingUsb.
+
+    Each read() returns the next recorded read, whatever was written.  Each
+    write() is matched with the next recorded write, and counted as a
+    mismatch if the data differs; if 'strict' is True a mismatch raises
+    ValueError instead, and ends the replay.  Once every recorded read has been served, reads
+    return None and is_valid() is False.
+
+    __init__(path, realtime, speed, strict) (Constructor) - Replay the file
+    'path'.  If 'realtime' is True each read returns no sooner than it did
+    in the recording, divided by 'speed' (from the first write() or
+    read()), otherwise reads return straight away.
+
+    is_valid(), get_path(), write(data, timeout_ms), read(timeout_ms) - Same
+    as MpOrLibUsb.  The USB path is the one recorded.
+
+    close() - Stop replaying.
+
+    get_stats() - Returns a dict of:
+    'reads', 'writes' - Number served.
+    'remaining' - Recorded reads not served yet.
+    'mismatches' - Writes that differed from the recording.
+    'first_mismatch' - Index (counting writes from 0), recorded and
+    written data of the first mismatch, None if none.
+    'max_lag' - Most seconds a realtime read returned after it was due.
+    """
+    def __init__(self, path, realtime=True, speed=1.0, strict=False):
+        debug("ReplayUsb.__init__()")
+        self.__usb_path = read_header(path)[1]
+        records = list(read_trace(path))
+        self.__reads = [r for r in records if r.kind != TraceRecord.WRITE]
+        self.__writes = [r for r in records if r.kind == TraceRecord.WRITE]
+        self.__realtime = realtime
+        self.__speed = speed
+        self.__strict = strict
+        self.__lock = threading.Lock()
+        self.__cond = threading.Condition(self.__lock)
+        self.__next_read = 0
+        self.__next_write = 0
+        self.__mismatches = 0
+        self.__first_mismatch = None
+        self.__max_lag = 0.0
+        self.__start = None
+        self.__valid = True
+        #end __init__
+
+    def __started(self):
+        """
+        Returns the time the replay started, starting it if this is the first
+        write() or read().  Called with __lock held.
+        """
+        if self.__start is None:
+            # line the first record up with now, not with the start of the
+            # recording, which may have been a while before the first write
+            first = min([r.offset for r in self.__reads[:1] + self.__writes[:1]] or [0.0])
+            self.__start = time.perf_counter() - (first / self.__speed)
+        return self.__start
+        #end __started()
+
+    def is_valid(self):
+        return self.__valid and (self.__next_read < len(self.__reads))
+        #end is_valid()
+
+    def get_path(self):
+        return self.__usb_path
+        #end get_path()
+
+    def close(self):
+        debug("ReplayUsb.close()")
+        with self.__cond:
+            self.__valid = False
+            self.__cond.notify_all()
+        #end close()
+
+    def write(self, data, timeout_ms=0):
+        with self.__lock:
+            if not self.is_valid():
+                return 0
+            self.__started()
+            index = self.__next_write
+            if index < len(self.__writes):
+                recorded = self.__writes[index].data
+                self.__next_write += 1
+            else:
+                recorded = None
+            if recorded != bytes(data):
+                self.__mismatches += 1
+                if self.__first_mismatch is None:
+                    self.__first_mismatch = (index, recorded, bytes(data))
+                if self.__strict:
+                    # the rest of the recording won't line up either
+                    self.__valid = False
+                    raise ValueError("write " + str(index) + " differs from the recording: " +
+                        (recorded.hex() if recorded else "nothing recorded") + " != " + bytes(data).hex())
+        return len(data)
+        #end write()
+
+    def read(self, timeout_ms=0):
+        with self.__cond:
+            if not self.is_valid():
+                return None
+            start = self.__started()
+            record = self.__reads[self.__next_read]
+            if self.__realtime:
+                due = start + (record.offset / self.__speed)
+                remain = due - time.perf_counter()
+                if (timeout_ms > 0) and (remain > (timeout_ms / 1000.0)):
+                    # not due within the timeout, like a real read timing out
+                    self.__cond.wait(timeout_ms / 1000.0)
+                    return None
+                if remain > 0:
+                    self.__cond.wait_for(lambda: not self.__valid, remain)
+                    if not self.__valid:
+                        return None
+                self.__max_lag = max(self.__max_lag, time.perf_counter() - due)
+            self.__next_read += 1
+            if record.kind == TraceRecord.READ_NONE:
+                return None
+            return bytearray(record.data)
+        #end read()
+
+    def get_stats(self):
+        with self.__lock:
+            return {
+                "reads": self.__next_read,
+                "writes": self.__next_write,
+                "remaining": len(self.__reads) - self.__next_read,
+                "mismatches": self.__mismatches,
+                "first_mismatch": self.__first_mismatch,
+                "max_lag": self.__max_lag,
+            }
+        #end get_stats()
+    #end class ReplayUsb
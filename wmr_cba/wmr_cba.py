@@ -16,6 +16,19 @@
 
     CBA4 - Class for talking to a WMR CBA4
 
+    CBA4Status - A decoded status (0x73) response from a CBA4, with when it
+    was measured and the USB round trip time.
+
+    AdaptivePollPolicy - Decides how often the thread started by
+    CBA4.do_start() polls the status, from how fast it's changing.
+
+    CBA4Trigger - A condition on the status of a CBA4 (low voltage, power
+    limited, high temperature...) and what to do when it is met.
+
+    CBA4Config - A decoded config (0x63) response from a CBA4.
+
+    CBA4ConfigCache - An on-disk cache of CBA4Config, by USB path.
+
     MpUsbApi - Class for talking to a USB device using Microchip's MPUSBAPI 
     driver.  This may not be useful to many people, but provided for any
     legacy users of this driver.
@@ -39,6 +52,59 @@
 
     2025-Feb-10
       - Replaced 'isAlive()' with 'is_alive()' (thanks @Cybertaco360)
+
+    2026-Oct-18
+      - Added CBA4Status and CBA4.get_status(), decoding every field of a
+        status response from a single USB transaction.
+      - Added SimulatedCBA4 (simulator.py) and a Prometheus/OpenMetrics
+        exporter (exporter.py).
+      - Added CBA4.add_listener(), and streaming CSV/Parquet writers
+        (writers.py).
+      - Added a status cache to CBA4, getters take a 'max_age' to reuse a
+        recent status instead of sending a new status message.  USB
+        transactions from different threads are now serialized.
+      - Added CBA4.open_all() and MpOrLibUsb.open_all(), opening every
+        device in one enumeration pass, and do_start(keep_alive=False).
+        Added CBAFleet (fleet.py).
+      - Added offline discharge analysis (analysis.py).
+      - Added streaming min/max and LTTB downsamplers (downsample.py).
+      - Added the 'wmr-cba' command line tool (cli.py).
+      - The config (0x63) response is decoded into a CBA4Config, and can be
+        cached on disk by USB path with CBA4ConfigCache, skipping the config
+        query when a CBA is opened again.
+      - MpOrLibUsb read()/write() no longer raise on USB errors, and libusb
+        reads honour 'timeout_ms'.  Added SupervisedUsb (supervisor.py) to
+        reconnect to a CBA and resume its test after a USB drop out.
+      - CBA4Status is timestamped half way between the status message being
+        sent and the response heard, and records the round trip time
+        ('rtt').  Added SyncGroup (sync.py), polling several CBAs on a shared
+        tick and pairing up their samples.
+      - Added CBA4Trigger and CBA4.add_trigger(), evaluating conditions on
+        every status heard and stopping the test or changing the load as
+        soon as they match.  Added CBA4.set_load(), changing the load
+        without stopping the test.  do_stop() can be called from a listener
+        running on the thread started by do_start(), and no longer waits for
+        that thread's 0.75s sleep to finish.
+      - Added control of the fan (the FAN byte of the set status message,
+        which was always 0): do_start(fan), set_load(fan) and set_fan().
+        Added ThermalManager (thermal.py), and a thermal model to
+        SimulatedCBA4.
+      - Added JobScheduler (jobs.py), running a persistent queue of tests on
+        whichever CBA is free.
+      - Added a shared memory ring of samples for other processes (shm.py).
+      - Added CBA4Process (process.py), running each CBA in its own worker
+        process behind a proxy with the CBA4 functions.
+      - Added AdaptivePollPolicy and CBA4.set_poll_policy(), polling the
+        status faster while it's changing and slower while it's steady.
+      - Added AsyncLibUsb (libusb_async.py), an interface using libusb's
+        asynchronous transfers with several reads always queued.
+      - Added GangedCBA4 (gang.py), sharing one test's load between several
+        CBAs on the same battery.  Added SimulatedBattery, which several
+        SimulatedCBA4 can share, and SimulatedCBA4(max_power).
+      - Added running statistics in constant memory, all time and over
+        moving windows (stats.py).
+      - Added RecordingUsb and ReplayUsb (trace.py), recording the USB
+        exchange of a session to a file and replaying it to a CBA4.
 """
 # Copyright (c) 2025 - Darren Rook (da66en) (route66@gmail.com)
 # Rights to use this code is made available using the MIT license.
@@ -47,7 +113,11 @@ import threading
 import time
 import ctypes
 import sys
+import os
+import json
+import math
 import usb.core
+import usb.util
 from sys import exit
 
 def debug(msg):
@@ -58,55 +128,138 @@ def debug(msg):
     pass
     #end debug
 
+def summarize(values):
+    """
+    Returns (mean, 95th percentile, max) of 'values', zeros if empty.  Used
+    for the timing statistics of SyncGroup and JobScheduler.
+    """
+    if not values:
+        return (0.0, 0.0, 0.0)
+    values = sorted(values)
+    p95 = values[min(int(math.ceil(0.95 * len(values))) - 1, len(values) - 1)]
+    return (sum(values) / len(values), p95, values[-1])
+    #end summarize()
+
 class CBA4:
     """
     Class for talking to CBA IV.
 
-    __init__(serial_number) (Constructor) - Open a CBAIV.  If serial_number is
-    provided, will attempt to open that specific CBAIV.  If serial_number isn't
-    provided, will attempt to open the first CBAIV found.
+    __init__(serial_number, interface, max_age, config_cache) (Constructor) -
+    Open a CBAIV.  If serial_number is provided, will attempt to open that
+    specific CBAIV.  If serial_number isn't provided, will attempt to open
+    the first CBAIV found.  See set_max_age() for 'max_age'.  If
+    'config_cache' (a CBA4ConfigCache) is provided, the config of the CBAIV
+    is taken from the cache when still valid, instead of asking the CBAIV.
 
     is_valid() - returns True if we are connected to a CBAIV.
 
     close() - gracefully close the connection to the CBAIV.
 
-    @staticmethod scan() - Returns an array of found CBAIV's serial numbers.
+    release() - let go of the CBAIV without stopping its test or resetting
+    it, for one opened only to read its serial number.
+
+    @staticmethod scan(config_cache) - Returns an array of found CBAIV's serial
+    numbers.
+
+    @staticmethod open_all(max_age, config_cache) - Opens every CBAIV found,
+    returns an array of CBA4 objects.
 
     @staticmethod test() - Perform a simple test of the USB framework.
 
     get_serial_number() - Returns the serial number of the connected CBAIV.
 
-    do_start(amps, vstop) - Starts performing a test by drawing 'amps' current
-    through the CBAIV.  If 'vstop' is provided, will automatically stop drawing
-    current if the voltage of the battery goes below specified value.
+    get_config() - Returns the config of the connected CBAIV, a CBA4Config.
+
+    do_start(amps, vstop, keep_alive, fan) - Starts performing a test by
+    drawing 'amps' current through the CBAIV.  If 'vstop' is provided, will
+    automatically stop drawing current if the voltage of the battery goes
+    below specified value.
 
     do_stop() - Stops performing a test, stops all current being drawn.
 
-    get_voltage() - Gets the voltage being read by the CBAIV.
+    set_load(amps, vstop, fan) - Change the current drawn by a running test,
+    without stopping it first like do_start() does.
+
+    set_fan(fan) - Set the fan speed, 0 (off) to 255, without changing the
+    test.  get_fan() returns the speed last set.
+
+    get_voltage(max_age) - Gets the voltage being read by the CBAIV.
+
+    get_set_current(max_age) - Gets the current that was set by the do_start().
+
+    get_measured_current(max_age) - Gets the actual current that is being drawn
+    by the CBAIV.
 
-    get_set_current() - Gets the current that was set by the do_start().
+    is_running(max_age) - Returns True if the CBAIV is performing a test and
+    drawing current.
 
-    get_measured_current() - Gets the actual current that is being drawn by the
-    CBAIV.
+    is_power_limited(max_age) - Returns True if the CBAIV is limiting current
+    draw to prevent exceeding the max power limits of the unit.
 
-    is_running() - Returns True if the CBAIV is performing a test and drawing
-    current.
+    is_high_temp(max_age) - Returns True if the test was aborted because the
+    CBAIV temperature was too high.
 
-    is_power_limited() - Returns True if the CBAIV is limiting current draw
-    to prevent exceeding the max power limits of the unit.
+    get_status(max_age) - Returns every field of one status response as a
+    CBA4Status, so several values can be read with one USB transaction.  Use
+    CBA4Status.get_age() to see how old it is.
 
-    is_high_temp() - Returns True if the test was aborted because the CBAIV 
-    temperature was too high.
+    set_max_age(seconds) - How old a cached status can be before the getters
+    above send a new status message, when a test isn't running.
+
+    The getters above all take an optional 'max_age', in seconds.  If the last
+    status heard is older than 'max_age' a new status message is sent, else
+    the last status is used.  If several threads need a new status at the same
+    time, only one status message is sent and they all use the response.  If
+    'max_age' isn't provided, the latest status heard by the thread started by
+    do_start() is used while a test is running, else the age set by
+    set_max_age() is used.
+
+    add_listener(callback) - 'callback(status)' is called with a CBA4Status
+    each time a status response is heard, including by the thread started
+    by do_start().
+
+    remove_listener(callback) - Stop calling 'callback'.
+
+    add_trigger(trigger) - Evaluate a CBA4Trigger on each status heard,
+    before the listeners are called.  Returns 'trigger'.
+
+    remove_trigger(trigger) - Stop evaluating 'trigger'.
+
+    set_poll_policy(policy) - How often the thread started by do_start()
+    polls the status.  'policy.next_interval(status)' is called with each
+    status it hears, and returns the seconds until the next poll, see
+    AdaptivePollPolicy.  None (the default) polls every
+    KEEP_ALIVE_INTERVAL.  get_poll_policy() returns the policy.
     """
-    def __init__(self, serial_number=None, interface=None):
+    # Seconds between polls by the thread started by do_start(), and the
+    # most it will wait whatever the poll policy, to keep the watchdog of
+    # the CBA happy.
+    KEEP_ALIVE_INTERVAL = 0.75
+
+    def __init__(self, serial_number=None, interface=None, max_age=0, config_cache=None):
         debug("CBA4.__init__()")
-        self.__config_bytes = None
+        self.__config = None
         self.__thread = None
+        self.__vstop = 0
+        self.__amps = 0
+        self.__fan = 0
+        self.__listeners = []
+        self.__triggers = []
+        self.__trigger_lock = threading.RLock()
+        self.__poll_policy = None
+        self.__max_age = max_age
+        self.__io_lock = threading.RLock()
+        self.__status = None
+        self.__status_cond = threading.Condition()
+        self.__status_querying = False
+        # counts the status responses heard, so get_status() can tell a
+        # response heard after it asked from one heard before
+        self.__status_heard = 0
 
         if serial_number:
             interface_number = 0
             if serial_number:
-                devices = self.scan()
+                devices = self.scan(config_cache)
                 for device in devices:
                     if device == serial_number:
                         break
@@ -121,13 +274,21 @@ class CBA4:
             self.__usb_if = MpOrLibUsb()
         
         if self.is_valid():
-            rx = bytearray(65)
-            bw = bytearray(1)
-            bw[0] = 0x43
-            self.__usb_if.write(bw, 1000)
-            ok = self.__wait_for(0x63, rx)
-            if ok:
-                self.__config_bytes = list(rx)
+            usb_path = None
+            if config_cache:
+                usb_path = self.get_usb_path()
+            if usb_path:
+                self.__config = config_cache.get(usb_path)
+            if not self.__config:
+                rx = bytearray(65)
+                bw = bytearray(1)
+                bw[0] = 0x43
+                self.__usb_if.write(bw, 1000)
+                ok = self.__wait_for(0x63, rx)
+                if ok:
+                    self.__config = CBA4Config(rx)
+                    if usb_path:
+                        config_cache.put(usb_path, self.__config)
         #end __init__
 
     def close(self):
@@ -136,11 +297,37 @@ class CBA4:
         """
         debug("CBA4.close()")
         self.do_stop()
+        if self.__fan and self.is_valid():
+            self.set_fan(0)
         if self.__usb_if:
             self.__usb_if.close()
         self.__usb_if = None
         #end close()
 
+    def release(self):
+        """
+        Let go of the CBA4 without stopping its test, turning off its fan or
+        resetting its USB device.  Use this instead of close() for a CBA that
+        was only opened to read its serial number, as it may be running a
+        test for another program.  The thread started by do_start() is
+        stopped, so a test started by this CBA4 ends when its watchdog runs
+        out.
+        """
+        debug("CBA4.release()")
+        thread = self.__thread
+        if (thread and thread.is_alive()):
+            thread.stop()
+            if thread is not threading.current_thread():
+                thread.join(None)
+            self.__thread = None
+        usb_if = self.__usb_if
+        self.__usb_if = None
+        if isinstance(usb_if, MpOrLibUsb):
+            usb_if.close(reset=False)
+        elif usb_if:
+            usb_if.close()
+        #end release()
+
     def __del__(self):
         debug("CBA4.__del__()")
         self.close()
@@ -172,17 +359,25 @@ class CBA4:
             self.__rx_bytes_unsynced = bytearray(65)
             self.__rx_bytes_synced = bytearray(65)
             self.__run = True
+            self.__stop_event = threading.Event()
             self.__temp_halted = False
             #end __init__()
 
         def run(self):
             debug("CBA4.__worker_thread.run()")
+            interval = CBA4.KEEP_ALIVE_INTERVAL
             while self.__run:
-                time.sleep(0.75)
-                self.__cba.get_status_response(self.__tx_bytes, self.__rx_bytes_unsynced)
+                if self.__stop_event.wait(interval):
+                    break
+                ok = self.__cba.get_status_response(self.__tx_bytes, self.__rx_bytes_unsynced)
                 self.__lock.acquire()
                 self.__rx_bytes_synced[:] = self.__rx_bytes_unsynced
                 self.__lock.release()
+                interval = CBA4.KEEP_ALIVE_INTERVAL
+                policy = self.__cba.get_poll_policy()
+                if ok and policy:
+                    status = self.__cba.get_status(float("inf"))
+                    interval = min(max(policy.next_interval(status), 0.0), CBA4.KEEP_ALIVE_INTERVAL)
             #end run()
 
         def stop(self):
@@ -192,6 +387,7 @@ class CBA4:
             """
             debug("CBA4.__worker_thread.stop()")
             self.__run = False
+            self.__stop_event.set()
             #end stop()
 
         def get_status_response(self, status_bytes):
@@ -221,25 +417,45 @@ class CBA4:
         #end is_valid()
 
     @staticmethod
-    def scan():
+    def scan(config_cache=None):
         """
         Returns an array of found devices, as their serial number (integer).
+        If 'config_cache' (a CBA4ConfigCache) is provided, devices found in
+        the cache aren't asked for their config.  The devices are released,
+        not closed, so tests running on them carry on.
         """
         debug("CBA4.scan()")
-        num = MpOrLibUsb.get_device_count()
         devices = []
-        i = 0
-        while i < num:
-            cba = CBA4(interface=MpOrLibUsb(i))
-            i += 1
-            sn = cba.get_serial_number()
-            if sn:
-                devices.append(sn)
-            cba.close()
+        for cba in CBA4.open_all(config_cache=config_cache):
+            devices.append(cba.get_serial_number())
+            cba.release()
             #end loop
         return devices
         #end scan()
 
+    @staticmethod
+    def open_all(max_age=0, config_cache=None):
+        """
+        Opens every device found, enumerating the USB bus only once.  Use this
+        instead of scan() followed by opening each serial number, which
+        enumerates the bus again for every device.
+
+        Returns:    \n
+        An array of CBA4 objects, only those that responded with a serial
+        number.
+        """
+        debug("CBA4.open_all()")
+        devices = []
+        for usb_if in MpOrLibUsb.open_all():
+            cba = CBA4(interface=usb_if, max_age=max_age, config_cache=config_cache)
+            if cba.get_serial_number():
+                devices.append(cba)
+            else:
+                cba.release()
+            #end loop
+        return devices
+        #end open_all()
+
     @staticmethod
     def test():
         debug("CBA4.test()")
@@ -271,8 +487,9 @@ class CBA4:
             #num_read = self.__usb_if.MPUSBRead(self.__handle_read, rx_bytes, int(remain*1000))
             #if (num_read > 0) and (rx_bytes[0]==cmd_byte):
             #    return True
-            rx = self.__usb_if.read(int(remain*1000))
-            num_read = len(rx)
+            # a timeout of 0 would mean wait forever
+            rx = self.__usb_if.read(max(1, int(remain*1000)))
+            num_read = len(rx) if rx else 0
             if rx:
                 rx_bytes[:] = rx
             if (num_read > 0) and (rx_bytes[0]==cmd_byte):
@@ -293,12 +510,31 @@ class CBA4:
         Returns:    \n
         The serial number, an integer.  Returns 0 if error.
         """
-        if not self.__config_bytes:
+        if not self.__config:
             return 0
-        return self.__config_bytes[4] + (self.__config_bytes[5] * 0x100) + (self.__config_bytes[6] * 0x10000) + (self.__config_bytes[7] * 0x1000000)
+        return self.__config.serial_number
         #end get_serial_number
 
-    def do_start(self, amps, vstop=0):
+    def get_config(self):
+        """
+        Returns the config response of the device, a CBA4Config.  Returns None
+        if error.
+        """
+        return self.__config
+        #end get_config()
+
+    def get_usb_path(self):
+        """
+        Returns a string identifying where the device is connected, see
+        MpOrLibUsb.get_path().  None if not known.
+        """
+        get_path = getattr(self.__usb_if, "get_path", None)
+        if not get_path:
+            return None
+        return get_path()
+        #end get_usb_path()
+
+    def do_start(self, amps, vstop=0, keep_alive=True, fan=None):
         """
         Tells the CBA to start drawing 'amps' load, in float, from it's source.  
         If voltage of supply goes below 'vstop', then the unit will stop drawing
@@ -309,11 +545,33 @@ class CBA4:
 
         The CBAIV has a watchdog timer (WDT) that stops drawing current if
         the USB connection goes inactive.  To prevent this from happening,
-        this function starts a thread that keeps the CBAIV alive.
+        this function starts a thread that keeps the CBAIV alive.  If
+        'keep_alive' is False the thread isn't started, and the caller must
+        instead call get_status(max_age=0) at least every 0.75 seconds (this
+        is how CBAFleet drives many CBAs from one thread pool).
+
+        'fan' is the speed of the fan, 0 (off) to 255, unchanged if not
+        provided (see set_fan()).
         """
         debug("CBA4.do_start()")
         self.do_stop()
 
+        if fan is not None:
+            self.__fan = fan
+        self.__amps = amps
+        self.__vstop = vstop
+        self.get_status_response(CBA4.__new_start_request(amps, vstop, self.__fan))
+
+        if keep_alive:
+            self.__thread = CBA4.__worker_thread(self)
+            self.__thread.start()
+        #end do_start_draw()
+
+    @staticmethod
+    def __new_start_request(amps, vstop, fan=0):
+        """
+        Returns a set status (0x53) message that runs a test drawing 'amps'.
+        """
         amps *= 1000.0 * 1000.0
         amps = int(amps)
         tx = bytearray(16)
@@ -326,7 +584,7 @@ class CBA4:
         tx[4] = (amps >> 8) & 0xff
         tx[5] = (amps >> 16) & 0xff
         tx[6] = (amps >> 24) & 0xff
-        tx[7] = 0   #FAN
+        tx[7] = int(fan) & 0xff   #FAN
         tx[8] = 0   #LED1
         tx[9] = 0   #LED2
         tx[10] = 0  #IOTRIS
@@ -337,29 +595,79 @@ class CBA4:
         tx[13] = (vstop >> 8) & 0xff
         tx[14] = (vstop >> 16) & 0xff
         tx[15] = (vstop >> 24) & 0xff
+        return tx
+        #end __new_start_request()
 
-        self.get_status_response(tx)
+    def set_load(self, amps, vstop=None, fan=None):
+        """
+        Change the current drawn by a running test to 'amps', in one USB
+        transaction.  Unlike do_start(), the test isn't stopped first, and the
+        thread keeping the CBAIV alive keeps running.  If 'vstop' or 'fan'
+        aren't provided they aren't changed.
 
-        self.__thread = CBA4.__worker_thread(self)
-        self.__thread.start()
-        #end do_start_draw()
+        Returns:    \n
+        The CBA4Status heard in response, None if an error.
+        """
+        debug("CBA4.set_load()")
+        if vstop is None:
+            vstop = self.__vstop
+        if fan is not None:
+            self.__fan = fan
+        self.__amps = amps
+        self.__vstop = vstop
+        if not self.get_status_response(CBA4.__new_start_request(amps, vstop, self.__fan)):
+            return None
+        return self.__status
+        #end set_load()
+
+    def set_fan(self, fan):
+        """
+        Set the speed of the fan, 0 (off) to 255.  If a test is running it
+        carries on unchanged, else the fan runs without a test, e.g. to cool
+        the CBAIV down between tests.
+
+        Returns:    \n
+        The CBA4Status heard in response, None if an error.
+        """
+        debug("CBA4.set_fan()")
+        status = self.__status
+        if status and status.is_running():
+            return self.set_load(self.__amps, fan=fan)
+        self.__fan = fan
+        tx = bytearray(16)
+        tx[0] = 0x53
+        tx[1] = 1
+        tx[7] = int(fan) & 0xff
+        if not self.get_status_response(tx):
+            return None
+        return self.__status
+        #end set_fan()
+
+    def get_fan(self):
+        return self.__fan
+        #end get_fan()
 
     def do_stop(self):
         """
         End a running test / current draw.
 
-        Stops the tread started by do_start().
+        Stops the tread started by do_start().  Can be called from that
+        thread, e.g. by a listener or trigger.  The fan is left running, use
+        set_fan(0) to turn it off.
         """
         debug("CBA4.do_stop()")
-        if (self.__thread and self.__thread.is_alive()):
-            self.__thread.stop()
-            self.__thread.join(None)
+        thread = self.__thread
+        if (thread and thread.is_alive()):
+            thread.stop()
+            if thread is not threading.current_thread():
+                thread.join(None)
             self.__thread = None
 
         if (self.is_valid()):
             tx = bytearray(16)
             tx[0] = 0x53
             tx[1] = 1
+            tx[7] = int(self.__fan) & 0xff
             self.get_status_response(tx)
         #end do_stop()
 
@@ -386,105 +694,768 @@ class CBA4:
             return force_rcv
 
         if not force_xmit:
-            force_xmit = bytearray(16)
-            force_xmit[0] = 0x53
-
-        self.__usb_if.write(force_xmit, 1000)
+            force_xmit = CBA4.__new_status_request()
 
-        ok = self.__wait_for(0x73, force_rcv)
+        self.__io_lock.acquire()
+        try:
+            t_sent = time.time()
+            t_start = time.perf_counter()
+            self.__usb_if.write(force_xmit, 1000)
+            ok = self.__wait_for(0x73, force_rcv)
+            rtt = time.perf_counter() - t_start
+        finally:
+            self.__io_lock.release()
 
         if ok:
+            heard = time.perf_counter()
+            status = CBA4Status(force_rcv, t_sent + (rtt / 2.0), rtt)
+            self.__status_cond.acquire()
+            self.__status = status
+            self.__status_heard += 1
+            self.__status_cond.notify_all()
+            self.__status_cond.release()
+            if self.__triggers:
+                with self.__trigger_lock:
+                    fired = [t for t in self.__triggers if t._evaluate(status)]
+                # act outside the lock, do_stop() may wait for the thread
+                # started by do_start(), which could be evaluating triggers
+                for trigger in fired:
+                    try:
+                        trigger._fire(self, status, heard)
+                    except Exception as e:
+                        debug("CBA4 trigger error: " + str(e))
+            for listener in self.__listeners:
+                try:
+                    listener(status)
+                except Exception as e:
+                    debug("CBA4 listener error: " + str(e))
             return force_rcv
 
         return None
         #end get_status_response()
 
-    def get_voltage(self):
+    def get_voltage(self, max_age=None):
         """
-        Returns the measured voltage (float)
+        Returns the measured voltage (float), None if an error.
         """
-        status = self.get_status_response()
-        volts = status[20] + (status[21] * 0x100) + (status[22] * 0x10000) + (status[23] * 0x1000000)
-        volts = float(volts)
-        volts /= (1000.0 * 1000.0)
-        return volts
+        status = self.get_status(max_age)
+        return status.voltage if status else None
         #end get_voltage
 
-    def get_set_current(self):
+    def get_set_current(self, max_age=None):
         """
         Returns the test current (amps, as a float), or 0.0 if a test is not
-        running.
-        """
-        status = self.get_status_response()
-        flags = status[1]
-        if (flags & 0x2) == 0:
-            return 0.0  #test isn't running
-        current = status[3] + (status[4] * 0x100) + (status[5] * 0x10000) + (status[6] * 0x1000000)
-        current = float(current)
-        current /= (1000.0 * 1000.0)
-        return current
+        running.  None if an error.
+        """
+        status = self.get_status(max_age)
+        return status.set_current if status else None
         #end get_set_current()
 
-    def get_measured_current(self):
+    def get_measured_current(self, max_age=None):
         """
         Returns the measured current (amps, as a float).  The feedback of the
         CBA is 10bits for the entire 40 Amps range, so this should not be used
         as an accurate reading.  It can be used to detect gross errors, such
-        as the fuse being blown or the device power limiting the test.
+        as the fuse being blown or the device power limiting the test.  None if
+        an error.
         """
-        status = self.get_status_response()
-        current = status[16] + (status[17] * 0x100) + (status[18] * 0x10000) + (status[19] * 0x1000000)
-        current = float(current)
-        current /= (1000.0 * 1000.0)
-        return current
+        status = self.get_status(max_age)
+        return status.measured_current if status else None
         #end get_measured_current
 
-    def is_running(self):
+    def is_running(self, max_age=None):
         """
         Returns True if a test is currently running and the CBA is drawing
-        current.
+        current.  None if an error.
         """
-        status = self.get_status_response()
-        return ((status[1] & 2) == 2)
+        status = self.get_status(max_age)
+        return status.is_running() if status else None
         #end is_running()
 
-    def is_power_limited(self):
+    def is_power_limited(self, max_age=None):
         """
         Returns True if test is not running to user specified parameters because
-        it has exceeded maximum power or current limits of the device.
+        it has exceeded maximum power or current limits of the device.  None if
+        an error.
         """
-        status = self.get_status_response()
-        return ((status[1] & 0x10) == 0x10)
+        status = self.get_status(max_age)
+        return status.is_power_limited() if status else None
         #end is_power_limited()
 
-    def is_high_temp(self):
+    def is_high_temp(self, max_age=None):
         """
         Returns True if test was aborted because the temperature of the CBA
-        got too high and exceeded safety limits.
+        got too high and exceeded safety limits.  None if an error.
         """
-        status = self.get_status_response()
-        return ((status[1] & 0x20) == 0x20)
+        status = self.get_status(max_age)
+        return status.is_high_temp() if status else None
         #end is_power_limited()
+
+    def get_status(self, max_age=None):
+        """
+        Returns the status of the CBA, all of it decoded.  Use this instead of
+        calling several get_*() / is_*() functions in a row, as each of those
+        may cost a USB transaction.
+
+        Parameters: \n
+        max_age - If the last status heard is older than 'max_age' seconds, a
+        new status message is sent.  If not provided, the latest status heard
+        by the thread started by do_start() is used while a test is running,
+        else the age set by set_max_age() is used.
+
+        Returns:    \n
+        A CBA4Status, None if an error.  CBA4Status.get_age() is how old it is.
+        """
+        if max_age is None:
+            if self.__thread and self.__thread.is_alive():
+                max_age = float("inf")
+            else:
+                max_age = self.__max_age
+        self.__status_cond.acquire()
+        try:
+            heard = self.__status_heard
+            while True:
+                status = self.__status
+                if status and (status.get_age() <= max_age):
+                    return status
+                if not self.__status_querying:
+                    break
+                # another thread is already asking, use its response.  The
+                # timestamp of a response is when it was probably sent, which
+                # can be before this was called, so don't go by that
+                self.__status_cond.wait()
+                status = self.__status
+                if status and (self.__status_heard != heard):
+                    return status
+                #end loop
+            self.__status_querying = True
+        finally:
+            self.__status_cond.release()
+
+        ok = None
+        try:
+            if self.is_valid():
+                ok = self.get_status_response(CBA4.__new_status_request())
+        finally:
+            self.__status_cond.acquire()
+            self.__status_querying = False
+            self.__status_cond.notify_all()
+            self.__status_cond.release()
+        if not ok:
+            return None
+        return self.__status
+        #end get_status()
+
+    @staticmethod
+    def __new_status_request():
+        """
+        Returns a set status (0x53) message that doesn't change any settings,
+        only asks for a status response.
+        """
+        tx = bytearray(16)
+        tx[0] = 0x53
+        return tx
+        #end __new_status_request()
+
+    def set_max_age(self, seconds):
+        """
+        Set how old, in seconds, the last status heard can be before the
+        getters send a new status message.  Only used while a test isn't
+        running and the getter isn't passed its own 'max_age'.  Defaults to 0,
+        a new status message every time.
+        """
+        self.__max_age = seconds
+        #end set_max_age()
+
+    def get_max_age(self):
+        return self.__max_age
+        #end get_max_age()
+
+    def add_listener(self, callback):
+        """
+        Call 'callback(status)' with a CBA4Status every time a status response
+        is heard from the CBA.  While a test is running this will be from the
+        thread started by do_start(), so 'callback' should return quickly.
+        """
+        # copy on write, so the list can be walked without a lock
+        self.__listeners = self.__listeners + [callback]
+        #end add_listener()
+
+    def remove_listener(self, callback):
+        """
+        Stop calling a 'callback' that was passed to add_listener().
+        """
+        self.__listeners = [l for l in self.__listeners if l != callback]
+        #end remove_listener()
+
+    def add_trigger(self, trigger):
+        """
+        Evaluate 'trigger' (a CBA4Trigger) on every status heard from the CBA,
+        including by the thread started by do_start(), before the listeners
+        are called.
+
+        Returns:    \n
+        'trigger'.
+        """
+        with self.__trigger_lock:
+            self.__triggers = self.__triggers + [trigger]
+        return trigger
+        #end add_trigger()
+
+    def remove_trigger(self, trigger):
+        with self.__trigger_lock:
+            self.__triggers = [t for t in self.__triggers if t is not trigger]
+        #end remove_trigger()
+
+    def get_triggers(self):
+        return list(self.__triggers)
+        #end get_triggers()
+
+    def set_poll_policy(self, policy):
+        """
+        Set how often the thread started by do_start() polls the status, e.g.
+        an AdaptivePollPolicy.  None polls every KEEP_ALIVE_INTERVAL.  Takes
+        effect after the next poll.
+        """
+        self.__poll_policy = policy
+        #end set_poll_policy()
+
+    def get_poll_policy(self):
+        return self.__poll_policy
+        #end get_poll_policy()
     #end class CBA4
 
+class CBA4Status:
+    """
+    A decoded status (0x73) response from a CBA4.
+
+    __init__(status_bytes, timestamp, rtt) (Constructor) - Decode
+    'status_bytes'.  'timestamp' is when the status was measured
+    (time.time()), now if not provided.  'rtt' is the round trip time.
+
+    timestamp - When the status was measured, as time.time().  For responses
+    heard by CBA4 this is half way between the status message being sent and
+    the response being heard.
+    rtt - Seconds between the status message being sent and the response
+    being heard, None if not known.
+    flags - Status byte 1.
+    voltage - Measured voltage (float).
+    set_current - Test current (float amps), 0.0 if a test isn't running.
+    measured_current - Measured current (float amps).
+    raw - The status response, a bytearray.
+
+    is_running(), is_power_limited(), is_high_temp() - Same meaning as the
+    CBA4 functions of the same name.
+
+    get_age() - Seconds since the response was heard.
+    """
+    __slots__ = ('timestamp', 'rtt', 'flags', 'voltage', 'set_current', 'measured_current', 'raw')
+
+    def __init__(self, status_bytes, timestamp=None, rtt=None):
+        if timestamp is None:
+            timestamp = time.time()
+        self.timestamp = timestamp
+        self.rtt = rtt
+        self.raw = bytearray(status_bytes)
+        self.flags = status_bytes[1]
+        self.voltage = CBA4Status.__get_u32(status_bytes, 20) / (1000.0 * 1000.0)
+        self.measured_current = CBA4Status.__get_u32(status_bytes, 16) / (1000.0 * 1000.0)
+        if (self.flags & 0x2) == 0:
+            self.set_current = 0.0  #test isn't running
+        else:
+            self.set_current = CBA4Status.__get_u32(status_bytes, 3) / (1000.0 * 1000.0)
+        #end __init__
+
+    @staticmethod
+    def __get_u32(b, offset):
+        return b[offset] + (b[offset+1] * 0x100) + (b[offset+2] * 0x10000) + (b[offset+3] * 0x1000000)
+        #end __get_u32()
+
+    def is_running(self):
+        return ((self.flags & 2) == 2)
+        #end is_running()
+
+    def is_power_limited(self):
+        return ((self.flags & 0x10) == 0x10)
+        #end is_power_limited()
+
+    def is_high_temp(self):
+        return ((self.flags & 0x20) == 0x20)
+        #end is_high_temp()
+
+    def get_age(self):
+        """
+        Returns how many seconds ago this status was measured.
+        """
+        return time.time() - self.timestamp
+        #end get_age()
+
+    def __repr__(self):
+        return "CBA4Status(voltage=" + str(self.voltage) + ", set_current=" + str(self.set_current) + \
+            ", measured_current=" + str(self.measured_current) + ", flags=" + hex(self.flags) + ")"
+        #end __repr__()
+    #end class CBA4Status
+
+class AdaptivePollPolicy:
+    """
+    Polls fast while the status is changing, and backs off while it's steady,
+    for CBA4.set_poll_policy().  Most of a discharge is a flat plateau that
+    needs few samples, while the knee near the end and changes of load need
+    many.
+
+    The interval drops straight to 'min_interval' when:
+      - the voltage changes faster than 'dvdt' volts per second.  The rate is
+        taken over the time the voltage took to move more than 'resolution'
+        volts, so the flicker of the last digits of the reading isn't taken
+        for a change.
+      - the measured current differs from the set current by more than
+        'current_error' amps, while running and not power limited (e.g. a
+        load change settling).
+      - the status flags change from one sample to the next (started,
+        stopped, power limited...).
+    It stays there for 'hold' samples after the last change, then grows by
+    'backoff' times each sample up to 'max_interval'.  The thread started by
+    do_start() never waits more than CBA4.KEEP_ALIVE_INTERVAL, whatever
+    'max_interval' is.
+
+    __init__(min_interval, max_interval, dvdt, current_error, hold, backoff,
+    resolution) (Constructor)
+
+    next_interval(status) - Returns the seconds until the next poll, given
+    the last CBA4Status heard.
+
+    reset() - Forget the samples seen, e.g. at the start of a new test.
+
+    get_stats() - Returns a dict of the current interval, samples seen and
+    how often each condition raised the rate.
+    """
+    def __init__(self, min_interval=0.05, max_interval=0.75, dvdt=0.005, current_error=0.1, hold=10, backoff=1.25,
+            resolution=0.005):
+        if min_interval > max_interval:
+            raise ValueError("min_interval must not be more than max_interval")
+        self.__min_interval = min_interval
+        self.__max_interval = max_interval
+        self.__dvdt = dvdt
+        self.__current_error = current_error
+        self.__hold = hold
+        self.__backoff = backoff
+        self.__resolution = resolution
+        self.__lock = threading.Lock()
+        self.reset()
+        #end __init__
+
+    def reset(self):
+        with self.__lock:
+            self.__last = None
+            # the sample the voltage is measured from, until it moves more
+            # than 'resolution' away
+            self.__anchor = None
+            self.__interval = self.__min_interval
+            self.__held = 0
+            self.__samples = 0
+            self.__by_dvdt = 0
+            self.__by_current = 0
+            self.__by_flags = 0
+        #end reset()
+
+    def next_interval(self, status):
+        """
+        Returns the seconds to wait before the next poll, given 'status', the
+        CBA4Status just heard.
+        """
+        with self.__lock:
+            last = self.__last
+            self.__last = status
+            self.__samples += 1
+            fast = False
+            anchor = self.__anchor
+            moved = (anchor is not None) and (abs(status.voltage - anchor.voltage) > self.__resolution)
+            if (anchor is None) or moved or ((last is not None) and (status.flags != last.flags)):
+                self.__anchor = status
+            if last is not None:
+                dt = status.timestamp - anchor.timestamp
+                if status.flags != last.flags:
+                    fast = True
+                    self.__by_flags += 1
+                elif moved and (dt > 0) and (abs(status.voltage - anchor.voltage) / dt > self.__dvdt):
+                    fast = True
+                    self.__by_dvdt += 1
+                elif status.is_running() and not status.is_power_limited() and \
+                        (abs(status.measured_current - status.set_current) > self.__current_error):
+                    fast = True
+                    self.__by_current += 1
+            if fast:
+                self.__interval = self.__min_interval
+                self.__held = 0
+            elif self.__held < self.__hold:
+                self.__held += 1
+            else:
+                self.__interval = min(self.__interval * self.__backoff, self.__max_interval)
+            return self.__interval
+        #end next_interval()
+
+    def get_stats(self):
+        """
+        Returns a dict of:
+        'interval' - seconds until the next poll.
+        'samples' - samples seen.
+        'by_dvdt', 'by_current', 'by_flags' - times each condition raised the
+        rate.
+        """
+        with self.__lock:
+            return {
+                "interval": self.__interval,
+                "samples": self.__samples,
+                "by_dvdt": self.__by_dvdt,
+                "by_current": self.__by_current,
+                "by_flags": self.__by_flags,
+            }
+        #end get_stats()
+    #end class AdaptivePollPolicy
+
+class CBA4Trigger:
+    """
+    A condition on the status of a CBA4, and what to do when it's met.  Add
+    it to a CBA4 with CBA4.add_trigger(), and it is checked against every
+    status heard, as soon as it is heard.
+
+    The trigger fires when the value goes below 'below' (or above 'above')
+    for 'debounce' samples in a row.  It then won't fire again until the value
+    has come back past the threshold by 'hysteresis', so a value hovering
+    around the threshold doesn't fire it over and over.
+
+    __init__(value, below, above, hysteresis, debounce, stop, set_load,
+    callback, once) (Constructor) - 'value' is the name of a CBA4Status
+    attribute, such as 'voltage', or a function returning a float from a
+    CBA4Status.  When fired, the test is stopped if 'stop' is True, else the
+    load is changed to 'set_load' amps if provided, then
+    'callback(trigger, status)' is called.  If 'once' is True the trigger
+    only ever fires once.
+
+    @staticmethod voltage_below(volts, hysteresis, debounce, ...) - Fires
+    when the voltage drops below 'volts'.
+
+    @staticmethod power_limited(debounce, ...) - Fires when the CBA starts
+    limiting the current (status flag 0x10).
+
+    @staticmethod high_temp(debounce, ...) - Fires when the CBA aborts the
+    test for being too hot (status flag 0x20).
+
+    is_armed() - False once fired, until re-armed by the hysteresis.
+
+    rearm() - Arm the trigger again.
+
+    get_stats() - Returns a dict of how often it fired and the latency from
+    the status being heard to the action being done.
+    """
+    def __init__(self, value, below=None, above=None, hysteresis=0.0, debounce=1,
+            stop=False, set_load=None, callback=None, once=False):
+        if (below is None) == (above is None):
+            raise ValueError("one of 'below' or 'above' must be provided")
+        if isinstance(value, str):
+            attr = value
+            value = lambda status: getattr(status, attr)
+        self.__value = value
+        self.__below = below
+        self.__above = above
+        self.__hysteresis = hysteresis
+        self.__debounce = max(int(debounce), 1)
+        self.__stop = stop
+        self.__set_load = set_load
+        self.__callback = callback
+        self.__once = once
+        self.__armed = True
+        self.__count = 0
+        self.__fired = 0
+        self.__last_status = None
+        self.__last_latency = 0.0
+        self.__max_latency = 0.0
+        self.__total_latency = 0.0
+        #end __init__
+
+    @staticmethod
+    def voltage_below(volts, hysteresis=0.0, debounce=1, **kwargs):
+        return CBA4Trigger("voltage", below=volts, hysteresis=hysteresis, debounce=debounce, **kwargs)
+        #end voltage_below()
+
+    @staticmethod
+    def power_limited(debounce=1, **kwargs):
+        return CBA4Trigger(lambda status: status.flags & 0x10, above=0, debounce=debounce, **kwargs)
+        #end power_limited()
+
+    @staticmethod
+    def high_temp(debounce=1, **kwargs):
+        return CBA4Trigger(lambda status: status.flags & 0x20, above=0, debounce=debounce, **kwargs)
+        #end high_temp()
+
+    def is_armed(self):
+        return self.__armed
+        #end is_armed()
+
+    def rearm(self):
+        self.__armed = True
+        self.__count = 0
+        #end rearm()
+
+    def _evaluate(self, status):
+        """
+        Check 'status'.  Returns True if the trigger fires, then _fire() must
+        be called.
+        """
+        v = self.__value(status)
+        if self.__below is not None:
+            met = v < self.__below
+            clear = v >= (self.__below + self.__hysteresis)
+        else:
+            met = v > self.__above
+            clear = v <= (self.__above - self.__hysteresis)
+        if not self.__armed:
+            if clear and not self.__once:
+                self.rearm()
+            return False
+        if not met:
+            self.__count = 0
+            return False
+        self.__count += 1
+        if self.__count < self.__debounce:
+            return False
+        self.__armed = False
+        self.__count = 0
+        return True
+        #end _evaluate()
+
+    def _fire(self, cba, status, heard):
+        """
+        Do the action for 'status', heard by 'cba' at time.perf_counter()
+        'heard'.
+        """
+        if self.__stop:
+            cba.do_stop()
+        elif self.__set_load is not None:
+            cba.set_load(self.__set_load)
+        latency = time.perf_counter() - heard
+        self.__fired += 1
+        self.__last_status = status
+        self.__last_latency = latency
+        self.__max_latency = max(self.__max_latency, latency)
+        self.__total_latency += latency
+        if self.__callback:
+            self.__callback(self, status)
+        #end _fire()
+
+    def get_stats(self):
+        """
+        Returns a dict of:
+        'fired' - number of times fired.
+        'armed' - see is_armed().
+        'last_status' - the CBA4Status that last fired it, None if never.
+        'last_latency', 'mean_latency', 'max_latency' - seconds from the
+        status that fired it being heard to the stop or set_load being done
+        (the status response to it heard).
+        """
+        return {
+            "fired": self.__fired,
+            "armed": self.__armed,
+            "last_status": self.__last_status,
+            "last_latency": self.__last_latency,
+            "mean_latency": (self.__total_latency / self.__fired) if self.__fired else 0.0,
+            "max_latency": self.__max_latency,
+        }
+        #end get_stats()
+    #end class CBA4Trigger
+
+class CBA4Config:
+    """
+    A decoded config (0x63) response from a CBA4.
+
+    __init__(config_bytes) (Constructor) - Decode 'config_bytes'.
+
+    serial_number - The serial number, written on a sticker on the bottom of
+    the device (bytes 4-7).
+    raw - The config response, a bytes.
+
+    Only the serial number is documented by the CBA IV SDK used by this
+    library.  The other bytes of the response can be read with get_u8(),
+    get_u16() and get_u32().
+
+    to_dict() - Returns a dict that can be saved as JSON.
+
+    @staticmethod from_dict(d) - The reverse of to_dict().
+    """
+    __slots__ = ('raw', 'serial_number')
+
+    def __init__(self, config_bytes):
+        self.raw = bytes(config_bytes)
+        self.serial_number = self.get_u32(4)
+        #end __init__
+
+    def get_u8(self, offset):
+        return self.raw[offset]
+        #end get_u8()
+
+    def get_u16(self, offset):
+        """
+        Returns the little endian 16bit value at 'offset'.
+        """
+        return self.raw[offset] + (self.raw[offset+1] * 0x100)
+        #end get_u16()
+
+    def get_u32(self, offset):
+        """
+        Returns the little endian 32bit value at 'offset'.
+        """
+        return self.raw[offset] + (self.raw[offset+1] * 0x100) + (self.raw[offset+2] * 0x10000) + (self.raw[offset+3] * 0x1000000)
+        #end get_u32()
+
+    def to_dict(self):
+        return {"serial_number": self.serial_number, "raw": self.raw.hex()}
+        #end to_dict()
+
+    @staticmethod
+    def from_dict(d):
+        return CBA4Config(bytes.fromhex(d["raw"]))
+        #end from_dict()
+
+    def __repr__(self):
+        return "CBA4Config(serial_number=" + str(self.serial_number) + ")"
+        #end __repr__()
+    #end class CBA4Config
+
+class CBA4ConfigCache:
+    """
+    Saves the config response of each CBA to a JSON file, by USB path, so a
+    CBA4 opened at the same USB path doesn't need to ask for it again.
+
+    The USB path includes the address the device was given when it was
+    enumerated, which changes every time a device is plugged in, so an entry
+    is only used while the same device stays connected.
+
+    __init__(path, max_age) (Constructor) - Use the cache file 'path', the
+    default of get_default_path() if not provided.  Entries older than
+    'max_age' seconds are ignored, if provided.
+
+    @staticmethod get_default_path() - Returns ~/.cache/wmr_cba/config.json
+
+    get(usb_path) - Returns the cached CBA4Config, None if not cached.
+
+    put(usb_path, config) - Cache 'config' (a CBA4Config).
+
+    clear() - Forget every cached config.
+    """
+    def __init__(self, path=None, max_age=None):
+        if not path:
+            path = CBA4ConfigCache.get_default_path()
+        self.__path = path
+        self.__max_age = max_age
+        self.__lock = threading.Lock()
+        self.__entries = {}
+        self.__mtime = None
+        #end __init__
+
+    @staticmethod
+    def get_default_path():
+        return os.path.join(os.path.expanduser("~"), ".cache", "wmr_cba", "config.json")
+        #end get_default_path()
+
+    def __load(self):
+        """
+        (Re)reads the cache file if it changed, e.g. by another process.
+        """
+        try:
+            mtime = os.path.getmtime(self.__path)
+        except OSError:
+            self.__entries = {}
+            self.__mtime = None
+            return
+        if mtime == self.__mtime:
+            return
+        try:
+            with open(self.__path, "r") as f:
+                self.__entries = json.load(f)
+        except (OSError, ValueError):
+            self.__entries = {}
+        if not isinstance(self.__entries, dict):
+            debug("CBA4ConfigCache ignoring " + self.__path + ", not a JSON object")
+            self.__entries = {}
+        self.__mtime = mtime
+        #end __load()
+
+    def __save(self):
+        try:
+            directory = os.path.dirname(self.__path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            tmp = self.__path + "." + str(os.getpid()) + ".tmp"
+            with open(tmp, "w") as f:
+                json.dump(self.__entries, f)
+            os.replace(tmp, self.__path)
+            self.__mtime = os.path.getmtime(self.__path)
+        except OSError as e:
+            debug("CBA4ConfigCache error: " + str(e))
+        #end __save()
+
+    def get(self, usb_path):
+        """
+        Returns the CBA4Config cached for 'usb_path', None if not cached or
+        too old.
+        """
+        with self.__lock:
+            self.__load()
+            entry = self.__entries.get(usb_path)
+        # the file may have been edited or written by another version, treat
+        # anything malformed as not cached
+        if not isinstance(entry, dict):
+            return None
+        t = entry.get("time")
+        if isinstance(t, bool) or not isinstance(t, (int, float)):
+            return None
+        if self.__max_age is not None and ((time.time() - t) > self.__max_age):
+            return None
+        try:
+            return CBA4Config.from_dict(entry["config"])
+        except (KeyError, ValueError, TypeError, IndexError):
+            return None
+        #end get()
+
+    def put(self, usb_path, config):
+        with self.__lock:
+            self.__load()
+            self.__entries[usb_path] = {"time": time.time(), "config": config.to_dict()}
+            self.__save()
+        #end put()
+
+    def clear(self):
+        with self.__lock:
+            self.__entries = {}
+            self.__save()
+        #end clear()
+    #end class CBA4ConfigCache
+
 class MpOrLibUsb:
     """
     A wrapper that either goes to mpusbapi (mpusbapi.dll) or usb.core (pyusb),
     depending on what the operating system is and what's installed.
 
-    __init__(ifnumber=0) - connect to specified device, based on order it's detected.
+    __init__(ifnumber=0, usb_device=None) - connect to specified device, based on order it's detected.
+    Or if 'usb_device' (a usb.core.Device) is provided, use that device.
     @staticmethod test() - if an error loading libraries, show error message.
     @staticmethod get_device_count() - return number of CBA4s connceted.
+    @staticmethod open_all() - return a MpOrLibUsb for every CBA4 connected.
     isValid() - returns True if we are connected to a CBA4 device.
-    close() - gracefully close connection
+    get_path() - returns a string identifying where the device is connected.
+    @staticmethod get_device_path(usb_device) - same as get_path(), for a usb.core.Device.
+    close(reset=True) - gracefully close connection, resetting a libusb device unless 'reset' is False.
     num = write(bytearray) - write bytes to CBA, returns number of bytes written
     bytearray = read(timeout_ms) - read bytes from CBA, waits 'timeout_ms' duration.
     """
-    def __init__(self, interface_number=0):
+    def __init__(self, interface_number=0, usb_device=None):
         debug("MpOrLibUsb.__init__()")
         self.__handle_read = -1
         self.__handle_write = -1
         self.__usb_dev = None
+        if usb_device:
+            self.__usb_dev = usb_device
+            return
         numMpusb = MpOrLibUsb.__get_device_count_Mpusb()
         if (interface_number < numMpusb):
             # grab from MpUsbApi
@@ -571,6 +1542,34 @@ class MpOrLibUsb:
         return num
         #end get_device_count()
 
+    @staticmethod
+    def open_all():
+        """
+        Opens every matching device, enumerating libusb devices only once
+        (creating a MpOrLibUsb for each interface number enumerates them all
+        each time).
+
+        Returns:    \n
+        An array of MpOrLibUsb, one for each device.
+        """
+        debug("MpOrLibUsb.open_all()")
+        interfaces = []
+        num = MpOrLibUsb.__get_device_count_Mpusb()
+        i = 0
+        while i < num:
+            interfaces.append(MpOrLibUsb(i))
+            i += 1
+        try:
+            devs = usb.core.find(find_all=True, idVendor=0x2405, idProduct=0x0005)
+        except:
+            devs = None
+        if devs:
+            for dev in devs:
+                interfaces.append(MpOrLibUsb(usb_device=dev))
+            devs = None
+        return interfaces
+        #end open_all()
+
     def is_valid(self):
         """
         Checks to see if connection is valid.
@@ -587,9 +1586,37 @@ class MpOrLibUsb:
         return False
         #end valid()
 
-    def close(self):
+    def get_path(self):
         """
-        Gracefully close USB connection to CBA.
+        Returns a string identifying where a libusb device is connected: the
+        bus, the ports leading to it and the address it was given, e.g.
+        'libusb:1-2.3@7'.  The address changes each time the device is
+        plugged in.  Returns None for MPUSBAPI devices, or if not known.
+        """
+        if not self.__usb_dev or not isinstance(self.__usb_dev, usb.core.Device):
+            return None
+        return MpOrLibUsb.get_device_path(self.__usb_dev)
+        #end get_path()
+
+    @staticmethod
+    def get_device_path(usb_device):
+        """
+        Returns the path of a usb.core.Device, see get_path().
+        """
+        try:
+            ports = usb_device.port_numbers
+        except:
+            ports = None
+        if not ports:
+            return None
+        return "libusb:" + str(usb_device.bus) + "-" + ".".join(str(p) for p in ports) + "@" + str(usb_device.address)
+        #end get_device_path()
+
+    def close(self, reset=True):
+        """
+        Gracefully close USB connection to CBA.  A libusb device is reset,
+        unless 'reset' is False, in which case it's only released (use this
+        for a device that may be running a test for someone else).
         """
         debug("MpOrLibUsb.close()")
         if self.__usb_dev and isinstance(self.__usb_dev, MpUsbApi):
@@ -600,7 +1627,10 @@ class MpOrLibUsb:
                 self.__usb_dev.MPUSBClose(self.__handle_write)
                 self.__handle_write = -1
         elif self.__usb_dev and isinstance(self.__usb_dev, usb.core.Device):
-            self.__usb_dev.reset()
+            if reset:
+                self.__usb_dev.reset()
+            else:
+                usb.util.dispose_resources(self.__usb_dev)
         self.__usb_dev = None
         #end close()
 
@@ -612,20 +1642,24 @@ class MpOrLibUsb:
     def write(self, data, timeout_ms=0):
         """
         Write 'data' (bytearray) to CBA4, waits 'timeout_ms' for endpoint to be available for writing (0 is wait forever).
-        Returns number of bytes actually written.
+        Returns number of bytes actually written, 0 or less if an error (such as the device being unplugged).
         """
         if not self.is_valid():
             return 0
-        if isinstance(self.__usb_dev, MpUsbApi):
-            num = self.__usb_dev.MPUSBWrite(self.__handle_write, data, timeout_ms)
-        else:
-            num = self.__usb_dev.write(1, data, timeout_ms)
+        try:
+            if isinstance(self.__usb_dev, MpUsbApi):
+                num = self.__usb_dev.MPUSBWrite(self.__handle_write, data, timeout_ms)
+            else:
+                num = self.__usb_dev.write(1, data, timeout_ms)
+        except usb.core.USBError as e:
+            debug("MpOrLibUsb.write() error: " + str(e))
+            num = 0
         return num
         #end write()
 
     def read(self, timeout_ms=0):
         """
-        Read from CBA4, returns bytearray if success or None if nothing available.  Will wait 'timeout_ms', forever if set to 0.
+        Read from CBA4, returns bytearray if success or None if nothing available or an error.  Will wait 'timeout_ms', forever if set to 0.
         """
         if not self.is_valid():
             return None
@@ -633,11 +1667,17 @@ class MpOrLibUsb:
         if isinstance(self.__usb_dev, MpUsbApi):
             rx = bytearray(65)
             num_read = self.__usb_dev.MPUSBRead(self.__handle_read, rx, timeout_ms)
-            if num_read:
+            if num_read > 0:
                 buf = bytearray(num_read)
                 buf[:] = rx[:num_read]
         else:
-            buf = self.__usb_dev.read(0x81, 64, 0)
+            try:
+                buf = self.__usb_dev.read(0x81, 64, timeout_ms)
+            except usb.core.USBError as e:
+                # includes timeouts, which aren't worth a debug message
+                if not isinstance(e, usb.core.USBTimeoutError):
+                    debug("MpOrLibUsb.read() error: " + str(e))
+                buf = None
         return buf
         #end read()
     #end class MpOrLibUsb
@@ -0,0 +1,442 @@
+"""
+    SUMMARY:
+
+    Streaming writers that save CBA4 status samples to data files.
+
+    Samples are queued by write() without blocking, and written in chunks by
+    a background thread, so disk I/O never stalls the thread sampling the
+    CBA.  The queue is bounded; if the disk can't keep up, samples are
+    dropped and counted rather than using unbounded memory.  Files can be
+    rotated by number of rows, size or age, for multi-day runs.  Written
+    data is flushed to disk at most once every flush_interval, not after
+    every chunk.
+
+    AVAILABLE CLASSES:
+
+    SampleWriter - Base class with the queueing, flushing and rotation.
+
+    CSVSampleWriter - Writes buffered CSV files.
+
+    ParquetSampleWriter - Writes Parquet files, one row group per chunk.
+    Needs pyarrow to be installed.
+
+    Example:
+
+        cba = wmr_cba.CBA4()
+        writer = writers.CSVSampleWriter("discharge.csv", rotate_seconds=3600)
+        writer.attach(cba)
+        cba.do_start(1.0, 10.5)
+        ...
+        cba.do_stop()
+        writer.close()
+"""
+# Copyright (c) 2025 - Darren Rook (da66en) (route66@gmail.com)
+# Rights to use this code is made available using the MIT license.
+
+import abc
+import csv
+import io
+import os
+import queue
+import re
+import threading
+import time
+from wmr_cba.wmr_cba import debug
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+class SampleWriter(abc.ABC):
+    """
+    Base class for the writers.  Subclasses implement _open_file(),
+    _write_chunk(), _get_file_size() and _close_file(), and can implement
+    _flush_file().
+
+    __init__(path, ...) (Constructor) - Start writing to 'path'.  See the
+    constructor for the chunking and rotation parameters.  The first file
+    is opened by the constructor, so an error opening it (e.g. OSError for
+    a missing directory) is raised to the caller.
+
+    write(status, serial) - Queue a CBA4Status to be written.  Never blocks.
+    Returns False if the sample was dropped because the queue is full, or
+    because writing has failed (see get_error()).
+
+    attach(cba) - Write every status heard by a CBA4 (see CBA4.add_listener()).
+
+    detach(cba) - Stop writing the status of a CBA4 passed to attach().
+
+    close() - Write everything still queued, and close the file.  Raises
+    the error that stopped the writing, if there was one.
+
+    get_rows_written() - Returns number of rows written to disk.
+
+    get_dropped() - Returns number of samples dropped because the queue was
+    full.
+
+    get_files() - Returns the list of files written, in order.
+
+    get_error() - Returns the exception that stopped the writing, None if
+    there wasn't one.  Once writing fails, every sample after is dropped.
+    """
+    COLUMNS = ["timestamp", "serial", "voltage", "set_current", "measured_current", "flags"]
+
+    def __init__(self, path, chunk_size=1000, max_queue=100000, flush_interval=1.0,
+            rotate_rows=None, rotate_bytes=None, rotate_seconds=None):
+        """
+        Parameters: \n
+        path - File to write.  If any of the 'rotate_' parameters are used, a
+        4 digit file number is added before the extension, e.g. 'log.csv'
+        becomes 'log-0000.csv', 'log-0001.csv', ...  Numbering continues
+        after the highest numbered file already there, so restarting a run
+        never overwrites its earlier files.  Without rotation, 'path' is
+        replaced if it exists.
+        chunk_size - Maximum number of samples written at once.
+        max_queue - Maximum number of samples waiting to be written.  This
+        bounds the memory used if the disk can't keep up.
+        flush_interval - Seconds to wait for a full chunk before writing a
+        partial one, and between flushes of the file to disk.
+        rotate_rows - Start a new file after this many rows.
+        rotate_bytes - Start a new file once the file reaches this size.
+        rotate_seconds - Start a new file after this many seconds.
+        """
+        debug("SampleWriter.__init__()")
+        self.__path = path
+        self.__chunk_size = chunk_size
+        self.__flush_interval = flush_interval
+        self.__rotate_rows = rotate_rows
+        self.__rotate_bytes = rotate_bytes
+        self.__rotate_seconds = rotate_seconds
+        self.__rotating = bool(rotate_rows or rotate_bytes or rotate_seconds)
+        self.__queue = queue.Queue(max_queue)
+        self.__listeners = {}
+        self.__dropped = 0
+        self.__rows_written = 0
+        self.__file_rows = 0
+        self.__file_opened = 0
+        self.__files = []
+        self.__first_number = self.__get_last_number() + 1
+        self.__is_open = False
+        self.__unflushed = False
+        self.__last_flush = time.monotonic()
+        self.__error = None
+        self.__closing = False
+        self.__open_next()
+        self.__thread = threading.Thread(target=self.__run, daemon=True)
+        self.__thread.start()
+        #end __init__
+
+    def write(self, status, serial=0):
+        """
+        Queue 'status' (a CBA4Status) to be written by the background thread.
+        'serial' is the serial number of the CBA it came from.
+
+        Returns:    \n
+        True if queued, False if it was dropped because the queue is full.
+        """
+        if self.__error:
+            self.__dropped += 1
+            return False
+        row = (status.timestamp, serial, status.voltage, status.set_current, status.measured_current, status.flags)
+        try:
+            self.__queue.put_nowait(row)
+        except queue.Full:
+            self.__dropped += 1
+            return False
+        return True
+        #end write()
+
+    def attach(self, cba):
+        """
+        Write every status heard by 'cba' (a CBA4), labelled with its serial
+        number.
+        """
+        serial = cba.get_serial_number()
+        listener = lambda status: self.write(status, serial)
+        self.__listeners[id(cba)] = listener
+        cba.add_listener(listener)
+        #end attach()
+
+    def detach(self, cba):
+        listener = self.__listeners.pop(id(cba), None)
+        if listener:
+            cba.remove_listener(listener)
+        #end detach()
+
+    def close(self):
+        """
+        Write everything still queued, then close the file.  Call detach()
+        first, or stop the test, else samples heard after this are dropped.
+        """
+        debug("SampleWriter.close()")
+        if not self.__closing:
+            self.__closing = True
+            self.__queue.put(None)
+            self.__thread.join()
+        if self.__error:
+            raise self.__error
+        #end close()
+
+    def get_rows_written(self):
+        return self.__rows_written
+        #end get_rows_written()
+
+    def get_dropped(self):
+        return self.__dropped
+        #end get_dropped()
+
+    def get_files(self):
+        return list(self.__files)
+        #end get_files()
+
+    def get_error(self):
+        return self.__error
+        #end get_error()
+
+    def __get_last_number(self):
+        """
+        Returns the highest file number of the rotated files already in the
+        directory, -1 if there are none.
+        """
+        if not self.__rotating:
+            return -1
+        base, ext = os.path.splitext(self.__path)
+        directory, name = os.path.split(base)
+        pattern = re.compile(re.escape(name) + r"-(\d{4,})" + re.escape(ext) + "$")
+        last = -1
+        try:
+            names = os.listdir(directory or ".")
+        except OSError:
+            return -1
+        for existing in names:
+            match = pattern.match(existing)
+            if match:
+                last = max(last, int(match.group(1)))
+        return last
+        #end __get_last_number()
+
+    def __next_path(self):
+        if not self.__rotating:
+            return self.__path
+        base, ext = os.path.splitext(self.__path)
+        return base + "-" + ("%04d" % (self.__first_number + len(self.__files))) + ext
+        #end __next_path()
+
+    def __open_next(self):
+        path = self.__next_path()
+        self._open_file(path)
+        self.__files.append(path)
+        self.__file_rows = 0
+        self.__file_opened = time.time()
+        self.__last_flush = time.monotonic()
+        self.__is_open = True
+        #end __open_next()
+
+    def __close_current(self):
+        self.__is_open = False
+        self.__unflushed = False
+        self._close_file()
+        #end __close_current()
+
+    def __rotate_due(self):
+        if self.__rotate_rows and (self.__file_rows >= self.__rotate_rows):
+            return True
+        if self.__rotate_seconds and ((time.time() - self.__file_opened) >= self.__rotate_seconds):
+            return True
+        if self.__rotate_bytes and (self._get_file_size() >= self.__rotate_bytes):
+            return True
+        return False
+        #end __rotate_due()
+
+    def __write_rows(self, rows):
+        while rows:
+            if self.__is_open and self.__rotate_due():
+                self.__close_current()
+            if not self.__is_open:
+                self.__open_next()
+            chunk = rows
+            if self.__rotate_rows:
+                chunk = rows[:self.__rotate_rows - self.__file_rows]
+            self._write_chunk(chunk)
+            self.__unflushed = True
+            self.__file_rows += len(chunk)
+            self.__rows_written += len(chunk)
+            rows = rows[len(chunk):]
+        #end __write_rows()
+
+    def __run(self):
+        done = False
+        while not done:
+            rows = []
+            deadline = time.monotonic() + self.__flush_interval
+            while len(rows) < self.__chunk_size:
+                remain = deadline - time.monotonic()
+                try:
+                    if remain > 0:
+                        row = self.__queue.get(True, remain)
+                    else:
+                        row = self.__queue.get_nowait()
+                except queue.Empty:
+                    break
+                if row is None:
+                    done = True
+                    break
+                rows.append(row)
+            written = self.__rows_written
+            try:
+                if rows and self.__error:
+                    self.__dropped += len(rows)
+                elif rows:
+                    self.__write_rows(rows)
+                if self.__unflushed and ((time.monotonic() - self.__last_flush) >= self.__flush_interval):
+                    self._flush_file()
+                    self.__unflushed = False
+                    self.__last_flush = time.monotonic()
+            except Exception as e:
+                # stop writing rather than carry on with a file in an unknown state
+                debug("SampleWriter error: " + str(e))
+                self.__error = e
+                self.__dropped += len(rows) - (self.__rows_written - written)
+        try:
+            if self.__is_open:
+                self.__close_current()
+        except Exception as e:
+            debug("SampleWriter error: " + str(e))
+            self.__error = self.__error or e
+        #end __run()
+
+    @abc.abstractmethod
+    def _open_file(self, path):
+        """
+        Open 'path' for writing, replacing any file already there.
+        """
+        #end _open_file()
+
+    @abc.abstractmethod
+    def _write_chunk(self, rows):
+        """
+        Write 'rows', a list of tuples in the order of COLUMNS.
+        """
+        #end _write_chunk()
+
+    def _flush_file(self):
+        """
+        Write anything buffered to disk.  Called at most once every
+        flush_interval.  Does nothing by default.
+        """
+        #end _flush_file()
+
+    @abc.abstractmethod
+    def _get_file_size(self):
+        """
+        Returns the size of the open file, in bytes, as written so far.
+        """
+        #end _get_file_size()
+
+    @abc.abstractmethod
+    def _close_file(self):
+        """
+        Write anything buffered and close the file.
+        """
+        #end _close_file()
+    #end class SampleWriter
+
+class CSVSampleWriter(SampleWriter):
+    """
+    Writes samples to CSV files, with a header row naming the columns (see
+    SampleWriter.COLUMNS).
+
+    __init__(path, buffer_size, ...) (Constructor) - Same as SampleWriter,
+    'buffer_size' is the size of the file's write buffer.
+    """
+    def __init__(self, path, buffer_size=1024*1024, **kwargs):
+        self.__buffer_size = buffer_size
+        self.__file = None
+        self.__size = 0
+        SampleWriter.__init__(self, path, **kwargs)
+        #end __init__
+
+    def __write_rows(self, rows):
+        # format the rows in memory and write them as one block, counting the
+        # bytes, as tell() on a text file would flush the buffer each chunk
+        text = io.StringIO()
+        csv.writer(text).writerows(rows)
+        data = text.getvalue().encode("utf-8")
+        self.__file.write(data)
+        self.__size += len(data)
+        #end __write_rows()
+
+    def _open_file(self, path):
+        self.__file = open(path, "wb", buffering=self.__buffer_size)
+        self.__size = 0
+        self.__write_rows([SampleWriter.COLUMNS])
+        #end _open_file()
+
+    def _write_chunk(self, rows):
+        self.__write_rows(rows)
+        #end _write_chunk()
+
+    def _flush_file(self):
+        self.__file.flush()
+        #end _flush_file()
+
+    def _get_file_size(self):
+        return self.__size
+        #end _get_file_size()
+
+    def _close_file(self):
+        file = self.__file
+        self.__file = None
+        file.close()
+        #end _close_file()
+    #end class CSVSampleWriter
+
+class ParquetSampleWriter(SampleWriter):
+    """
+    Writes samples to Parquet files, each chunk is written as one row group.
+    Raises ImportError if pyarrow is not installed.
+
+    __init__(path, compression, ...) (Constructor) - Same as SampleWriter,
+    'compression' is the Parquet compression codec.
+    """
+    def __init__(self, path, compression="snappy", **kwargs):
+        if not pyarrow:
+            raise ImportError("ParquetSampleWriter needs pyarrow, which is missing or not installed!")
+        self.__compression = compression
+        self.__schema = pyarrow.schema([
+            ("timestamp", pyarrow.float64()),
+            ("serial", pyarrow.uint32()),
+            ("voltage", pyarrow.float64()),
+            ("set_current", pyarrow.float64()),
+            ("measured_current", pyarrow.float64()),
+            ("flags", pyarrow.uint8()),
+        ])
+        self.__path = None
+        self.__writer = None
+        SampleWriter.__init__(self, path, **kwargs)
+        #end __init__
+
+    def _open_file(self, path):
+        self.__path = path
+        self.__writer = pyarrow.parquet.ParquetWriter(path, self.__schema, compression=self.__compression)
+        #end _open_file()
+
+    def _write_chunk(self, rows):
+        columns = list(zip(*rows))
+        arrays = [pyarrow.array(columns[i], type=self.__schema.field(i).type) for i in range(len(columns))]
+        table = pyarrow.Table.from_arrays(arrays, schema=self.__schema)
+        self.__writer.write_table(table, row_group_size=len(rows))
+        #end _write_chunk()
+
+    def _get_file_size(self):
+        # row groups are written out as each chunk is written
+        return os.path.getsize(self.__path)
+        #end _get_file_size()
+
+    def _close_file(self):
+        self.__writer.close()
+        self.__writer = None
+        #end _close_file()
+    #end class ParquetSampleWriter